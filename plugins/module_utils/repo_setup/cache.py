@@ -0,0 +1,205 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+
+try:
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
+
+__metaclass__ = type
+
+DEFAULT_CACHE_DIR = "/var/cache/repo-setup"
+# Entries not used for this many seconds are evicted
+DEFAULT_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+# Oldest entries are evicted once the cache grows over this many bytes
+DEFAULT_CACHE_MAX_SIZE = 50 * 1024 * 1024
+
+BODY_SUFFIX = ".body"
+META_SUFFIX = ".json"
+
+
+class HttpCache:
+    """
+    On-disk cache of downloaded files keyed by URL. Each entry stores the
+    response body together with the ETag and Last-Modified headers the
+    server sent, so later downloads of the same URL can be turned into
+    conditional requests and answered with a 304 Not Modified.
+
+    A read only cache serves the entries it has but never changes them.
+    """
+
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        max_age=DEFAULT_CACHE_MAX_AGE,
+        max_size=DEFAULT_CACHE_MAX_SIZE,
+        read_only=False,
+    ):
+        """Create a HttpCache object, creating cache_dir if needed.
+
+        :param cache_dir: Directory that holds the cache entries.
+        :param max_age: Seconds after the last use of an entry that it is
+            evicted.
+        :param max_size: Total size in bytes of the cache entries that
+            triggers eviction of the least recently used ones.
+        :param read_only: Never write to cache_dir. An existing cache_dir
+            that is not writable, e.g. the default one for a regular user,
+            makes the cache read only too.
+        :raises OSError if the cache directory can not be created.
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_size = max_size
+        self.read_only = read_only
+        if read_only:
+            return
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        elif not os.access(cache_dir, os.W_OK):
+            logging.debug("Using the cache in %s read only, it is not "
+                          "writable", cache_dir)
+            self.read_only = True
+
+    def _entry_path(self, url, suffix):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _read_meta(self, url):
+        try:
+            with open(self._entry_path(url, META_SUFFIX), "r") as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return meta
+
+    def conditional_headers(self, url):
+        """Return the request headers to revalidate the cached url.
+
+        :return: dict with If-None-Match and/or If-Modified-Since, empty if
+            url is not cached.
+        """
+        meta = self._read_meta(url)
+        if not meta or not os.path.isfile(self._entry_path(url, BODY_SUFFIX)):
+            return {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def get(self, url):
+        """Return the cached content of url or None if it is not cached."""
+        body_path = self._entry_path(url, BODY_SUFFIX)
+        try:
+            with io.open(body_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except (IOError, OSError):
+            return None
+        if not self.read_only:
+            # Refresh the entry mtime, used as last access time for eviction
+            try:
+                os.utime(body_path, None)
+            except OSError:
+                pass
+        logging.debug("Using cached copy of %s", url)
+        return content
+
+    def store(self, url, content, headers):
+        """Store content of url along with its validator headers.
+
+        Nothing is stored if the server did not send an ETag or a
+        Last-Modified header since the entry could never be revalidated.
+
+        :param url: The downloaded url.
+        :param content: Response body as text.
+        :param headers: Case insensitive mapping of response headers.
+        """
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "stored": time.time(),
+        }
+        if self.read_only or (not meta["etag"] and not meta["last_modified"]):
+            return
+        try:
+            # The cache can always be refilled, don't pay for fsync
+            repos_utils.atomic_write(
+                self._entry_path(url, BODY_SUFFIX), content, durability="none"
+            )
+            repos_utils.atomic_write(
+                self._entry_path(url, META_SUFFIX),
+                json.dumps(meta),
+                durability="none",
+            )
+        except (IOError, OSError) as e:
+            # Warn once, not for every url of the run
+            logging.warning("Unable to cache %s, not caching anything more: "
+                            "%s", url, e)
+            self.read_only = True
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until
+        the cache fits in max_size.
+
+        :return: number of evicted entries.
+        """
+        if self.read_only:
+            return 0
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(BODY_SUFFIX):
+                continue
+            key = file_name[: -len(BODY_SUFFIX)]
+            body_path = os.path.join(self.cache_dir, file_name)
+            meta_path = os.path.join(self.cache_dir, key + META_SUFFIX)
+            try:
+                body_stat = os.stat(body_path)
+                size = body_stat.st_size
+                if os.path.exists(meta_path):
+                    size += os.path.getsize(meta_path)
+            except OSError:
+                continue
+            entries.append((body_stat.st_mtime, size, body_path, meta_path))
+
+        # least recently used first
+        entries.sort()
+        now = time.time()
+        total_size = sum(entry[1] for entry in entries)
+        evicted = 0
+        for mtime, size, body_path, meta_path in entries:
+            if now - mtime <= self.max_age and total_size <= self.max_size:
+                continue
+            for file_path in (body_path, meta_path):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            total_size -= size
+            evicted += 1
+        if evicted:
+            logging.debug("Evicted %d entries from %s", evicted, self.cache_dir)
+        return evicted
@@ -15,11 +15,123 @@
 #
 
 import argparse
+import itertools
 import json
 import logging
+import os
+import subprocess
 import sys
 from repo_setup.utils import load_logging
+import repo_setup.timing as repos_timing
 from repo_setup.get_hash.hash_info import HashInfo
+from repo_setup.get_hash import dlrn_api
+from repo_setup.get_hash import hash_info
+from repo_setup.get_hash import watch
+
+# Hash resolution backends, see --backend
+BACKENDS = {
+    "files": hash_info.iter_resolved,
+    "api": dlrn_api.iter_resolved,
+}
+
+# Dimensions of the matrix mode, as (argument dest, query key)
+MATRIX_DIMENSIONS = [
+    ("os_version", "os_version"),
+    ("release", "release"),
+    ("component", "component"),
+    ("tag", "tag"),
+]
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _load_query_file(path):
+    """Loads a JSON or YAML list of queries, '-' reads it from stdin"""
+    if path == "-":
+        content = sys.stdin.read()
+    else:
+        with open(path, "r") as f:
+            content = f.read()
+    try:
+        queries = json.loads(content)
+    except ValueError:
+        queries = HashInfo.load_yaml(content)
+    if not isinstance(queries, list) or not all(
+        isinstance(q, dict) for q in queries
+    ):
+        raise ValueError("The query file must contain a list of queries")
+    return queries
+
+
+def _matrix_queries(args):
+    """Builds the queries of the cartesian product of all dimensions"""
+    dimensions = [_as_list(getattr(args, dest)) for dest, _ in MATRIX_DIMENSIONS]
+    for values in itertools.product(*dimensions):
+        query = dict(zip([key for _, key in MATRIX_DIMENSIONS], values))
+        query["dlrn_hash_tag"] = args.dlrn_hash_tag
+        yield query
+
+
+def _get_queries(args):
+    if args.query_file:
+        return _load_query_file(args.query_file)
+    return list(_matrix_queries(args))
+
+
+def _run_matrix(args, config):
+    """Resolves all queries and prints one JSON line per result as soon as
+    it is available. Failed queries are printed with an 'error' key and
+    make the command exit with a non-zero status.
+    """
+    queries = _get_queries(args)
+    results = []
+    for query, result in BACKENDS[args.backend](
+        queries, config=config, workers=args.workers
+    ):
+        if isinstance(result, Exception):
+            data = dict((k, query.get(k)) for k in hash_info.QUERY_KEYS)
+            data["error"] = str(result)
+        else:
+            data = result.to_dict()
+        print(json.dumps(data))
+        sys.stdout.flush()
+        results.append(result)
+    return results
+
+
+def _emit_event(event, exec_hook=None):
+    """Prints a change event as a JSON line and runs exec_hook, if any,
+    with the event as JSON on its stdin and its hashes in the environment.
+    """
+    data = json.dumps(event)
+    print(data)
+    sys.stdout.flush()
+    if exec_hook:
+        env = dict(os.environ)
+        for key, value in event.items():
+            env["REPO_SETUP_" + key.upper()] = "" if value is None else str(value)
+        proc = subprocess.Popen(exec_hook, shell=True, stdin=subprocess.PIPE, env=env)
+        proc.communicate(data.encode("utf-8"))
+        if proc.returncode != 0:
+            logging.warning(
+                "Hook '%s' exited with code %d", exec_hook, proc.returncode
+            )
+
+
+def _run_watch(args, config):
+    """Polls the queries forever, printing a JSON line for every change"""
+    watcher = watch.HashWatcher(
+        _get_queries(args),
+        config=config,
+        interval=args.interval,
+        max_interval=args.max_interval,
+        on_change=lambda event: _emit_event(event, args.exec_hook),
+    )
+    return watcher.run()
 
 
 def main():
@@ -28,6 +140,7 @@ def main():
     parser = argparse.ArgumentParser(description="repo-setup-get-hash.py")
     parser.add_argument(
         "--component",
+        nargs="+",
         help=("Use this to specify a component " "This is NOT valid for Centos 7."),
         choices=config["repo_setup_ci_components"],
     )
@@ -35,23 +148,28 @@ def main():
         "--dlrn-url",
         help=(
             "The URL for the delorean server to use. Defaults to "
-            "https://trunk.rdoproject.org"
+            "https://trunk.rdoproject.org. A comma separated list of "
+            "equivalent servers may be given in order of preference, a slow "
+            "or failing server is then hedged with the next one."
         ),
     )
     parser.add_argument(
         "--os-version",
+        nargs="+",
         default="centos8",
         choices=config["os_versions"],
         help=("The operating system and version to fetch the build tag for"),
     )
     parser.add_argument(
         "--tag",
+        nargs="+",
         default="current-podified",
         choices=config["rdo_named_tags"],
         help=("The known tag to retrieve the hash_info for"),
     )
     parser.add_argument(
         "--release",
+        nargs="+",
         default="master",
         help=("The release of OpenStack you want the hash info for. " "Default master"),
         choices=config["repo_setup_releases"],
@@ -71,8 +189,107 @@ def main():
         default=None,
         help=("Pass a particular dlrn hash tag"),
     )
+    parser.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default=None,
+        help=(
+            "How to resolve hashes: 'files' fetches the commit.yaml or "
+            "delorean.repo.md5 file of each query, 'api' asks the promotions "
+            "endpoint of the DLRN API for many components at once and falls "
+            "back to 'files' for the queries it can't answer. Defaults to "
+            "'files', the only backend of --watch mode"
+        ),
+    )
+    parser.add_argument(
+        "--matrix",
+        action="store_true",
+        help=(
+            "Resolve every combination of the given --os-version, --release, "
+            "--component and --tag values concurrently and print one JSON "
+            "line per result as soon as it is available"
+        ),
+    )
+    parser.add_argument(
+        "--query-file",
+        default=None,
+        help=(
+            "JSON or YAML file with a list of queries to resolve in matrix "
+            "mode, each with os_version, release, component, tag and "
+            "dlrn_hash_tag keys. Use '-' to read it from stdin"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep polling the given queries, which accept several values "
+            "like in --matrix mode, and print a JSON line every time the "
+            "full_hash of one of them changes"
+        ),
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=watch.DEFAULT_INTERVAL,
+        help=("Seconds between polls right after a change in --watch mode"),
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=watch.DEFAULT_MAX_INTERVAL,
+        help=(
+            "The polling interval doubles up to this many seconds while "
+            "nothing changes in --watch mode"
+        ),
+    )
+    parser.add_argument(
+        "--exec",
+        dest="exec_hook",
+        default=None,
+        help=(
+            "Shell command run on every change in --watch mode, with the "
+            "event as JSON on its stdin and REPO_SETUP_<KEY> environment "
+            "variables, e.g. REPO_SETUP_FULL_HASH"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=hash_info.DEFAULT_WORKERS,
+        help=("Maximum number of concurrent queries in matrix mode"),
+    )
+    parser.add_argument(
+        "--timings",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Write a JSON report of the time spent in each HTTP request to "
+            "PATH, '-' for stderr. Defaults to the %s environment variable"
+            % repos_timing.TIMINGS_ENV
+        ),
+    )
 
     args = parser.parse_args()
+    if args.query_file and not args.watch:
+        args.matrix = True
+    if args.matrix and args.watch:
+        parser.error("--matrix and --watch are mutually exclusive")
+    if not args.matrix and not args.watch:
+        for dest, _ in MATRIX_DIMENSIONS:
+            values = _as_list(getattr(args, dest))
+            if len(values) > 1:
+                parser.error(
+                    "--%s accepts several values only with --matrix"
+                    % dest.replace("_", "-")
+                )
+            setattr(args, dest, values[0])
+    if args.watch and args.backend is not None:
+        # conditional requests only make sense for the per query files
+        parser.error("--backend is not supported with --watch")
+    args.backend = args.backend or "files"
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -86,7 +303,18 @@ def main():
         config["dlrn_url"] = args.dlrn_url
         logging.debug("Proceeding with the following configuration: {}".format(config))
 
-    repo_setup_hash_info = HashInfo(
+    with repos_timing.recording("repo-setup-get-hash", args.timings):
+        return _resolve(args, config)
+
+
+def _resolve(args, config):
+    if args.matrix:
+        return _run_matrix(args, config)
+    if args.watch:
+        return _run_watch(args, config)
+
+    resolve = dlrn_api.resolve if args.backend == "api" else HashInfo
+    repo_setup_hash_info = resolve(
         args.os_version,
         args.release,
         args.component,
@@ -95,27 +323,23 @@ def main():
         config,
     )
     if args.json:
-        dict_data = {"commit_hash": repo_setup_hash_info.commit_hash,
-                     "distro_hash": repo_setup_hash_info.distro_hash,
-                     "full_hash": repo_setup_hash_info.full_hash,
-                     "extended_hash": repo_setup_hash_info.extended_hash,
-                     "dlrn_url": repo_setup_hash_info.dlrn_url,
-                     "dlrn_api_url": repo_setup_hash_info.dlrn_api_url,
-                     "os_version": repo_setup_hash_info.os_version,
-                     "release": repo_setup_hash_info.release,
-                     "component": repo_setup_hash_info.component,
-                     "tag": repo_setup_hash_info.tag}
-
+        dict_data = repo_setup_hash_info.to_dict()
         print(json.dumps(dict_data))
     else:
         print(repo_setup_hash_info)
         return repo_setup_hash_info
 
 
+def _exit_code(result):
+    """Returns 1 when any query of the matrix mode failed, 0 otherwise"""
+    if isinstance(result, list) and any(isinstance(r, Exception) for r in result):
+        return 1
+    return 0
+
+
 def cli_entrypoint():
     try:
-        main()
-        sys.exit(0)
+        sys.exit(_exit_code(main()))
     except KeyboardInterrupt:
         logging.info("Exiting on user interrupt")
         raise
@@ -0,0 +1,175 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+#
+"""asyncio API to resolve hash info without blocking the event loop.
+
+The requests to the delorean server are run in the default executor of the
+running loop, so only the standard library is needed. Python 3 only.
+"""
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+from . import hash_info as hash_info_mod
+from .hash_info import HashInfo, QUERY_KEYS
+
+try:
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
+
+__metaclass__ = type
+
+# Default number of concurrent requests sent to the same delorean server
+DEFAULT_PER_HOST_LIMIT = 4
+
+
+class HostLimiter:
+    """Bounds the number of concurrent requests sent to each host.
+
+    A limiter must be used from a single event loop.
+    """
+
+    def __init__(self, per_host_limit=DEFAULT_PER_HOST_LIMIT):
+        if per_host_limit < 1:
+            raise ValueError("per_host_limit must be at least 1")
+        self.per_host_limit = per_host_limit
+        self._semaphores = {}
+
+    def for_url(self, url):
+        """Returns the semaphore of the host of url"""
+        host = urlparse(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._semaphores[host]
+
+
+async def _get(url, limiter):
+    """GETs url in the default executor of the running loop, holding a slot
+    of the host of url when a limiter is given.
+
+    :returns (response text, status code)
+    """
+    loop = asyncio.get_running_loop()
+    start = time.time()
+    if limiter is None:
+        result = await loop.run_in_executor(None, hash_info_mod.http_get, url)
+    else:
+        async with limiter.for_url(url):
+            start = time.time()
+            result = await loop.run_in_executor(None, hash_info_mod.http_get, url)
+    if result[1] == 200:
+        repos_utils.record_latency(url, time.time() - start)
+    return result
+
+
+async def _hedged_get(urls, limiter):
+    """Async counterpart of utils.http_get_mirrors.
+
+    The GET of urls[0] is started first, the next url is also requested
+    when it has not answered within utils.hedge_delay() or as soon as it
+    fails. Each GET takes a limiter slot of its own host. The first 200
+    response wins and the GETs still running are cancelled.
+
+    :returns (url, (response text, status code)) of the winning GET, or of
+        the last one to answer when none returned 200
+    :raises the exception of the last failed GET if every GET raised
+    """
+    pending = {}
+    remaining = list(urls)
+    latest = None
+    failure = None
+    while pending or remaining:
+        if remaining and not pending:
+            latest = remaining.pop(0)
+            pending[asyncio.ensure_future(_get(latest, limiter))] = latest
+        timeout = repos_utils.hedge_delay(latest) if remaining else None
+        done, __ = await asyncio.wait(
+            pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            latest = remaining.pop(0)
+            logging.debug("Hedging request to %s", latest)
+            pending[asyncio.ensure_future(_get(latest, limiter))] = latest
+            continue
+        for task in done:
+            url = pending.pop(task)
+            try:
+                result = task.result()
+            except Exception as e:
+                logging.debug("Request to %s failed: %s", url, e)
+                failure = (url, e)
+                continue
+            if result[1] == 200:
+                for other in pending:
+                    other.cancel()
+                return url, result
+            failure = (url, result)
+
+    url, result = failure
+    if isinstance(result, Exception):
+        raise result
+    return url, result
+
+
+async def create(
+    os_version, release, component, tag, dlrn_hash_tag=None, config=None, limiter=None
+):
+    """Async counterpart of the HashInfo constructor.
+
+    Mirrors listed in the dlrn_url of the config are hedged in like in the
+    constructor. Each request counts against the limiter of the host it is
+    sent to.
+
+    :param limiter: HostLimiter shared between concurrent calls, defaults to
+        no limit
+    :raises HashInvalidDLRNResponse like the HashInfo constructor
+    :returns a resolved HashInfo object
+    """
+    hash_info = HashInfo.unresolved(
+        os_version, release, component, tag, dlrn_hash_tag, config
+    )
+    urls = hash_info.mirror_urls()
+    url, (response, status) = await _hedged_get(urls, limiter)
+    hash_info.use_mirror(hash_info.mirrors()[urls.index(url)])
+    hash_info.parse_response(response, status)
+    return hash_info
+
+
+async def resolve_many(
+    queries, config=None, per_host_limit=DEFAULT_PER_HOST_LIMIT, return_exceptions=True
+):
+    """Resolves many queries concurrently.
+
+    :param queries: iterable of dicts with hash_info.QUERY_KEYS, a missing
+        key is None
+    :param config: config dictionary shared by all queries
+    :param per_host_limit: maximum number of concurrent requests per host
+    :param return_exceptions: return the exception of a failed query in its
+        place instead of raising it, like asyncio.gather
+    :returns list of HashInfo objects in the order of queries
+    """
+    config = HashInfo.load_config(config)
+    limiter = HostLimiter(per_host_limit)
+    return await asyncio.gather(
+        *[
+            create(*[query.get(k) for k in QUERY_KEYS], config=config, limiter=limiter)
+            for query in queries
+        ],
+        return_exceptions=return_exceptions
+    )
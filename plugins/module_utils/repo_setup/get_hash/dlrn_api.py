@@ -0,0 +1,217 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+#
+"""Hash resolution backed by the promotions endpoint of the DLRN API.
+
+A single GET of <dlrn_api_url>/api/promotions?promote_name=<tag> returns the
+latest promotions of every component to a named tag, so sweeping many
+components of the same tag costs one request instead of one commit.yaml
+download per component. Queries the promotions can't answer, like the
+'current' and 'consistent' tags that are not promotions or queries pinned to
+a dlrn_hash_tag, fall back to hash_info.iter_resolved.
+"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import json
+import logging
+
+from . import hash_info as hash_info_mod
+from .exceptions import HashInvalidDLRNResponse
+from .hash_info import HashInfo, QUERY_KEYS
+
+try:
+    from repo_setup.utils import hedged_call
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils import (
+        hedged_call,
+    )
+
+__metaclass__ = type
+
+# Number of promotions requested per promotions query
+DEFAULT_PROMOTIONS_LIMIT = 100
+
+
+def promotions_url(dlrn_api_url, tag, limit=DEFAULT_PROMOTIONS_LIMIT):
+    return "%s/api/promotions?promote_name=%s&limit=%d" % (dlrn_api_url, tag, limit)
+
+
+def fetch_promotions(dlrn_api_url, tag, limit=DEFAULT_PROMOTIONS_LIMIT):
+    """Returns the latest promotions to tag, newest first.
+
+    :raises HashInvalidDLRNResponse for an error or a malformed response
+    """
+    url = promotions_url(dlrn_api_url, tag, limit)
+    response, status = hash_info_mod.http_get(url)
+    if status != 200:
+        raise HashInvalidDLRNResponse(
+            "Invalid response received from the DLRN API. Queried URL: {0}. "
+            "Response code: {1}.".format(url, status)
+        )
+    try:
+        promotions = json.loads(response)
+    except ValueError:
+        promotions = None
+    if not isinstance(promotions, list):
+        raise HashInvalidDLRNResponse(
+            "Malformed promotions received from the DLRN API. Queried URL: "
+            "{0}.".format(url)
+        )
+    return sorted(
+        (p for p in promotions if isinstance(p, dict)),
+        key=lambda p: p.get("timestamp") or 0,
+        reverse=True,
+    )
+
+
+def fetch_promotions_mirrors(dlrn_api_urls, tag, limit=DEFAULT_PROMOTIONS_LIMIT):
+    """fetch_promotions from the first of several equivalent DLRN APIs to
+    answer, the next ones are hedged in when the first ones are slow, fail
+    or return malformed promotions, see utils.hedged_call.
+
+    :param dlrn_api_urls: the DLRN API url of each mirror, in order of
+        preference
+    :returns (dlrn_api_url, promotions) of the answering API
+    :raises HashInvalidDLRNResponse of the last API when none answered
+    """
+    if len(dlrn_api_urls) == 1:
+        return dlrn_api_urls[0], fetch_promotions(dlrn_api_urls[0], tag, limit)
+    return hedged_call(
+        lambda dlrn_api_url: fetch_promotions(dlrn_api_url, tag, limit),
+        dlrn_api_urls,
+        url=lambda dlrn_api_url: promotions_url(dlrn_api_url, tag, limit),
+    )
+
+
+def find_promotion(promotions, component):
+    """Returns the newest promotion of component, or the newest promotion
+    with an aggregate hash when component is None.
+    """
+    for promotion in promotions:
+        if component is None:
+            if promotion.get("aggregate_hash"):
+                return promotion
+        elif promotion.get("component") == component:
+            return promotion
+    return None
+
+
+def apply_promotion(hash_info, promotion):
+    """Sets the hashes of an unresolved HashInfo from a promotion.
+
+    The hashes are the same ones the commit.yaml (component) or
+    delorean.repo.md5 (aggregate) file fetch would return.
+    """
+    if hash_info.component is None:
+        hash_info.full_hash = promotion["aggregate_hash"]
+        hash_info.commit_hash = None
+        hash_info.distro_hash = None
+        hash_info.extended_hash = None
+    else:
+        hash_info.commit_hash = promotion["commit_hash"]
+        hash_info.distro_hash = promotion["distro_hash"]
+        hash_info.extended_hash = promotion.get("extended_hash")
+        hash_info.full_hash = "%s_%s" % (
+            hash_info.commit_hash,
+            hash_info.distro_hash[0:8],
+        )
+    return hash_info
+
+
+def iter_resolved(
+    queries,
+    config=None,
+    workers=hash_info_mod.DEFAULT_WORKERS,
+    limit=DEFAULT_PROMOTIONS_LIMIT,
+):
+    """Resolves many queries with one promotions request per DLRN API and
+    tag, falling back to the per file fetch for the unanswered ones.
+
+    The DLRN APIs of the mirrors listed in the dlrn_url of the config are
+    hedged in like the delorean servers of the HashInfo constructor.
+
+    Takes the same arguments and yields the same (query, HashInfo or the
+    raised exception) tuples as hash_info.iter_resolved.
+    """
+    # Not available on python2, where only single queries are supported
+    import concurrent.futures
+
+    config = HashInfo.load_config(config)
+    fallback = []
+    groups = collections.OrderedDict()
+    for query in queries:
+        if query.get("dlrn_hash_tag"):
+            fallback.append(query)
+            continue
+        try:
+            hash_info = HashInfo.unresolved(
+                *[query.get(k) for k in QUERY_KEYS], config=config
+            )
+        except Exception as e:
+            yield query, e
+            continue
+        dlrn_api_urls = tuple(
+            hash_info.api_url_for(mirror) for mirror in hash_info.mirrors()
+        )
+        key = (dlrn_api_urls, hash_info.tag)
+        groups.setdefault(key, []).append((query, hash_info))
+
+    if groups:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(workers, len(groups)))
+        ) as pool:
+            futures = {}
+            for (dlrn_api_urls, tag), members in groups.items():
+                future = pool.submit(
+                    fetch_promotions_mirrors, list(dlrn_api_urls), tag, limit
+                )
+                futures[future] = dlrn_api_urls, members
+            for future in concurrent.futures.as_completed(futures):
+                dlrn_api_urls, members = futures[future]
+                try:
+                    dlrn_api_url, promotions = future.result()
+                except Exception as e:
+                    logging.debug("Falling back to file fetch: %s", e)
+                    dlrn_api_url, promotions = None, []
+                for query, hash_info in members:
+                    promotion = find_promotion(promotions, hash_info.component)
+                    if promotion is None:
+                        fallback.append(query)
+                        continue
+                    mirror = hash_info.mirrors()[dlrn_api_urls.index(dlrn_api_url)]
+                    hash_info.use_mirror(mirror)
+                    try:
+                        yield query, apply_promotion(hash_info, promotion)
+                    except (KeyError, TypeError):
+                        fallback.append(query)
+
+    if fallback:
+        logging.debug("Resolving %d queries with file fetch", len(fallback))
+        for item in hash_info_mod.iter_resolved(fallback, config=config, workers=workers):
+            yield item
+
+
+def resolve(os_version, release, component, tag, dlrn_hash_tag=None, config=None):
+    """Single query counterpart of the HashInfo constructor using the
+    promotions endpoint first.
+
+    :raises HashInvalidDLRNResponse like the HashInfo constructor
+    """
+    query = dict(zip(QUERY_KEYS, [os_version, release, component, tag, dlrn_hash_tag]))
+    for __, result in iter_resolved([query], config=config, workers=1):
+        if isinstance(result, Exception):
+            raise result
+        return result
@@ -15,21 +15,112 @@
 #
 from __future__ import absolute_import, division, print_function
 
+import io
 import logging
 import os
+import re
 from .constants import CONFIG_PATH, CONFIG_KEYS, DEFAULT_CONFIG
 from .exceptions import HashInvalidConfig, HashInvalidDLRNResponse
 
 try:
-    from repo_setup.utils import http_get
+    from repo_setup.utils import hedged_call, http_get, split_mirrors
 except ImportError:
     from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils import (
+        hedged_call,
         http_get,
+        split_mirrors,
     )
 
 
 __metaclass__ = type
 
+# Default number of concurrent queries resolved by iter_resolved
+DEFAULT_WORKERS = 8
+QUERY_KEYS = ["os_version", "release", "component", "tag", "dlrn_hash_tag"]
+
+# Keys read from the first entry of a DLRN commit.yaml
+COMMIT_YAML_KEYS = ["commit_hash", "distro_hash", "extended_hash"]
+# "key: value" line of a commit.yaml entry, with an optional "- " item marker
+COMMIT_YAML_LINE_RE = re.compile(
+    r"^(?P<indent> *)(?P<item>- +)?(?P<key>[A-Za-z_]+):(?: +(?P<value>.*?))? *$"
+)
+# Plain scalars resolved to null by YAML
+YAML_NULLS = ("", "~", "null", "Null", "NULL")
+
+
+def _parse_plain_scalar(value):
+    """Returns the string of a single line YAML scalar, or raises ValueError
+    when it is not a simple plain or quoted string.
+    """
+    value = value or ""
+    if len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1].replace("''", "'")
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        if "\\" in value:
+            raise ValueError(value)
+        return value[1:-1]
+    if value in YAML_NULLS:
+        return None
+    if value[0] in "[]{}&*!|>'\"%@`#" or " #" in value:
+        raise ValueError(value)
+    return value
+
+
+def first_commit_from_commit_yaml(content):
+    """Extracts COMMIT_YAML_KEYS from the first entry of a DLRN commit.yaml
+    without parsing the whole document. Lines are only read up to the end of
+    the first entry.
+
+    :param content: commit.yaml content
+    :returns dict with COMMIT_YAML_KEYS or None when the document does not
+        have the expected 'commits:' list shape
+    """
+    found = {}
+    lines = io.StringIO(content)
+    for line in lines:
+        if line.strip() and not line.lstrip().startswith("#"):
+            break
+    else:
+        return None
+    if line.strip() != "commits:":
+        return None
+    commits_indent = len(line) - len(line.lstrip(" "))
+
+    entry_indent = None
+    for line in lines:
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        match = COMMIT_YAML_LINE_RE.match(line.rstrip("\r\n"))
+        if match is None:
+            if entry_indent is None:
+                return None
+            # continuation of a multi-line value of a key we don't need,
+            # it must be indented more than the keys of the entry
+            if len(line) - len(line.lstrip(" ")) > entry_indent:
+                continue
+            return None
+        indent = len(match.group("indent"))
+        if match.group("item"):
+            if entry_indent is not None:
+                # start of the second entry
+                break
+            if indent < commits_indent:
+                return None
+            entry_indent = indent + len(match.group("item"))
+        elif entry_indent is None or indent != entry_indent:
+            if entry_indent is not None and indent > entry_indent:
+                continue
+            return None
+        key = match.group("key")
+        if key in COMMIT_YAML_KEYS:
+            try:
+                found[key] = _parse_plain_scalar(match.group("value"))
+            except ValueError:
+                return None
+            if len(found) == len(COMMIT_YAML_KEYS):
+                return found
+    return None
+
 
 class HashInfo:
     """
@@ -46,7 +137,19 @@ class HashInfo:
     def load_yaml(cls, filename):
         import yaml
 
-        return yaml.safe_load(filename)
+        # The C loader is much faster but only there if libyaml is installed
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        return yaml.load(filename, Loader=loader)
+
+    # Memoized config loading, see load_config
+    _config_path = None
+    _config_cache = {}
+
+    @classmethod
+    def clear_config_cache(cls):
+        """Forget the resolved config path and all loaded config files"""
+        cls._config_path = None
+        cls._config_cache = {}
 
     @classmethod
     def _resolve_local_config_path(cls):
@@ -69,6 +172,50 @@ class HashInfo:
             return True
         return False
 
+    @classmethod
+    def _resolve_config_path(cls):
+        """Returns the config file to use, or "" for the embedded config.
+        The candidate paths are only probed once per process.
+        """
+        if cls._config_path is None:
+            # prefer const.CONFIG_PATH then local_config
+            if cls._check_read_file(CONFIG_PATH):
+                cls._config_path = CONFIG_PATH
+            else:
+                cls._config_path = cls._resolve_local_config_path() or ""
+        return cls._config_path
+
+    @classmethod
+    def _load_config_file(cls, config_path):
+        """Returns the validated content of config_path. The file is only
+        parsed again when its mtime changed since it was last loaded.
+        """
+        try:
+            mtime = os.path.getmtime(config_path)
+        except OSError:
+            mtime = None
+        cached = cls._config_cache.get(config_path)
+        if cached is not None and mtime is not None and cached[0] == mtime:
+            return cached[1]
+
+        logging.debug("Using config file at %s", config_path)
+        with open(config_path, "r") as config_yaml:
+            loaded_config = cls.load_yaml(config_yaml)
+        cls._validate_config(loaded_config)
+        cls._config_cache[config_path] = (mtime, loaded_config)
+        return loaded_config
+
+    @classmethod
+    def _validate_config(cls, loaded_config):
+        for k in CONFIG_KEYS:
+            if k not in loaded_config:
+                error_str = (
+                    "Malformed config file - missing {0}. Expected all"
+                    "of these configuration items: {1}"
+                ).format(k, ", ".join(CONFIG_KEYS))
+                logging.error(error_str)
+                raise HashInvalidConfig(error_str)
+
     @classmethod
     def load_config(cls, passed_config=None):
         """
@@ -83,6 +230,10 @@ class HashInfo:
         loaded config file. Returns a dictionary containing
         the key->value for all the keys in constants.CONFIG_KEYS.
 
+        The config file is resolved once per process and only parsed again
+        when its mtime changes. When passed_config already provides every
+        key, no file is read at all.
+
         :param passed_config: dict with configuration overrides
         :raises HashMissingConfig for missing config.yaml
         :raises HashInvalidConfig for missing keys in config.yaml
@@ -90,29 +241,24 @@ class HashInfo:
         """
 
         passed_config = passed_config or {}
-        result_config = {}
-        config_path = ""
-        local_config = cls._resolve_local_config_path()
-        # prefer const.CONFIG_PATH then local_config
-        if cls._check_read_file(CONFIG_PATH):
-            config_path = CONFIG_PATH
-        elif local_config:
-            config_path = local_config
-        else:
+        if all(passed_config.get(k) for k in CONFIG_KEYS):
+            return dict((k, passed_config[k]) for k in CONFIG_KEYS)
+
+        config_path = cls._resolve_config_path()
+        try:
+            loaded_config = cls._load_config_file(config_path) if config_path else None
+        except (IOError, OSError):
+            # the file went away, probe the candidate paths again
+            cls.clear_config_cache()
+            config_path = cls._resolve_config_path()
+            loaded_config = cls._load_config_file(config_path) if config_path else None
+        if loaded_config is None:
             logging.debug("Using embedded config file")
             loaded_config = DEFAULT_CONFIG
-        logging.debug("Using config file at %s", config_path)
-        if config_path != "":
-            with open(config_path, "r") as config_yaml:
-                loaded_config = cls.load_yaml(config_yaml)
+            cls._validate_config(loaded_config)
+
+        result_config = {}
         for k in CONFIG_KEYS:
-            if k not in loaded_config:
-                error_str = (
-                    "Malformed config file - missing {0}. Expected all"
-                    "of these configuration items: {1}"
-                ).format(k, ", ".join(CONFIG_KEYS))
-                logging.error(error_str)
-                raise HashInvalidConfig(error_str)
             # if the passed config contains the key then use that value
             if passed_config.get(k):
                 result_config[k] = passed_config[k]
@@ -128,7 +274,30 @@ class HashInfo:
         :param component: The podified-ci component e.g. 'common' or None
         :param tag: The Delorean server named tag e.g. current-podified
         :param config: Use an existing config dictionary and don't load it
+
+        The dlrn_url of the config may list several equivalent delorean
+        servers, separated by commas. The first one is queried and the next
+        ones are hedged in if it is slow or fails, see utils.hedged_call.
+        dlrn_url and dlrn_api_url then point at the server which answered.
         """
+        self._setup(os_version, release, component, tag, dlrn_hash_tag, config)
+        repo_url_response, status = self._fetch()
+        self.parse_response(repo_url_response, status)
+
+    @classmethod
+    def unresolved(cls, os_version, release, component, tag, dlrn_hash_tag=None, config=None):
+        """Create a HashInfo object without querying the delorean server.
+
+        Only the attributes derived from the arguments, like dlrn_url, are
+        set. The hashes are filled by passing the response of a GET of
+        dlrn_url to parse_response. This is used by callers that do their
+        own I/O, see the aio module.
+        """
+        hash_info = cls.__new__(cls)
+        hash_info._setup(os_version, release, component, tag, dlrn_hash_tag, config)
+        return hash_info
+
+    def _setup(self, os_version, release, component, tag, dlrn_hash_tag, config):
         config = HashInfo.load_config(config)
 
         self.os_version = os_version
@@ -137,12 +306,60 @@ class HashInfo:
         self.tag = tag
         self.dlrn_hash_tag = dlrn_hash_tag
 
-        repo_url = self._resolve_repo_url(config["dlrn_url"])
+        self._mirrors = split_mirrors(config["dlrn_url"])
+        repo_url = self._resolve_repo_url(self._mirrors[0])
         self.dlrn_url = repo_url
-        self.dlrn_api_url = self._get_dlrn_api_url(config["dlrn_url"])
+        self.dlrn_api_url = self._get_dlrn_api_url(self._mirrors[0])
 
-        repo_url_response, status = http_get(repo_url)
+    def _fetch(self):
+        """GETs dlrn_url, hedging in the next configured mirrors when the
+        first ones are slow or fail, see utils.hedged_call.
 
+        dlrn_url and dlrn_api_url then point at the mirror which answered.
+
+        :returns (response text, status code) of the answering mirror
+        """
+        if len(self._mirrors) == 1:
+            return http_get(self.dlrn_url)
+        urls = self.mirror_urls()
+        url, result = hedged_call(
+            lambda url: http_get(url),
+            urls,
+            is_success=lambda result: result[1] == 200,
+        )
+        self.use_mirror(self._mirrors[urls.index(url)])
+        return result
+
+    def mirrors(self):
+        """Returns the base url of each configured delorean server, in order
+        of preference
+        """
+        return list(self._mirrors)
+
+    def mirror_urls(self):
+        """Returns the dlrn_url of this query on each mirror, in the order
+        of mirrors()
+        """
+        return [self._resolve_repo_url(mirror) for mirror in self._mirrors]
+
+    def api_url_for(self, mirror):
+        """Returns the dlrn_api_url of this query on the mirror"""
+        return self._get_dlrn_api_url(mirror)
+
+    def use_mirror(self, mirror):
+        """Points dlrn_url and dlrn_api_url at the delorean server mirror"""
+        url = self._resolve_repo_url(mirror)
+        if url != self.dlrn_url:
+            logging.debug("%s answered by mirror %s", self.dlrn_url, url)
+            self.dlrn_url = url
+            self.dlrn_api_url = self._get_dlrn_api_url(mirror)
+
+    def parse_response(self, repo_url_response, status):
+        """Sets the hashes from the response of the delorean server.
+
+        :raises HashInvalidDLRNResponse if status is not 200
+        """
+        repo_url = self.dlrn_url
         if status != 200:
             error_str = (
                 "Invalid response received from the delorean server. Queried "
@@ -229,15 +446,67 @@ class HashInfo:
 
         :returns tuple of strings full, commit, distro, extended hashes
         """
-        parsed_yaml = self.load_yaml(delorean_result)
-        commit = parsed_yaml["commits"][0]["commit_hash"]
-        distro = parsed_yaml["commits"][0]["distro_hash"]
+        first_commit = first_commit_from_commit_yaml(delorean_result)
+        if first_commit is None:
+            logging.debug("Unexpected commit.yaml layout, using the YAML parser")
+            first_commit = self.load_yaml(delorean_result)["commits"][0]
+        commit = first_commit["commit_hash"]
+        distro = first_commit["distro_hash"]
         full = "%s_%s" % (commit, distro[0:8])
-        extended = parsed_yaml["commits"][0]["extended_hash"]
-        logging.debug("delorean commit.yaml results %s", parsed_yaml["commits"][0])
+        extended = first_commit["extended_hash"]
+        logging.debug("delorean commit.yaml results %s", first_commit)
         return full, commit, distro, extended
 
+    def to_dict(self):
+        """Returns the hash info as a dict suitable for JSON output"""
+        return {
+            "commit_hash": self.commit_hash,
+            "distro_hash": self.distro_hash,
+            "full_hash": self.full_hash,
+            "extended_hash": self.extended_hash,
+            "dlrn_url": self.dlrn_url,
+            "dlrn_api_url": self.dlrn_api_url,
+            "os_version": self.os_version,
+            "release": self.release,
+            "component": self.component,
+            "tag": self.tag,
+        }
+
     def __repr__(self):
-        """Returns a string representation of the object"""
-        attrs = vars(self)
-        return ",\n".join("%s: %s" % item for item in attrs.items())
+        """Returns a string representation of the object, the printed
+        output of repo-setup-get-hash. Private attributes are left out.
+        """
+        attrs = [item for item in vars(self).items() if not item[0].startswith("_")]
+        return ",\n".join("%s: %s" % item for item in attrs)
+
+
+def iter_resolved(queries, config=None, workers=DEFAULT_WORKERS):
+    """Resolves many queries concurrently over a bounded worker pool.
+
+    Results are yielded as soon as each query completes, not in the order
+    of queries.
+
+    :param queries: iterable of dicts with QUERY_KEYS, a missing key is None
+    :param config: config dictionary shared by all queries
+    :param workers: maximum number of concurrent queries
+    :returns generator of (query, HashInfo or the raised exception) tuples
+    """
+    # Not available on python2, where only single queries are supported
+    import concurrent.futures
+
+    config = HashInfo.load_config(config)
+    queries = list(queries)
+    if not queries:
+        return
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(workers, len(queries)))
+    ) as pool:
+        futures = {}
+        for query in queries:
+            args = [query.get(k) for k in QUERY_KEYS]
+            futures[pool.submit(HashInfo, *args, config=config)] = query
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
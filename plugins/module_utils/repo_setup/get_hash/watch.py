@@ -0,0 +1,189 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+#
+from __future__ import absolute_import, division, print_function
+
+import logging
+import time
+
+from . import hash_info as hash_info_mod
+from .exceptions import HashInvalidDLRNResponse
+from .hash_info import HashInfo, QUERY_KEYS
+
+try:
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
+
+__metaclass__ = type
+
+# Seconds between two polls while the hashes keep changing
+DEFAULT_INTERVAL = 60
+# The interval grows up to this many seconds while nothing changes
+DEFAULT_MAX_INTERVAL = 600
+BACKOFF_FACTOR = 2
+
+
+class WatchTarget:
+    """A watched query along with its last known full_hash and the HTTP
+    validators of its last download from each delorean server mirror.
+    """
+
+    def __init__(self, query, config):
+        self.query = query
+        hash_info = self.unresolved(config)
+        self.mirrors = hash_info.mirrors()
+        self.urls = hash_info.mirror_urls()
+        self.url = self.urls[0]
+        # url: (ETag, Last-Modified)
+        self.validators = {}
+        self.full_hash = None
+
+    def unresolved(self, config):
+        return HashInfo.unresolved(*[self.query.get(k) for k in QUERY_KEYS], config=config)
+
+
+class HashWatcher:
+    """
+    Polls the delorean server for a set of queries and reports every change
+    of their full_hash. Files are revalidated with conditional requests
+    over the shared keep-alive session, so an unchanged tag costs a 304
+    response. The polling interval doubles, up to max_interval, every time
+    a poll finds no change and goes back to interval after a change.
+    """
+
+    def __init__(
+        self,
+        queries,
+        config=None,
+        interval=DEFAULT_INTERVAL,
+        max_interval=DEFAULT_MAX_INTERVAL,
+        on_change=None,
+        sleep=None,
+    ):
+        """Create a HashWatcher object.
+
+        :param queries: list of dicts with hash_info.QUERY_KEYS
+        :param config: config dictionary shared by all queries
+        :param interval: seconds between polls after a change
+        :param max_interval: maximum seconds between polls
+        :param on_change: callable receiving each change event dict
+        :param sleep: callable used to wait between polls, defaults to
+            time.sleep
+        """
+        self.config = HashInfo.load_config(config)
+        self.targets = [WatchTarget(query, self.config) for query in queries]
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.on_change = on_change or (lambda event: None)
+        self.sleep = sleep or time.sleep
+
+    def _fetch(self, target):
+        """GETs the file of target from the first mirror to answer, the next
+        mirrors of the config are hedged in when the first ones are slow or
+        fail, see utils.hedged_call.
+
+        :returns (url, (content, status code, validators)) of the answering
+            mirror
+        """
+        if len(target.urls) == 1:
+            return target.url, self._get(target, target.url)
+        return repos_utils.hedged_call(
+            lambda url: self._get(target, url),
+            target.urls,
+            is_success=lambda result: result[1] in (200, 304),
+        )
+
+    def _get(self, target, url):
+        """Conditional GET of url with the validators of its last download
+
+        :returns (content, status code, validators of the response)
+        """
+        session = repos_utils.get_session()
+        if session is None:
+            content, status = hash_info_mod.http_get(url)
+            return content, status, (None, None)
+        etag, last_modified = target.validators.get(url, (None, None))
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = repos_utils.session_get(
+            session, url, headers=headers, timeout=repos_utils.HTTP_TIMEOUT
+        )
+        validators = (
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        return response.content.decode("utf-8"), response.status_code, validators
+
+    def poll(self):
+        """Checks every target once.
+
+        The first successful check of a target only records its full_hash.
+
+        :returns list of change event dicts, the HashInfo.to_dict() of the
+            new hash plus the previous_full_hash
+        """
+        events = []
+        for target in self.targets:
+            try:
+                url, (content, status, validators) = self._fetch(target)
+            except Exception as e:
+                logging.warning("Unable to poll %s: %s", target.url, e)
+                continue
+            if status == 304:
+                logging.debug("%s is unchanged", url)
+                continue
+            hash_info = target.unresolved(self.config)
+            hash_info.use_mirror(target.mirrors[target.urls.index(url)])
+            try:
+                hash_info.parse_response(content, status)
+            except HashInvalidDLRNResponse:
+                # the validators of an invalid response must not be reused
+                target.validators.pop(url, None)
+                continue
+            # only the validators of a processed response, the one of a
+            # mirror that lost the race would hide its content next time
+            target.validators[url] = validators
+            if target.full_hash is not None and hash_info.full_hash != target.full_hash:
+                event = hash_info.to_dict()
+                event["previous_full_hash"] = target.full_hash
+                events.append(event)
+            target.full_hash = hash_info.full_hash
+        return events
+
+    def run(self, max_polls=None):
+        """Polls until interrupted, or max_polls polls were done.
+
+        :returns number of emitted change events
+        """
+        interval = self.interval
+        polls = 0
+        emitted = 0
+        while True:
+            events = self.poll()
+            for event in events:
+                self.on_change(event)
+            emitted += len(events)
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                return emitted
+            if events:
+                interval = self.interval
+            logging.debug("Next poll in %s seconds", interval)
+            self.sleep(interval)
+            interval = min(interval * BACKOFF_FACTOR, self.max_interval)
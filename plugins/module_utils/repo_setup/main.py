@@ -16,19 +16,49 @@
 
 from __future__ import absolute_import, division, print_function
 import argparse
+import collections
+import contextlib
+import copy
+import functools
+import hashlib
+import io
+import logging
 import os
 import platform
 import re
 import subprocess
 import sys
+import time
+
+try:
+    import repo_setup.cache as repos_cache
+    import repo_setup.metrics as repos_metrics
+    import repo_setup.mirrors as repos_mirrors
+    import repo_setup.timing as repos_timing
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.cache as repos_cache
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.metrics as repos_metrics
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.mirrors as repos_mirrors
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.timing as repos_timing
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
 
 
 __metaclass__ = type
 TITLE_RE = re.compile("\\[(.*)\\]")
 NAME_RE = re.compile("name=(.+)")
 PRIORITY_RE = re.compile("priority=\\d+")
+SECTION_RE = re.compile(r"^\s*\[([^\]]+)\]", re.MULTILINE)
+DISABLED_RE = re.compile(r"^\s*enabled\s*=\s*(0|false|no)\s*$", re.MULTILINE | re.IGNORECASE)
 DEFAULT_OUTPUT_PATH = "/etc/yum.repos.d"
+CLEAN_MODES = ["all", "changed", "none"]
 DEFAULT_RDO_MIRROR = "https://trunk.rdoproject.org"
+# Upper bound of concurrent downloads issued against the RDO mirror
+MAX_FETCH_WORKERS = 4
+# Upper bound of --target output paths rendered concurrently
+MAX_TARGET_WORKERS = 4
+# DLRN repos that are fetched from <tag>/delorean.repo and pull in deps
+DLRN_REPOS = ["current", "current-podified", "podified-ci-testing"]
 
 # RHEL is only provided to licensed cloud providers via RHUI
 DEFAULT_MIRROR_MAP = {
@@ -106,6 +136,77 @@ SUPPORTED_DISTROS = [
 DISTRO_CHOICES = ["".join(distro_pair) for distro_pair in SUPPORTED_DISTROS]
 
 
+# A repo file handled by repo-setup, whether its content changed, the ids
+# of the repos it defined before and after the change and its content before
+# and after the change, None when the file did not or does not exist
+RepoFile = collections.namedtuple(
+    "RepoFile", ["path", "changed", "repo_ids", "old_content", "content"]
+)
+RepoFile.__new__.__defaults__ = (None, None)
+# One distro/branch pair rendered into output_path by --target
+Target = collections.namedtuple("Target", ["distro", "branch", "output_path"])
+# Outcome of a run: the paths of the repo files written, left unchanged and
+# removed, the repo urls downloaded, the seconds spent in each phase and the
+# RepoFile of every file installed or removed
+RepoSetupResult = collections.namedtuple(
+    "RepoSetupResult",
+    ["written", "unchanged", "removed", "fetched", "timings", "repo_files"],
+)
+
+
+class RepoSetupOptions:
+    """Options of an in-process run, see run()
+
+    Every attribute matches the repo-setup command line argument of the
+    same name and defaults to the same value. distro defaults to the
+    distro of the host, targets is a list of Target, timings is the path
+    of the JSON timings report and metrics_dir the node_exporter textfile
+    collector directory.
+    """
+
+    def __init__(
+        self,
+        repos,
+        distro=None,
+        branch="master",
+        output_path=DEFAULT_OUTPUT_PATH,
+        targets=None,
+        mirror=None,
+        mirror_candidates=None,
+        mirror_ttl=repos_mirrors.DEFAULT_RANKING_TTL,
+        rdo_mirror=DEFAULT_RDO_MIRROR,
+        dlrn_hash_tag=None,
+        stream=True,
+        no_stream=False,
+        clean_mode="changed",
+        cache_dir=repos_cache.DEFAULT_CACHE_DIR,
+        no_cache=False,
+        durability=None,
+        dry_run=False,
+        timings=None,
+        metrics_dir=None,
+    ):
+        self.repos = list(repos)
+        self.distro = distro
+        self.branch = branch
+        self.output_path = output_path
+        self.targets = targets
+        self.mirror = mirror
+        self.mirror_candidates = mirror_candidates
+        self.mirror_ttl = mirror_ttl
+        self.rdo_mirror = rdo_mirror
+        self.dlrn_hash_tag = dlrn_hash_tag
+        self.stream = stream
+        self.no_stream = no_stream
+        self.clean_mode = clean_mode
+        self.cache_dir = cache_dir
+        self.no_cache = no_cache
+        self.durability = durability
+        self.dry_run = dry_run
+        self.timings = timings
+        self.metrics_dir = metrics_dir
+
+
 class InvalidArguments(Exception):
     pass
 
@@ -114,58 +215,56 @@ class NoRepoTitle(Exception):
     pass
 
 
+class DownloadError(Exception):
+    pass
+
+
 def _get_distro():
     """Get distro info from os-release
 
     returns: distro_id, distro_major_version_id, distro_name
     """
-    # Avoids a crash on unsupported platforms which would prevent even
-    # running with `--help`.
-    if not os.path.exists("/etc/os-release"):
-        return platform.system(), "unknown", "unknown"
-
-    output = subprocess.Popen(
-        'source /etc/os-release && echo -e -n "$ID\n$VERSION_ID\n$NAME"',
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=open(os.devnull, "w"),
-        executable="/bin/bash",
-        universal_newlines=True,
-    ).communicate()
-
-    # distro_id and distro_version_id will always be at least an empty string
-    distro_id, distro_version_id, distro_name = output[0].split("\n")
-
-    # if distro_version_id is empty string the major version will be empty
-    # string too
-    distro_major_version_id = distro_version_id.split(".")[0]
-
-    # check if that is UBI subcase?
-    if os.path.exists("/etc/yum.repos.d/ubi.repo"):
-        distro_id = "ubi"
+    distro_id, distro_major_version_id, distro_name = (
+        repos_utils.get_distro_info())
+    # Unsupported platforms without os-release keep working with `--help`
+    if distro_major_version_id == "unknown":
+        return distro_id, distro_major_version_id, distro_name
 
     if (distro_id, distro_major_version_id) not in SUPPORTED_DISTROS:
-        print(
-            "WARNING: Unsupported platform '{0}{1}' detected by repo-setup,"
-            " centos9 will be used unless you use CLI param to change it."
-            "".format(distro_id, distro_major_version_id),
-            file=sys.stderr,
+        logging.warning(
+            "Unsupported platform '%s%s' detected by repo-setup,"
+            " centos9 will be used unless you use CLI param to change it.",
+            distro_id,
+            distro_major_version_id,
         )
         distro_id = "centos"
         distro_major_version_id = "9"
 
     if distro_id == "ubi":
-        print(
-            "WARNING: Centos{0} Base and AppStream will be installed for "
-            "this UBI distro".format(distro_major_version_id)
+        logging.warning(
+            "Centos%s Base and AppStream will be installed for this UBI distro",
+            distro_major_version_id,
         )
 
     return distro_id, distro_major_version_id, distro_name
 
 
-def _parse_args(distro_id, distro_major_version_id):
-    distro = "{0}{1}".format(distro_id, distro_major_version_id)
+def _parse_target(value):
+    """argparse type of --target DISTRO:BRANCH:OUTPUT_PATH"""
+    parts = value.split(":", 2)
+    if len(parts) != 3 or not all(parts):
+        raise argparse.ArgumentTypeError(
+            "expected DISTRO:BRANCH:OUTPUT_PATH, got '%s'" % value
+        )
+    if parts[0] not in DISTRO_CHOICES:
+        raise argparse.ArgumentTypeError(
+            "invalid distro '%s' (choose from %s)"
+            % (parts[0], ", ".join(DISTRO_CHOICES))
+        )
+    return Target(*parts)
 
+
+def _build_parser(distro):
     parser = argparse.ArgumentParser(
         description="Download and install repos necessary for OpenStack. Note "
         "that some of these repos require yum-plugin-priorities, "
@@ -216,15 +315,45 @@ def _parse_args(distro_id, distro_major_version_id):
         default=DEFAULT_OUTPUT_PATH,
         help="Directory in which to save the selected repos.",
     )
+    parser.add_argument(
+        "--target",
+        dest="targets",
+        action="append",
+        type=_parse_target,
+        default=None,
+        metavar="DISTRO:BRANCH:OUTPUT_PATH",
+        help="Render the repos for distro and branch into output path. May "
+        "be repeated to render many targets in one run, sharing the "
+        "downloads. Replaces --distro, --branch and --output-path. The dnf "
+        "metadata is only cleaned for targets rendered into %s."
+        % DEFAULT_OUTPUT_PATH,
+    )
     parser.add_argument(
         "--mirror",
         help="Server from which to install base OS packages. "
-        "Default value is based on distro param.",
+        "Default value is based on distro param. 'auto' probes the "
+        "--mirror-candidates and picks the fastest healthy one.",
+    )
+    parser.add_argument(
+        "--mirror-candidates",
+        default=None,
+        help="Comma separated base OS mirrors ranked by --mirror auto. The "
+        "default mirror of the distro is always a candidate.",
+    )
+    parser.add_argument(
+        "--mirror-ttl",
+        type=int,
+        default=repos_mirrors.DEFAULT_RANKING_TTL,
+        help="Seconds the mirror ranking of --mirror auto is cached in the "
+        "cache directory.",
     )
     parser.add_argument(
         "--rdo-mirror",
         default=DEFAULT_RDO_MIRROR,
-        help="Server from which to install RDO packages.",
+        help="Server from which to install RDO packages. A comma "
+        "separated list of equivalent servers may be given in order of "
+        "preference, a slow or failing server is then hedged with the "
+        "next one.",
     )
     parser.add_argument(
         "--dlrn-hash-tag",
@@ -243,10 +372,84 @@ def _parse_args(distro_id, distro_major_version_id):
         default=False,
         help="Disable stream support for CentOS repos",
     )
+    parser.add_argument(
+        "--clean-mode",
+        default="changed",
+        choices=CLEAN_MODES,
+        help="How to clean the dnf metadata cache after installing the "
+        "repos: 'all' cleans the metadata of every repo, 'changed' only "
+        "refreshes the metadata of the enabled repos added or changed in "
+        "%s by this run and 'none' leaves the cache alone." % DEFAULT_OUTPUT_PATH,
+    )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--cache-dir",
+        default=repos_cache.DEFAULT_CACHE_DIR,
+        help="Directory used to cache downloaded repo files. Cached files "
+        "are revalidated with the server on every run.",
+    )
+    cache_group.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Always download repo files without using the cache.",
+    )
+
+    parser.add_argument(
+        "--durability",
+        choices=repos_utils.DURABILITY_LEVELS,
+        default=None,
+        help="How hard to make sure written files reach stable storage: "
+        "'none' skips fsync, 'file' fsyncs every written file and 'full' "
+        "also fsyncs their directory. Defaults to the %s environment "
+        "variable or '%s'." % (repos_utils.DURABILITY_ENV, repos_utils.DEFAULT_DURABILITY),
+    )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Report the repo files that would be installed or removed "
+        "without writing, removing or cleaning anything. The download cache "
+        "and the mirror ranking are only read.",
+    )
+
+    parser.add_argument(
+        "--timings",
+        default=None,
+        metavar="PATH",
+        help="Write a JSON report of the time spent in each phase and HTTP "
+        "request to PATH, '-' for stderr. Defaults to the %s environment "
+        "variable." % repos_timing.TIMINGS_ENV,
+    )
+
+    parser.add_argument(
+        "--metrics-dir",
+        default=None,
+        metavar="DIR",
+        help="Write Prometheus metrics of the HTTP requests, file writes, "
+        "dnf clean and runs, accumulated over the runs, to DIR/repo-setup.prom "
+        "for the node_exporter textfile collector. Defaults to the %s "
+        "environment variable." % repos_metrics.METRICS_DIR_ENV,
+    )
+    return parser
+
+
+def _parse_args(distro_id, distro_major_version_id, argv=None):
+    """Parse argv, sys.argv by default, into the args of a run"""
+    distro = "{0}{1}".format(distro_id, distro_major_version_id)
+    args = _build_parser(distro).parse_args(argv)
+    return _finalize_args(args)
+
+
+def _finalize_args(args):
+    """Derive the settings implied by the parsed arguments"""
     if args.no_stream:
         args.stream = False
+    args.rdo_mirrors = repos_utils.split_mirrors(args.rdo_mirror) or [
+        DEFAULT_RDO_MIRROR
+    ]
+    args.rdo_mirror = args.rdo_mirrors[0]
 
     # Default mirror for args.distro (which defaults to 'distro')
     default_mirror = DEFAULT_MIRROR_MAP.get(args.distro, None)
@@ -258,19 +461,119 @@ def _parse_args(distro_id, distro_major_version_id):
     return args
 
 
-def _get_repo(path, args):
-    # lazy import
-    if "requests" not in globals():
-        import requests
+def _mirror_probe_path(args):
+    """Return the BaseOS repomd.xml path probed on the base OS mirrors
 
-    r = requests.get(path)
-    if r.status_code == 200:
-        return _inject_mirrors(r.text, args)
+    Returns None for distros whose base OS repos are not installed from a
+    CentOS mirror.
+    """
+    if not args.distro.startswith(("centos", "ubi")):
+        return None
+    version = args.distro[-1]
+    if version == "9":
+        stream = "9-stream"
+    elif args.distro.startswith("ubi") or (args.stream and not args.no_stream):
+        stream = "centos/%s-stream" % version
+    else:
+        stream = "centos/%s" % version
+    return "%s/BaseOS/%s/os/repodata/repomd.xml" % (stream, platform.machine())
+
+
+def _select_mirror(args):
+    """Replace a --mirror auto by the fastest healthy mirror candidate"""
+    if args.mirror != "auto":
+        return args.mirror
+    candidates = repos_utils.split_mirrors(args.mirror_candidates)
+    if args.old_mirror and args.old_mirror not in candidates:
+        candidates.insert(0, args.old_mirror)
+    path = _mirror_probe_path(args)
+    if path is None or len(candidates) < 2:
+        args.mirror = args.old_mirror
     else:
-        r.raise_for_status()
+        cache_dir = None if args.no_cache else args.cache_dir
+        args.mirror = repos_mirrors.select_mirror(
+            candidates,
+            path,
+            cache_dir=cache_dir,
+            ttl=args.mirror_ttl,
+            read_only=args.dry_run,
+        )
+    logging.info("Using base OS mirror %s", args.mirror)
+    return args.mirror
+
+
+def _get_cache(args):
+    """Return the download cache for args or None if caching is disabled
+
+    A dry run only reads the cache, so it leaves the host untouched.
+    """
+    if args.no_cache:
+        return None
+    try:
+        return repos_cache.HttpCache(args.cache_dir, read_only=args.dry_run)
+    except (IOError, OSError) as e:
+        # Regular users can't create the default cache dir, don't nag them
+        if args.cache_dir == repos_cache.DEFAULT_CACHE_DIR:
+            logging.debug("Download cache disabled: %s", e)
+        else:
+            logging.warning("Download cache disabled: %s", e)
+        return None
+
+
+def _download_repo(path, args, cache=None):
+    """Return the RDO mirror which served path and the downloaded content
+
+    When path is on args.rdo_mirror and more mirrors were given, the same
+    file is requested from the next mirrors too if the first ones are slow
+    or fail, see repos_utils.hedged_call.
+    """
+    candidates = _mirror_candidates(path, args)
+    if len(candidates) == 1:
+        return candidates[0][0], _fetch_repo(path, cache)
+    (rdo_mirror, __), content = repos_utils.hedged_call(
+        lambda candidate: _fetch_repo(candidate[1], cache),
+        candidates,
+        url=lambda candidate: candidate[1],
+    )
+    if rdo_mirror != args.rdo_mirror:
+        logging.info("Downloaded %s from mirror %s", path, rdo_mirror)
+    return rdo_mirror, content
+
+
+def _mirror_candidates(path, args):
+    """Return the (rdo mirror, url) pairs serving path, in preference order"""
+    for rdo_mirror in args.rdo_mirrors:
+        if path.startswith(rdo_mirror):
+            relative = path[len(rdo_mirror):]
+            return [(m, m + relative) for m in args.rdo_mirrors]
+    return [(args.rdo_mirror, path)]
 
 
-def _write_repo(content, target, name=None):
+def _fetch_repo(path, cache=None):
+    """Return the content of path, revalidated against the cached copy
+
+    :raises DownloadError for any response but 200, or 304 for a cached
+        copy
+    """
+    session = repos_utils.get_session()
+    headers = cache.conditional_headers(path) if cache else {}
+    r = repos_utils.session_get(
+        session, path, headers=headers, timeout=repos_utils.HTTP_TIMEOUT
+    )
+    if r.status_code == 304 and headers:
+        content = cache.get(path)
+        if content is not None:
+            return content
+        # The cached copy vanished in the meantime, download it again
+        r = repos_utils.session_get(session, path, timeout=repos_utils.HTTP_TIMEOUT)
+    if r.status_code == 200:
+        if cache:
+            cache.store(path, r.text, r.headers)
+        return r.text
+    raise DownloadError("Unexpected response %d for %s" % (r.status_code, path))
+
+
+def _write_repo(content, target, name=None, dry_run=False, durability=None):
     if not name:
         m = TITLE_RE.search(content)
         if not m:
@@ -282,9 +585,64 @@ def _write_repo(content, target, name=None):
             name = "delorean"
     filename = name + ".repo"
     filename = os.path.join(target, filename)
-    with open(filename, "w") as f:
-        f.write(content)
-    print("Installed repo %s to %s" % (name, filename))
+    old_content = _read_repo_file(filename)
+    repo_ids = _get_repo_ids(content)
+    if old_content is not None and (
+        _content_digest(old_content) == _content_digest(content)
+    ):
+        logging.info("Repo %s is unchanged at %s", name, filename)
+        return RepoFile(filename, False, repo_ids, old_content, content)
+    if dry_run:
+        logging.info("Would install repo %s to %s", name, filename)
+    else:
+        repos_utils.atomic_write(filename, content, durability=durability)
+        logging.info("Installed repo %s to %s", name, filename)
+    return RepoFile(
+        filename,
+        True,
+        sorted(set(repo_ids + _get_repo_ids(old_content or ""))),
+        old_content,
+        content,
+    )
+
+
+def _content_digest(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _read_repo_file(filename):
+    """Return the content of filename or None if it can't be read"""
+    try:
+        with io.open(filename, "r", encoding="utf-8") as f:
+            return f.read()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _get_repo_ids(content):
+    """Return the ids of the repos defined in a repo file content"""
+    return sorted(set(SECTION_RE.findall(content)))
+
+
+def _merge_repo_files(repo_files):
+    """Merge results of files written more than once, keeping their order
+
+    A file counts as changed if any of the writes changed it, its old
+    content is the one before the first write.
+    """
+    merged = collections.OrderedDict()
+    for repo_file in repo_files:
+        if repo_file.path in merged:
+            previous = merged[repo_file.path]
+            repo_file = RepoFile(
+                repo_file.path,
+                repo_file.changed or previous.changed,
+                sorted(set(repo_file.repo_ids + previous.repo_ids)),
+                previous.old_content,
+                repo_file.content,
+            )
+        merged[repo_file.path] = repo_file
+    return list(merged.values())
 
 
 def _validate_distro_repos(args):
@@ -324,7 +682,7 @@ def _validate_current_repos(repos):
     """
     if "current-podified" in repos and "current" in repos:
         raise InvalidArguments(
-            "Cannot use current and current-podified at the " "same time."
+            "Cannot use current and current-podified at the same time."
         )
     if "current-podified-dev" not in repos:
         return True
@@ -391,8 +749,16 @@ def _validate_args(args, distro_name, distro_major_version_id):
     _validate_distro_stream(args, distro_name, distro_major_version_id)
 
 
-def _remove_existing(args):
-    """Remove any delorean* or opstools repos that already exist"""
+def _remove_existing(args, keep=None, dry_run=False):
+    """Remove any delorean* or opstools repos that already exist
+
+    Files listed in keep, the ones just installed, are left in place. With
+    dry_run the files are only reported.
+
+    returns: list of RepoFile for every removed file
+    """
+    keep = keep or []
+    removed = []
     if args.distro in ["ubi8", "ubi9"]:
         regex = (
             "^(BaseOS|AppStream|delorean|repo-setup-centos-"
@@ -410,14 +776,21 @@ def _remove_existing(args):
         paths = os.listdir(args.output_path)
     for f in paths:
         if pattern.match(f):
-            filename = os.path.join(args.output_path, f)
-            if os.path.exists(filename):
-                os.remove(filename)
-                print('Removed old repo "%s"' % filename)
-            filename = os.path.join("/etc/distro.repos.d", f)
-            if os.path.exists(filename):
-                os.remove(filename)
-                print('Removed old repo "%s"' % filename)
+            for filename in (os.path.join(args.output_path, f),
+                             os.path.join("/etc/distro.repos.d", f)):
+                if filename in keep:
+                    continue
+                if os.path.exists(filename):
+                    old_content = _read_repo_file(filename)
+                    repo_ids = _get_repo_ids(old_content or "")
+                    if dry_run:
+                        logging.info('Would remove old repo "%s"', filename)
+                    else:
+                        os.remove(filename)
+                        logging.info('Removed old repo "%s"', filename)
+                    removed.append(
+                        RepoFile(filename, True, repo_ids, old_content, None))
+    return removed
 
 
 def _get_base_path(args):
@@ -467,18 +840,26 @@ def _change_priority(content, new_priority):
     return new_content
 
 
-def _inject_mirrors(content, args):
+def _inject_mirrors(content, args, rdo_mirror=None):
     """Replace any references to the default mirrors in repo content
 
     In some cases we want to use mirrors whose repo files still point to the
     default servers.  If the user specified to use the mirror, we want to
     replace any such references with the mirror address.  This function
     handles that by using a regex to swap out the baseurl server.
-    """
 
-    content = re.sub(
-        "baseurl=%s" % DEFAULT_RDO_MIRROR, "baseurl=%s" % args.rdo_mirror, content
-    )
+    rdo_mirror is the RDO mirror which served content, args.rdo_mirror by
+    default. References to the other RDO mirrors are swapped for it too so
+    the packages come from the server the repo file came from.
+    """
+    rdo_mirror = rdo_mirror or args.rdo_mirror
+    replaced = [DEFAULT_RDO_MIRROR]
+    if rdo_mirror != args.rdo_mirror:
+        replaced += [m for m in args.rdo_mirrors if m != rdo_mirror]
+    for server in replaced:
+        content = re.sub(
+            "baseurl=%s" % server, "baseurl=%s" % rdo_mirror, content
+        )
 
     if args.old_mirror:
         content = re.sub(
@@ -488,8 +869,8 @@ def _inject_mirrors(content, args):
     return content
 
 
-def _get_rhel_trunk_candidate_repos(args, base_path):
-    content = _get_repo(base_path + "osptrunk-deps.repo", args)
+def _get_rhel_trunk_candidate_repos(args, base_path, fetched):
+    content = fetched[base_path + "osptrunk-deps.repo"]
     # Replace deps with candidate
     content = content.replace('deps', 'candidate')
     content = content.replace('build', 'candidate')
@@ -518,33 +899,104 @@ def _get_dlrn_hash_tag(args, repo):
     return repo
 
 
-def _install_repos(args, base_path):
+def _get_deps_url(args, base_path):
+    if 'rhel' in args.distro:
+        return base_path + "osptrunk-deps.repo"
+    return base_path + "delorean-deps.repo"
+
+
+def _plan_repo_urls(args, base_path):
+    """Return the ordered list of unique repo URLs needed by args.repos
+
+    current, current-podified and podified-ci-testing all pull in the deps
+    repo, so it is only listed once no matter how many of them are requested.
+    """
+    urls = []
+    for repo in args.repos:
+        if repo in DLRN_REPOS:
+            urls.append(base_path + _get_dlrn_hash_tag(
+                args, "%s/delorean.repo" % repo))
+        if repo in DLRN_REPOS or repo == "deps":
+            urls.append(_get_deps_url(args, base_path))
+    unique_urls = []
+    for url in urls:
+        if url not in unique_urls:
+            unique_urls.append(url)
+    return unique_urls
+
+
+def _download_repos(urls, args, cache=None):
+    """Download all urls concurrently, without injecting mirrors
+
+    returns: dict mapping each url to the (rdo mirror, content) it was
+             downloaded as, to be shared by targets with different mirrors
+    """
+    # Not available on python2, the repo_setup module requires python 3
+    import concurrent.futures
+
+    if not urls:
+        return {}
+    download_repo = repos_timing.bind(_download_repo)
+    workers = min(len(urls), MAX_FETCH_WORKERS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict((url, pool.submit(download_repo, url, args, cache))
+                       for url in urls)
+        return dict((url, future.result()) for url, future in futures.items())
+
+
+def _install_repos(args, base_path, cache=None, downloaded=None,
+                   dry_run=False):
+    """Install the repo files for args.repos and the base OS repos
+
+    downloaded is the result of _download_repos for urls including the ones
+    planned for args, the repos are downloaded here when it is None. With
+    dry_run nothing is written, see _write_repo.
+
+    returns: list of RepoFile for every write, files written more than once
+             are listed once per write
+    """
+    urls = _plan_repo_urls(args, base_path)
+    if downloaded is None:
+        downloaded = _download_repos(urls, args, cache)
+    fetched = {}
+    for url in urls:
+        rdo_mirror, content = downloaded[url]
+        fetched[url] = _inject_mirrors(content, args, rdo_mirror)
+    write_repo = _write_repo
+    if dry_run:
+        write_repo = functools.partial(_write_repo, dry_run=True)
+    elif args.durability:
+        write_repo = functools.partial(_write_repo,
+                                       durability=args.durability)
+    installed = []
+
     def install_deps(args, base_path):
         if 'rhel' in args.distro:
-            content = _get_rhel_trunk_candidate_repos(args, base_path)
-            _write_repo(content, args.output_path, name="osp-trunk-candidate")
+            content = _get_rhel_trunk_candidate_repos(args, base_path,
+                                                      fetched)
+            installed.append(write_repo(content, args.output_path, name="osp-trunk-candidate"))
         else:
-            content = _get_repo(base_path + "delorean-deps.repo", args)
-            _write_repo(content, args.output_path)
+            content = fetched[_get_deps_url(args, base_path)]
+            installed.append(write_repo(content, args.output_path))
 
     for repo in args.repos:
         if repo == "current":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "current/delorean.repo"), args)
-            _write_repo(content, args.output_path, name="delorean")
+            content = fetched[base_path + _get_dlrn_hash_tag(args, "current/delorean.repo")]
+            installed.append(write_repo(content, args.output_path, name="delorean"))
             install_deps(args, base_path)
         elif repo == "deps":
             install_deps(args, base_path)
         elif repo == "current-podified":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "current-podified/delorean.repo"), args)
-            _write_repo(content, args.output_path)
+            content = fetched[base_path + _get_dlrn_hash_tag(args, "current-podified/delorean.repo")]
+            installed.append(write_repo(content, args.output_path))
             install_deps(args, base_path)
         elif repo == "podified-ci-testing":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "podified-ci-testing/delorean.repo"), args)
-            _write_repo(content, args.output_path)
+            content = fetched[base_path + _get_dlrn_hash_tag(args, "podified-ci-testing/delorean.repo")]
+            installed.append(write_repo(content, args.output_path))
             install_deps(args, base_path)
         elif repo == "ceph":
             content = _create_ceph(args, "pacific")
-            _write_repo(content, args.output_path)
+            installed.append(write_repo(content, args.output_path))
         else:
             raise InvalidArguments('Invalid repo "%s" specified' % repo)
 
@@ -553,8 +1005,8 @@ def _install_repos(args, base_path):
     legacy_url = "centos/"
     if distro in ["ubi8", "ubi9"]:
         if not os.path.exists("/etc/distro.repos.d"):
-            print(
-                "WARNING: For UBI it is recommended to create "
+            logging.warning(
+                "For UBI it is recommended to create "
                 "/etc/distro.repos.d and rerun!"
             )
             dp_exists = False
@@ -575,13 +1027,13 @@ def _install_repos(args, base_path):
             "legacy_url": legacy_url,
             "stream": distro_name,
         }
-        _write_repo(content, distro_path)
+        installed.append(write_repo(content, distro_path))
         content = BASE_REPO_TEMPLATE % {
             "mirror": args.mirror,
             "legacy_url": legacy_url,
             "stream": distro_name,
         }
-        _write_repo(content, distro_path)
+        installed.append(write_repo(content, distro_path))
         if distro in ["centos8", "centos9", "ubi8", "ubi9"]:
             distro = "centos" + str(distro[-1])
 
@@ -602,7 +1054,7 @@ def _install_repos(args, base_path):
                 "stream": stream,
                 "legacy_url": legacy_url,
             }
-            _write_repo(content, args.output_path)
+            installed.append(write_repo(content, args.output_path))
 
             content = POWERTOOLS_REPO_TEMPLATE % {
                 "mirror": args.mirror,
@@ -610,7 +1062,7 @@ def _install_repos(args, base_path):
                 "legacy_url": legacy_url,
                 "pt_name": pt_name,
             }
-            _write_repo(content, args.output_path)
+            installed.append(write_repo(content, args.output_path))
 
             if "9" in stream:
                 content = APPSTREAM_REPO_TEMPLATE % {
@@ -619,33 +1071,316 @@ def _install_repos(args, base_path):
                     "legacy_url": legacy_url,
                     "stream": stream,
                 }
-                _write_repo(content, args.output_path)
+                installed.append(write_repo(content, args.output_path))
 
                 content = BASE_REPO_TEMPLATE % {
                     "mirror": args.mirror,
                     "legacy_url": legacy_url,
                     "stream": stream,
                 }
-                _write_repo(content, args.output_path)
+                installed.append(write_repo(content, args.output_path))
+
+    return installed
+
+
+def _get_enabled_repo_ids(content):
+    """Return the ids of the repos of a repo file content not disabled"""
+    parts = SECTION_RE.split(content)
+    # parts is the text before the first section, then id, body pairs
+    return sorted(
+        set(
+            repo_id
+            for repo_id, body in zip(parts[1::2], parts[2::2])
+            if not DISABLED_RE.search(body)
+        )
+    )
+
+
+def _refresh_repo_metadata(repo_ids, distro):
+    """Refresh the dnf metadata of repo_ids only
+
+    dnf itself expires and downloads again the metadata of these repos,
+    under its own locks, while the metadata of all other repos is kept.
+    When that fails all the metadata is cleaned instead, so dnf still
+    can't use stale metadata.
+    """
+    cmd = ["dnf", "makecache", "--refresh"]
+    for repo_id in repo_ids:
+        cmd += ["--repo", repo_id]
+    try:
+        with repos_timing.span("dnf_clean", repos=len(repo_ids)):
+            subprocess.check_call(cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(
+            "Failed to refresh the dnf metadata of repos %s, cleaning the "
+            "metadata of all repos: %s",
+            ", ".join(repo_ids),
+            e,
+        )
+        _run_pkg_clean(distro)
+        return
+    logging.info("Refreshed dnf metadata of repos: %s", ", ".join(repo_ids))
+
+
+def _clean_metadata(args, repo_files):
+    """Clean the dnf metadata according to args.clean_mode
+
+    :param repo_files: list of RepoFile installed or removed by this run
+    """
+    if args.clean_mode == "none":
+        logging.info("Skipping dnf metadata clean, disabled by --clean-mode")
+    elif args.clean_mode == "all":
+        _run_pkg_clean(args.distro)
+    elif os.path.normpath(args.output_path) != DEFAULT_OUTPUT_PATH:
+        # dnf doesn't use these repos, their metadata can't be stale
+        logging.info(
+            "Skipping dnf metadata refresh, %s is not %s",
+            args.output_path,
+            DEFAULT_OUTPUT_PATH,
+        )
+    else:
+        repo_ids = set()
+        changed = False
+        for repo_file in repo_files:
+            if repo_file.changed:
+                changed = True
+                # removed repos and disabled ones are not used by dnf
+                repo_ids.update(_get_enabled_repo_ids(repo_file.content or ""))
+        if repo_ids:
+            _refresh_repo_metadata(sorted(repo_ids), args.distro)
+        elif changed:
+            logging.info(
+                "Skipping dnf metadata refresh, only removed or disabled "
+                "repos changed"
+            )
+        else:
+            logging.info("Skipping dnf metadata clean, no repo file changed")
 
 
 def _run_pkg_clean(distro):
     pkg_mgr = "dnf"
     try:
-        subprocess.check_call([pkg_mgr, "clean", "metadata"])
+        with repos_timing.span("dnf_clean"):
+            subprocess.check_call([pkg_mgr, "clean", "metadata"])
     except subprocess.CalledProcessError:
-        print("ERROR: Failed to clean yum metadata.")
+        logging.error("Failed to clean yum metadata.")
         raise
 
 
+def _target_args(args, target):
+    """Return a copy of args for target
+
+    The base OS mirror follows the distro of target unless --mirror was
+    given.
+    """
+    target_args = copy.copy(args)
+    target_args.distro, target_args.branch, target_args.output_path = target
+    default_mirror = DEFAULT_MIRROR_MAP.get(target.distro, None)
+    if args.mirror == args.old_mirror:
+        target_args.mirror = default_mirror
+    target_args.old_mirror = default_mirror
+    return target_args
+
+
+def _plan_targets_urls(plans):
+    """Return the unique repo urls needed by the (args, base path) plans"""
+    urls = []
+    for target_args, base_path in plans:
+        for url in _plan_repo_urls(target_args, base_path):
+            if url not in urls:
+                urls.append(url)
+    return urls
+
+
+def _fetched_urls(downloaded, args):
+    """Return the urls the repo files of downloaded were served from
+
+    :param downloaded: result of _download_repos
+    """
+    urls = []
+    for url, (rdo_mirror, __) in downloaded.items():
+        urls.append(dict(_mirror_candidates(url, args)).get(rdo_mirror, url))
+    return urls
+
+
+def _install_targets(args, plans, cache=None, dry_run=False,
+                     downloaded=None):
+    """Install the repos of every target, downloading each url once
+
+    :param plans: list of (target args, base path)
+    :param downloaded: result of _download_repos for the urls of plans,
+        they are downloaded here when it is None.
+    returns: list of (target args, list of RepoFile) in plans order
+    """
+    # Not available on python2, the repo_setup module requires python 3
+    import concurrent.futures
+
+    if downloaded is None:
+        downloaded = _download_repos(_plan_targets_urls(plans), args, cache)
+    install_repos = repos_timing.bind(_install_repos)
+    workers = min(len(plans), MAX_TARGET_WORKERS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (target_args, pool.submit(install_repos, target_args, base_path,
+                                      cache, downloaded, dry_run))
+            for target_args, base_path in plans
+        ]
+        return [(target_args, _merge_repo_files(future.result()))
+                for target_args, future in futures]
+
+
+@contextlib.contextmanager
+def _timed(timings, phase):
+    """Add the seconds spent in the with block to timings[phase]
+
+    The block is also recorded as a timing span named phase.
+    """
+    start = time.time()
+    try:
+        with repos_timing.span(phase):
+            yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.time() - start
+
+
+def _run(args, distro_name, distro_major_version_id):
+    """Install the repos for args
+
+    returns: RepoSetupResult
+    """
+    timings = collections.OrderedDict()
+    if args.targets:
+        output_paths = [target.output_path for target in args.targets]
+        if len(set(output_paths)) != len(output_paths):
+            raise InvalidArguments(
+                "Every --target needs its own output path: %s" % output_paths
+            )
+        targets_args = [_target_args(args, target) for target in args.targets]
+    else:
+        targets_args = [args]
+
+    with _timed(timings, "validate"):
+        for target_args in targets_args:
+            _validate_args(target_args, distro_name, distro_major_version_id)
+            _select_mirror(target_args)
+        plans = [(target_args, _get_base_path(target_args))
+                 for target_args in targets_args]
+    cache = _get_cache(args)
+    with _timed(timings, "install"):
+        downloaded = _download_repos(_plan_targets_urls(plans), args, cache)
+        if args.targets:
+            results = _install_targets(args, plans, cache,
+                                       dry_run=args.dry_run,
+                                       downloaded=downloaded)
+        else:
+            results = [(args, _merge_repo_files(_install_repos(
+                args, plans[0][1], cache=cache, downloaded=downloaded,
+                dry_run=args.dry_run)))]
+
+    written, unchanged, removed, repo_files = [], [], [], []
+    for target_args, installed in results:
+        with _timed(timings, "remove"):
+            target_removed = _remove_existing(
+                target_args, keep=[f.path for f in installed],
+                dry_run=args.dry_run)
+        target_unchanged = [f for f in installed if not f.changed]
+        written += [f.path for f in installed if f.changed]
+        unchanged += [f.path for f in target_unchanged]
+        removed += [f.path for f in target_removed]
+        repo_files += installed + target_removed
+        prefix = "%s: " % target_args.output_path if args.targets else ""
+        logging.info("%s%d of %d repo files were unchanged", prefix,
+                     len(target_unchanged), len(installed))
+        with _timed(timings, "clean"):
+            if args.dry_run:
+                logging.info("Skipping dnf metadata clean, dry run")
+            elif not args.targets or target_args.output_path == DEFAULT_OUTPUT_PATH:
+                _clean_metadata(target_args, installed + target_removed)
+            else:
+                logging.info("Skipping dnf metadata clean of %s, not %s",
+                             target_args.output_path, DEFAULT_OUTPUT_PATH)
+    if cache:
+        cache.evict()
+    return RepoSetupResult(written, unchanged, removed,
+                           _fetched_urls(downloaded, args), timings,
+                           repo_files)
+
+
+def _options_args(options, distro_id, distro_major_version_id):
+    """Return the args of a run for RepoSetupOptions"""
+    args = argparse.Namespace(**vars(options))
+    if args.distro is None:
+        args.distro = "{0}{1}".format(distro_id, distro_major_version_id)
+    if args.distro not in DISTRO_CHOICES:
+        raise InvalidArguments("Invalid distro %s, valid distros are: %s"
+                               % (args.distro, DISTRO_CHOICES))
+    if args.clean_mode not in CLEAN_MODES:
+        raise InvalidArguments("Invalid clean mode %s, valid modes are: %s"
+                               % (args.clean_mode, CLEAN_MODES))
+    if args.targets:
+        args.targets = [Target(*target) for target in args.targets]
+    return _finalize_args(args)
+
+
+def run(options):
+    """Install repos in-process, the library counterpart of main()
+
+    Nothing is printed, progress is reported through the logging module,
+    and errors are raised instead of exiting so one process can run many
+    times, concurrently too.
+
+    :param options: RepoSetupOptions
+    :raises InvalidArguments for invalid options
+    :return: RepoSetupResult
+    """
+    with repos_timing.recording("repo-setup", options.timings) as recorder:
+        repos_metrics.attach(recorder, options.metrics_dir)
+        with repos_timing.span("distro"):
+            distro_id, distro_major_version_id, distro_name = _get_distro()
+        args = _options_args(options, distro_id, distro_major_version_id)
+        return _run(args, distro_name, distro_major_version_id)
+
+
+class _BelowWarningFilter(logging.Filter):
+    def filter(self, record):
+        return record.levelno < logging.WARNING
+
+
+class _CliFormatter(logging.Formatter):
+    """Plain messages, prefixed by their level from WARNING up"""
+
+    def format(self, record):
+        message = logging.Formatter.format(self, record)
+        if record.levelno >= logging.WARNING:
+            return "%s: %s" % (record.levelname, message)
+        return message
+
+
+def _setup_cli_logging():
+    """Show the progress messages on stdout and the warnings on stderr"""
+    logger = logging.getLogger()
+    if logger.handlers:
+        return
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.addFilter(_BelowWarningFilter())
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.WARNING)
+    for handler in (stdout_handler, stderr_handler):
+        handler.setFormatter(_CliFormatter())
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
 def main():
-    distro_id, distro_major_version_id, distro_name = _get_distro()
-    args = _parse_args(distro_id, distro_major_version_id)
-    _validate_args(args, distro_name, distro_major_version_id)
-    base_path = _get_base_path(args)
-    _remove_existing(args)
-    _install_repos(args, base_path)
-    _run_pkg_clean(args.distro)
+    _setup_cli_logging()
+    with repos_timing.recording("repo-setup") as recorder:
+        with repos_timing.span("distro"):
+            distro_id, distro_major_version_id, distro_name = _get_distro()
+        with repos_timing.span("parse_args"):
+            args = _parse_args(distro_id, distro_major_version_id)
+        recorder.path = args.timings
+        repos_metrics.attach(recorder, args.metrics_dir)
+        _run(args, distro_name, distro_major_version_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,321 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+"""Prometheus metrics of the runs, for the node_exporter textfile collector.
+
+A MetricsSink is fed the timing spans of a run and, when the run ends,
+writes <metrics dir>/<command>.prom. Counters and histograms accumulate
+over the runs of a command, their totals are kept in a state file next to
+the .prom file, which the collector ignores.
+"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import time
+
+try:
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
+
+__metaclass__ = type
+
+# Directory of the textfile collector used when the command line has no
+# --metrics-dir
+METRICS_DIR_ENV = "REPO_SETUP_METRICS_DIR"
+STATE_VERSION = 1
+# Upper bounds, in seconds, of the histogram buckets
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DNF_CLEAN_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# name -> (type, help), in the order they are written
+METRICS = collections.OrderedDict(
+    [
+        ("repo_setup_runs_total", ("counter", "Runs by result.")),
+        (
+            "repo_setup_last_run_timestamp_seconds",
+            ("gauge", "Time the last run ended."),
+        ),
+        (
+            "repo_setup_last_run_duration_seconds",
+            ("gauge", "Duration of the last run."),
+        ),
+        (
+            "repo_setup_last_run_success",
+            ("gauge", "Whether the last run succeeded."),
+        ),
+        (
+            "repo_setup_http_requests_total",
+            (
+                "counter",
+                "HTTP requests by host and status, 304 responses were served "
+                "from the download cache.",
+            ),
+        ),
+        (
+            "repo_setup_http_response_bytes_total",
+            ("counter", "Bytes of the HTTP response bodies."),
+        ),
+        (
+            "repo_setup_http_request_duration_seconds",
+            ("histogram", "Duration of the HTTP requests."),
+        ),
+        ("repo_setup_file_writes_total", ("counter", "Atomic file writes by result.")),
+        ("repo_setup_file_write_bytes_total", ("counter", "Bytes written to files.")),
+        (
+            "repo_setup_file_write_duration_seconds",
+            ("histogram", "Duration of the atomic file writes."),
+        ),
+        ("repo_setup_dnf_clean_total", ("counter", "dnf metadata cleans by result.")),
+        (
+            "repo_setup_dnf_clean_duration_seconds",
+            ("histogram", "Duration of the dnf metadata cleans."),
+        ),
+    ]
+)
+HISTOGRAM_BUCKETS = {
+    "repo_setup_http_request_duration_seconds": DURATION_BUCKETS,
+    "repo_setup_file_write_duration_seconds": DURATION_BUCKETS,
+    "repo_setup_dnf_clean_duration_seconds": DNF_CLEAN_BUCKETS,
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(counters, histograms, gauges):
+    """Return the metrics in the Prometheus text exposition format.
+
+    :param counters: dict of (name, labels) to value, labels being a tuple
+        of (label, value) pairs. gauges is the same.
+    :param histograms: dict of (name, labels) to [bucket counts, sum,
+        count], the bucket counts being per bucket, the last one for +Inf.
+    """
+    lines = []
+    for name, (metric_type, metric_help) in METRICS.items():
+        if metric_type == "histogram":
+            series = histograms
+        elif metric_type == "counter":
+            series = counters
+        else:
+            series = gauges
+        keys = sorted(k for k in series if k[0] == name)
+        if not keys:
+            continue
+        lines.append("# HELP %s %s" % (name, metric_help))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for key in keys:
+            labels = key[1]
+            if metric_type != "histogram":
+                lines.append(
+                    "%s%s %s" % (name, _format_labels(labels), _format_value(series[key]))
+                )
+                continue
+            counts, total, count = series[key]
+            cumulative = 0
+            bounds = [repr(b) for b in HISTOGRAM_BUCKETS[name]] + ["+Inf"]
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(
+                    "%s_bucket%s %d"
+                    % (name, _format_labels(labels + (("le", bound),)), cumulative)
+                )
+            lines.append("%s_sum%s %s" % (name, _format_labels(labels), repr(total)))
+            lines.append("%s_count%s %d" % (name, _format_labels(labels), count))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsSink:
+    """Timing sink exporting the metrics of a run of command."""
+
+    def __init__(self, metrics_dir, command):
+        self.metrics_dir = metrics_dir
+        self.command = command
+        self.path = os.path.join(metrics_dir, command + ".prom")
+        self.state_path = os.path.join(metrics_dir, "." + command + ".state.json")
+        self.lock_path = os.path.join(metrics_dir, "." + command + ".lock")
+        # the counters and histograms of this run only
+        self.counters = {}
+        self.histograms = {}
+
+    def _labels(self, **labels):
+        return (("command", self.command),) + tuple(sorted(labels.items()))
+
+    def _inc(self, name, value, **labels):
+        key = (name, self._labels(**labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _observe(self, name, value, **labels):
+        key = (name, self._labels(**labels))
+        buckets = HISTOGRAM_BUCKETS[name]
+        if key not in self.histograms:
+            self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram = self.histograms[key]
+        index = len(buckets)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                index = i
+                break
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def observe(self, span):
+        """Count a timing span of the 'http', 'write' or 'dnf_clean' kind."""
+        attrs = span.attrs
+        if span.name == "http":
+            status = attrs.get("status")
+            status = "error" if status is None or status < 0 else str(status)
+            host = repos_utils.url_host(attrs.get("url", ""))
+            self._inc("repo_setup_http_requests_total", 1, host=host, status=status)
+            self._inc(
+                "repo_setup_http_response_bytes_total", attrs.get("bytes", 0), host=host
+            )
+            self._observe(
+                "repo_setup_http_request_duration_seconds", span.duration, host=host
+            )
+        elif span.name == "write":
+            result = "failure" if "error" in attrs else "success"
+            self._inc("repo_setup_file_writes_total", 1, result=result)
+            self._inc("repo_setup_file_write_bytes_total", attrs.get("bytes", 0))
+            self._observe("repo_setup_file_write_duration_seconds", span.duration)
+        elif span.name == "dnf_clean":
+            result = "failure" if "error" in attrs else "success"
+            self._inc("repo_setup_dnf_clean_total", 1, result=result)
+            self._observe("repo_setup_dnf_clean_duration_seconds", span.duration)
+
+    def close(self, recorder):
+        """Count the run and write the metrics of all runs."""
+        success = recorder.error is None
+        self._inc("repo_setup_runs_total", 1, result="success" if success else "failure")
+        labels = self._labels()
+        gauges = {
+            ("repo_setup_last_run_timestamp_seconds", labels): time.time(),
+            ("repo_setup_last_run_duration_seconds", labels): (
+                time.time() - recorder.started
+            ),
+            ("repo_setup_last_run_success", labels): 1 if success else 0,
+        }
+        self.export(gauges)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serialize the runs of command updating the state"""
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if state.get("version") != STATE_VERSION:
+                raise ValueError("unknown version %s" % state.get("version"))
+            counters = dict(
+                ((c["name"], tuple(tuple(lv) for lv in c["labels"])), c["value"])
+                for c in state["counters"]
+            )
+            histograms = dict(
+                (
+                    (h["name"], tuple(tuple(lv) for lv in h["labels"])),
+                    [h["buckets"], h["sum"], h["count"]],
+                )
+                for h in state["histograms"]
+            )
+            return counters, histograms
+        except (IOError, OSError):
+            return {}, {}
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(
+                "Resetting the metrics, invalid state %s: %s", self.state_path, e
+            )
+            return {}, {}
+
+    def _save_state(self, counters, histograms):
+        state = {
+            "version": STATE_VERSION,
+            "counters": [
+                {"name": name, "labels": list(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": list(labels),
+                    "buckets": counts,
+                    "sum": total,
+                    "count": count,
+                }
+                for (name, labels), (counts, total, count) in sorted(histograms.items())
+            ],
+        }
+        repos_utils.atomic_write(self.state_path, json.dumps(state), durability="none")
+
+    def export(self, gauges):
+        """Add the metrics of this run to the stored ones and write both the
+        state and the .prom file atomically.
+        """
+        if not os.path.isdir(self.metrics_dir):
+            os.makedirs(self.metrics_dir)
+        with self._locked():
+            counters, histograms = self._load_state()
+            for key, value in self.counters.items():
+                counters[key] = counters.get(key, 0) + value
+            for key, (counts, total, count) in self.histograms.items():
+                stored = histograms.get(key)
+                if stored is None or len(stored[0]) != len(counts):
+                    # new series, or the buckets changed since it was stored
+                    histograms[key] = [list(counts), total, count]
+                else:
+                    stored[0] = [a + b for a, b in zip(stored[0], counts)]
+                    stored[1] += total
+                    stored[2] += count
+            self._save_state(counters, histograms)
+            repos_utils.atomic_write(
+                self.path, render(counters, histograms, gauges), durability="none"
+            )
+
+
+def attach(recorder, metrics_dir=None):
+    """Export the metrics of a timing recording when it ends.
+
+    :param recorder: the timing.Recorder of the run.
+    :param metrics_dir: textfile collector directory, defaults to the
+        REPO_SETUP_METRICS_DIR environment variable. Nothing is exported
+        without either.
+    """
+    metrics_dir = metrics_dir or os.environ.get(METRICS_DIR_ENV)
+    if metrics_dir:
+        recorder.add_sink(MetricsSink(metrics_dir, recorder.command))
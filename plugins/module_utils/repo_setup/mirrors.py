@@ -0,0 +1,179 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+from __future__ import absolute_import, division, print_function
+
+import collections
+import errno
+import hashlib
+import json
+import logging
+import os
+import time
+
+try:
+    import repo_setup.timing as repos_timing
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.timing as repos_timing
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
+
+__metaclass__ = type
+
+# Seconds a ranking stored in the cache directory is reused
+DEFAULT_RANKING_TTL = 6 * 60 * 60
+# Seconds to wait for a mirror to answer a probe
+PROBE_TIMEOUT = 10
+# Mirrors are ranked by the time they would take to serve this many bytes,
+# about the size of the primary metadata of a BaseOS repo
+REFERENCE_SIZE = 1024 * 1024
+RANKING_PREFIX = "mirror-ranking-"
+MAX_PROBE_WORKERS = 8
+
+MirrorProbe = collections.namedtuple(
+    "MirrorProbe", ["mirror", "healthy", "latency", "throughput"]
+)
+
+
+def _probe_url(mirror, path):
+    return "%s/%s" % (mirror.rstrip("/"), path.lstrip("/"))
+
+
+def probe_mirror(mirror, path, timeout=PROBE_TIMEOUT):
+    """Download path, a repomd.xml, from mirror and time it.
+
+    :return: MirrorProbe with the seconds until the response headers
+        arrived as latency and the body download speed in bytes per second
+        as throughput. A mirror is healthy if it served a repomd.xml.
+    """
+    url = _probe_url(mirror, path)
+    session = repos_utils.get_session()
+    start = time.time()
+    try:
+        if session is None:
+            content, status = repos_utils.http_get(url)
+            latency = time.time() - start
+            content = content.encode("utf-8")
+        else:
+            with repos_timing.span("http", url=url) as span:
+                r = session.get(url, timeout=timeout, stream=True)
+                latency = time.time() - start
+                content = r.content
+                status = span["status"] = r.status_code
+                span["bytes"] = len(content)
+    except Exception as e:
+        logging.debug("Probe of %s failed: %s", url, e)
+        return MirrorProbe(mirror, False, None, None)
+    duration = max(time.time() - start - latency, 1e-6)
+    healthy = status == 200 and b"<repomd" in content
+    if not healthy:
+        logging.debug("Probe of %s returned status %s", url, status)
+    return MirrorProbe(mirror, healthy, latency, len(content) / duration)
+
+
+def _score(probe):
+    """Estimated seconds for probe.mirror to serve REFERENCE_SIZE bytes"""
+    return probe.latency + REFERENCE_SIZE / max(probe.throughput, 1.0)
+
+
+def rank_mirrors(mirrors, path, timeout=PROBE_TIMEOUT):
+    """Probe every mirror concurrently.
+
+    :return: list of MirrorProbe, the healthy mirrors first, fastest first,
+        then the unhealthy ones in the order of mirrors.
+    """
+    import concurrent.futures
+
+    workers = max(1, min(MAX_PROBE_WORKERS, len(mirrors)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        probe = repos_timing.bind(probe_mirror)
+        probes = list(pool.map(lambda m: probe(m, path, timeout), mirrors))
+    healthy = sorted((p for p in probes if p.healthy), key=_score)
+    return healthy + [p for p in probes if not p.healthy]
+
+
+def _ranking_path(cache_dir, mirrors, path):
+    key = hashlib.sha256(json.dumps([path] + list(mirrors)).encode("utf-8"))
+    return os.path.join(cache_dir, RANKING_PREFIX + key.hexdigest()[:16] + ".json")
+
+
+def load_ranking(cache_dir, mirrors, path, ttl=DEFAULT_RANKING_TTL):
+    """Return the ranking of mirrors for path stored less than ttl seconds
+    ago in cache_dir, or None.
+    """
+    try:
+        with open(_ranking_path(cache_dir, mirrors, path), "r") as f:
+            stored = json.load(f)
+        if time.time() - stored["stored"] > ttl:
+            return None
+        return [MirrorProbe(*probe) for probe in stored["ranking"]]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_ranking(cache_dir, mirrors, path, ranking):
+    """Store the ranking of mirrors for path in cache_dir"""
+    stored = {
+        "path": path,
+        "mirrors": list(mirrors),
+        "stored": time.time(),
+        "ranking": [list(probe) for probe in ranking],
+    }
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # The ranking can always be probed again, don't pay for fsync
+        repos_utils.atomic_write(
+            _ranking_path(cache_dir, mirrors, path),
+            json.dumps(stored),
+            durability="none",
+        )
+    except (IOError, OSError) as e:
+        # Regular users can't write to the default cache dir, don't nag them
+        if e.errno in (errno.EACCES, errno.EPERM, errno.EROFS):
+            logging.debug("Unable to cache the mirror ranking: %s", e)
+        else:
+            logging.warning("Unable to cache the mirror ranking: %s", e)
+
+
+def select_mirror(
+    mirrors, path, cache_dir=None, ttl=DEFAULT_RANKING_TTL, read_only=False
+):
+    """Return the fastest healthy mirror serving path.
+
+    The ranking is reused from cache_dir while younger than ttl seconds,
+    otherwise every mirror is probed again. Without any healthy mirror the
+    first one is returned, and the ranking is not cached so the mirrors are
+    probed again on the next run.
+
+    :param mirrors: candidate base OS mirror urls.
+    :param path: path of a repomd.xml relative to the mirrors.
+    :param cache_dir: directory where the ranking is cached, None to always
+        probe.
+    :param read_only: only reuse a cached ranking, never store one.
+    """
+    ranking = None
+    if cache_dir:
+        ranking = load_ranking(cache_dir, mirrors, path, ttl)
+        if ranking is not None:
+            logging.debug("Using cached mirror ranking")
+    if ranking is None:
+        ranking = rank_mirrors(mirrors, path)
+        if cache_dir and not read_only and any(probe.healthy for probe in ranking):
+            save_ranking(cache_dir, mirrors, path, ranking)
+    for probe in ranking:
+        if probe.healthy:
+            return probe.mirror
+    logging.warning("No healthy mirror found among %s", ", ".join(mirrors))
+    return mirrors[0]
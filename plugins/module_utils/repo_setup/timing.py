@@ -0,0 +1,226 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+"""Timing spans of the phases and HTTP requests of a run.
+
+Code wraps its phases in span() blocks. While a recording() is active the
+spans of its thread, and of the worker threads running functions wrapped by
+bind(), are collected and a JSON report is written when it ends. Other
+threads record into the first recording in progress. Sinks added to the
+recording, like the metrics exporter, see every span as well. Without an
+active recording span() only yields a throwaway dict, so instrumented code
+pays next to nothing.
+"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+__metaclass__ = type
+
+# Path of the JSON report written when the command line has no --timings
+TIMINGS_ENV = "REPO_SETUP_TIMINGS"
+# Spans kept by a recording, later ones are only counted in the totals so a
+# long running watch doesn't grow forever
+MAX_SPANS = 10000
+
+# start is in seconds since the recording started, attrs is a dict of
+# details like the url, status and bytes of an HTTP request
+Span = collections.namedtuple("Span", ["name", "start", "duration", "attrs"])
+
+_recorder = None
+# Recorder of the recording() or bind() running in each thread
+_local = threading.local()
+_lock = threading.Lock()
+_UNSET = object()
+
+
+class Recorder:
+    """Collects the spans of one run of a command."""
+
+    def __init__(self, command, path=None):
+        """
+        :param command: name of the recorded command.
+        :param path: where to write the report, '-' for stderr, defaults to
+            the REPO_SETUP_TIMINGS environment variable.
+        """
+        self.command = command
+        self.path = path
+        self.error = None
+        self.started = time.time()
+        self.spans = []
+        self.totals = collections.OrderedDict()
+        self.dropped = 0
+        self.sinks = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration, attrs):
+        s = Span(name, started - self.started, duration, attrs)
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0.0) + duration
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(s)
+            else:
+                self.dropped += 1
+            for sink in self.sinks:
+                sink.observe(s)
+
+    def add_sink(self, sink):
+        """Feed every span to sink.
+
+        sink.observe(span) is called for the spans recorded so far and then
+        for every new one, sink.close(recorder) once the recording ended.
+        """
+        with self._lock:
+            for s in self.spans:
+                sink.observe(s)
+            self.sinks.append(sink)
+
+    def report(self):
+        """Return the report as a JSON serializable dict.
+
+        'totals' holds the seconds spent in the spans of each name, the
+        spans of concurrent threads are all added up.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+            totals = collections.OrderedDict(self.totals)
+        report = collections.OrderedDict()
+        report["command"] = self.command
+        report["started"] = self.started
+        report["duration"] = time.time() - self.started
+        report["error"] = self.error
+        report["totals"] = totals
+        report["dropped_spans"] = self.dropped
+        report["spans"] = []
+        for s in spans:
+            data = collections.OrderedDict(
+                [("name", s.name), ("start", s.start), ("duration", s.duration)]
+            )
+            data.update(s.attrs)
+            report["spans"].append(data)
+        return report
+
+
+def get_recorder():
+    """Return the active Recorder of this thread, or None."""
+    recorder = getattr(_local, "recorder", _UNSET)
+    if recorder is _UNSET:
+        return _recorder
+    return recorder
+
+
+def bind(func):
+    """Return func recording its spans into the caller's recording.
+
+    Used for the functions run by worker threads, so concurrent recordings
+    each get the spans of their own workers.
+    """
+    recorder = get_recorder()
+
+    def bound(*args, **kwargs):
+        saved = getattr(_local, "recorder", _UNSET)
+        _local.recorder = recorder
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.recorder = saved
+
+    return bound
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time the with block as a span named name.
+
+    The yielded dict holds attrs and accepts more details, e.g. the status
+    of a request known at the end of the block. A raised exception is
+    recorded as the 'error' of the span.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        yield attrs
+        return
+    started = time.time()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        recorder.add(name, started, time.time() - started, attrs)
+
+
+def write_report(report, path):
+    """Write report as JSON to path, '-' writes it to stderr."""
+    data = json.dumps(report, indent=2)
+    try:
+        if path == "-":
+            sys.stderr.write(data + "\n")
+        else:
+            with open(path, "w") as f:
+                f.write(data + "\n")
+    except (IOError, OSError) as e:
+        logging.warning("Unable to write the timings report to %s: %s", path, e)
+
+
+@contextlib.contextmanager
+def recording(command, path=None):
+    """Record the spans of the with block and write the report at its end.
+
+    The report goes to recorder.path, or the REPO_SETUP_TIMINGS
+    environment variable, and is not written without either. The Recorder
+    is yielded so its path can be set once the arguments were parsed. A
+    recording already in progress in this thread is reused, concurrent
+    recordings of other threads are kept apart.
+    """
+    global _recorder
+    saved = getattr(_local, "recorder", _UNSET)
+    if saved is not _UNSET and saved is not None:
+        yield saved
+        return
+    recorder = _local.recorder = Recorder(command, path)
+    with _lock:
+        claimed = _recorder is None
+        if claimed:
+            _recorder = recorder
+    try:
+        yield recorder
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            recorder.error = "exit status %s" % e.code
+        raise
+    except Exception as e:
+        recorder.error = str(e) or type(e).__name__
+        raise
+    finally:
+        _local.recorder = saved
+        if claimed:
+            with _lock:
+                _recorder = None
+        for sink in recorder.sinks:
+            try:
+                sink.close(recorder)
+            except Exception as e:
+                logging.warning("Unable to close the %s timing sink: %s",
+                                type(sink).__name__, e)
+        path = recorder.path or os.environ.get(TIMINGS_ENV)
+        if path:
+            write_report(recorder.report(), path)
@@ -14,20 +14,71 @@
 #
 from __future__ import absolute_import, division, print_function
 
+import collections
+import io
 import logging
+import os
+import platform
+import re
 import sys
+import tempfile
+import threading
+import time
+
+try:
+    import repo_setup.timing as repos_timing
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.timing as repos_timing
 
 __metaclass__ = type
 
+# Seconds to wait for a DLRN/mirror server before giving up on a request
+HTTP_TIMEOUT = 60
+# Size of the keep-alive connection pool kept per host by the shared session
+HTTP_POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process wide HTTP session, creating it on first use.
+
+    The session keeps connections alive and pooled per host, so repeated
+    requests against the same DLRN server only pay the TCP/TLS setup once.
+    Returns None when python-requests is not available.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                try:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                except ImportError:
+                    return None
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
 # portable http_get that uses either ansible recommended way or python native
-# urllib. Also deals with python2 vs python3 for centos7 train jobs.
+# urllib. Also deals with python2 vs python3 for centos7 train jobs. These are
+# only used when python-requests, and therefore the shared session, is not
+# available.
 py_version = sys.version_info.major
 if py_version < 3:
     import urllib2
 
-    def http_get(url):
+    def _http_get_fallback(url):
         try:
-            response = urllib2.urlopen(url)
+            response = urllib2.urlopen(url, timeout=HTTP_TIMEOUT)
             return (response.read().decode("utf-8"), int(response.code))
         except Exception as e:
             return (str(e), -1)
@@ -36,9 +87,9 @@ else:
     try:
         from ansible.module_utils.urls import open_url
 
-        def http_get(url):
+        def _http_get_fallback(url):
             try:
-                response = open_url(url, method="GET")
+                response = open_url(url, method="GET", timeout=HTTP_TIMEOUT)
                 return (response.read().decode("utf-8"), response.status)
             except Exception as e:
                 return (str(e), -1)
@@ -46,14 +97,358 @@ else:
     except ImportError:
         from urllib.request import urlopen
 
-        def http_get(url):
+        def _http_get_fallback(url):
             try:
-                response = urlopen(url)
+                response = urlopen(url, timeout=HTTP_TIMEOUT)
                 return (response.read().decode("utf-8"), int(response.status))
             except Exception as e:
                 return (str(e), -1)
 
 
+def http_get(url):
+    """Fetch url and return a (content, status code) tuple.
+
+    Any error is reported as (error message, -1) instead of being raised.
+    """
+    with repos_timing.span("http", url=url) as span:
+        session = get_session()
+        if session is None:
+            content, status = _http_get_fallback(url)
+            if status != -1:
+                span["bytes"] = len(content.encode("utf-8"))
+        else:
+            try:
+                response = session.get(url, timeout=HTTP_TIMEOUT)
+                content, status = (
+                    response.content.decode("utf-8"),
+                    response.status_code,
+                )
+                span["bytes"] = len(response.content)
+            except Exception as e:
+                content, status = str(e), -1
+        span["status"] = status
+    return content, status
+
+
+def session_get(session, url, **kwargs):
+    """session.get(url, **kwargs) timed as an 'http' span.
+
+    The body is read within the span to record its size, so this is not
+    meant for streamed requests.
+    """
+    with repos_timing.span("http", url=url) as span:
+        response = session.get(url, **kwargs)
+        span["status"] = response.status_code
+        span["bytes"] = len(response.content)
+    return response
+
+
+# A hedged request is sent to the next mirror when the previous one did not
+# answer within this percentile of its past response times ...
+HEDGE_PERCENTILE = 95
+# ... computed over the last HEDGE_SAMPLES successful requests to a host, or
+# after HEDGE_DEFAULT_DELAY seconds until HEDGE_MIN_SAMPLES are known.
+HEDGE_SAMPLES = 100
+HEDGE_MIN_SAMPLES = 5
+HEDGE_DEFAULT_DELAY = 1.0
+
+_latencies = collections.defaultdict(lambda: collections.deque(maxlen=HEDGE_SAMPLES))
+_latencies_lock = threading.Lock()
+
+
+def split_mirrors(value):
+    """Return the list of mirrors of a comma separated string or a list."""
+    if isinstance(value, (list, tuple)):
+        return [m for m in value if m]
+    return [m.strip() for m in (value or "").split(",") if m.strip()]
+
+
+def url_host(url):
+    """Return the host, and port if any, of url."""
+    return url.split("://", 1)[-1].split("/", 1)[0]
+
+
+def record_latency(url, seconds):
+    """Record the response time of a successful request to url."""
+    with _latencies_lock:
+        _latencies[url_host(url)].append(seconds)
+
+
+def hedge_delay(url):
+    """Return the seconds to wait for url before hedging to another mirror."""
+    with _latencies_lock:
+        samples = sorted(_latencies.get(url_host(url), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    index = int(round((len(samples) - 1) * HEDGE_PERCENTILE / 100.0))
+    return samples[index]
+
+
+def hedged_call(func, candidates, is_success=None, url=None):
+    """Call func on candidates in order, hedging slow and failed calls.
+
+    func(candidates[0]) is started first. When it has not returned within
+    hedge_delay() of its url, or as soon as it fails, func is also started
+    on the next candidate, and so on. The first successful result wins, the
+    calls still running are abandoned. They run in daemon threads so they
+    don't hold up the exit of the process.
+
+    :param func: callable taking a candidate.
+    :param candidates: ordered list of candidates, e.g. mirror urls.
+    :param is_success: callable telling whether a result is a success,
+        defaults to any result. A raised exception is always a failure.
+    :param url: callable returning the url of a candidate, used to track
+        response times per host. Defaults to the candidate itself.
+    :return: (candidate, result) of the winning call.
+    :raises the exception of the last failed call if every call raised.
+    """
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    is_success = is_success or (lambda result: True)
+    url = url or (lambda candidate: candidate)
+
+    def timed(candidate):
+        start = time.time()
+        result = func(candidate)
+        if is_success(result):
+            record_latency(url(candidate), time.time() - start)
+        return result
+
+    if len(candidates) == 1:
+        return candidates[0], timed(candidates[0])
+
+    # (candidate, result, exception) of the finished calls
+    finished = queue.Queue()
+
+    def call(candidate):
+        try:
+            finished.put((candidate, timed(candidate), None))
+        except Exception as e:
+            finished.put((candidate, None, e))
+
+    def start(candidate):
+        thread = threading.Thread(target=repos_timing.bind(call),
+                                  args=(candidate,))
+        thread.daemon = True
+        thread.start()
+
+    running = 0
+    remaining = list(candidates)
+    latest = None
+    failure = None
+    while running or remaining:
+        if remaining and not running:
+            latest = remaining.pop(0)
+            start(latest)
+            running += 1
+        timeout = None
+        if remaining:
+            timeout = hedge_delay(url(latest))
+        try:
+            candidate, result, error = finished.get(timeout=timeout)
+        except queue.Empty:
+            latest = remaining.pop(0)
+            logging.debug("Hedging request to %s", url(latest))
+            start(latest)
+            running += 1
+            continue
+        running -= 1
+        if error is not None:
+            logging.debug("Request to %s failed: %s", url(candidate), error)
+            failure = (candidate, error)
+            continue
+        if is_success(result):
+            return candidate, result
+        failure = (candidate, result)
+
+    candidate, result = failure
+    if isinstance(result, Exception):
+        raise result
+    return candidate, result
+
+
+def http_get_mirrors(urls):
+    """http_get the first mirror url to answer, hedging slow mirrors.
+
+    :param urls: The same resource on several mirrors, in order of
+        preference.
+    :return: (url, (content, status code)) of the serving mirror.
+    """
+    return hedged_call(http_get, urls, is_success=lambda result: result[1] == 200)
+
+
+# How hard atomic_write tries to get data to stable storage: 'none' only
+# relies on the atomic rename, 'file' also fsyncs the file data before the
+# rename and 'full' additionally fsyncs the parent directory after it.
+DURABILITY_LEVELS = ["none", "file", "full"]
+DEFAULT_DURABILITY = "full"
+DURABILITY_ENV = "REPO_SETUP_DURABILITY"
+
+_durability = None
+
+
+def set_durability(level):
+    """Set the durability level used by atomic_write for this process.
+
+    :param level: One of DURABILITY_LEVELS or None to go back to the
+        REPO_SETUP_DURABILITY environment variable or the default.
+    """
+    global _durability
+    if level is not None and level not in DURABILITY_LEVELS:
+        raise ValueError("Invalid durability level: %s" % level)
+    _durability = level
+
+
+def get_durability():
+    """Return the durability level used by atomic_write."""
+    if _durability is not None:
+        return _durability
+    level = os.environ.get(DURABILITY_ENV)
+    if level in DURABILITY_LEVELS:
+        return level
+    if level:
+        logging.warning(
+            "Ignoring invalid %s value '%s', using '%s'",
+            DURABILITY_ENV,
+            level,
+            DEFAULT_DURABILITY,
+        )
+    return DEFAULT_DURABILITY
+
+
+def _fsync_dir(dir_path):
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Not every platform/filesystem supports fsync on directories
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path, data, mode=0o644, durability=None):
+    """Replace file_path with data without ever exposing a partial file.
+
+    data is written to a temporary file in the same directory which is then
+    renamed over file_path. A symlink is followed, so its target is replaced
+    and the link kept. An existing file keeps its permissions, and its owner
+    when running as root.
+
+    :param file_path: Path of the file to be written.
+    :param data: Text or bytes to be written to the file.
+    :param mode: Permissions for file_path if it does not exist yet.
+    :param durability: One of DURABILITY_LEVELS, defaults to
+        get_durability().
+    """
+    durability = durability or get_durability()
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    with repos_timing.span("write", path=file_path, bytes=len(data)):
+        _atomic_write(file_path, data, mode, durability)
+
+
+def _atomic_write(file_path, data, mode, durability):
+    # e.g. /etc/yum.conf is a link to dnf/dnf.conf on EL8 and later
+    file_path = os.path.realpath(file_path)
+    dir_path = os.path.dirname(file_path)
+    owner = None
+    try:
+        stat = os.stat(file_path)
+        mode = stat.st_mode & 0o7777
+        owner = (stat.st_uid, stat.st_gid)
+    except OSError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dir_path, prefix="." + os.path.basename(file_path) + "."
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        if owner is not None and os.geteuid() == 0:
+            os.chown(tmp_path, *owner)
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, file_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    if durability == "full":
+        _fsync_dir(dir_path)
+
+
+OS_RELEASE_PATH = "/etc/os-release"
+# KEY=VALUE lines of an os-release file, the value being optionally quoted
+OS_RELEASE_LINE_RE = re.compile(
+    r"^(?P<name>[a-zA-Z0-9_]+)=(?P<quote>[\"']?)(?P<value>.*)(?P=quote)$"
+)
+# Shell special characters are escaped with a backslash in os-release values
+OS_RELEASE_UNESCAPE_RE = re.compile(r"\\([\\$\"'`])")
+
+_os_release_cache = {}
+
+
+def parse_os_release(path=OS_RELEASE_PATH):
+    """Parse an os-release file following the freedesktop.org format.
+
+    Blank lines and comments are skipped, values may be enclosed in single
+    or double quotes and backslash escaped shell characters are unescaped.
+    Results are memoized per path for the lifetime of the process.
+
+    :param path: Path to the os-release file.
+    :return: dict with all the variables defined in the file.
+    """
+    if path not in _os_release_cache:
+        info = {}
+        with io.open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                match = OS_RELEASE_LINE_RE.match(line)
+                if match:
+                    info[match.group("name")] = OS_RELEASE_UNESCAPE_RE.sub(
+                        r"\1", match.group("value")
+                    )
+        _os_release_cache[path] = info
+    return dict(_os_release_cache[path])
+
+
+def get_distro_info(os_release_path=OS_RELEASE_PATH):
+    """Get distro info from os-release file.
+
+    :return: distro_id, distro_major_version_id and distro_name
+    """
+    # Avoids a crash on unsupported platforms which would prevent even
+    # running with `--help`.
+    if not os.path.exists(os_release_path):
+        return platform.system(), "unknown", "unknown"
+
+    os_release = parse_os_release(os_release_path)
+    # distro_id and distro_version_id will always be at least an empty string
+    distro_id = os_release.get("ID", "")
+    distro_version_id = os_release.get("VERSION_ID", "")
+    distro_name = os_release.get("NAME", "")
+
+    # if distro_version_id is empty string the major version will be empty
+    # string too
+    distro_major_version_id = distro_version_id.split(".")[0]
+
+    # check if that is UBI subcase?
+    if os.path.exists("/etc/yum.repos.d/ubi.repo"):
+        distro_id = "ubi"
+
+    return distro_id, distro_major_version_id, distro_name
+
+
 def load_logging(level=logging.INFO, module_name="repo-setup"):
     """Load and set logging level. Default is set to logging.INFO level."""
     logger = logging.getLogger()
@@ -13,16 +13,32 @@
 #   under the License.
 
 import argparse
+import json
 import logging
 import os
 import sys
 
 from repo_setup.utils import load_logging
+import repo_setup.metrics as repos_metrics
+import repo_setup.timing as repos_timing
+import repo_setup.utils as repos_utils
 import repo_setup.yum_config.constants as const
+import repo_setup.yum_config.exceptions as exc
 import repo_setup.yum_config.yum_config as cfg
 import repo_setup.yum_config.utils as utils
 
 
+# Per section arguments of the 'repo' subcommand, as (option, dest), that the
+# entries of a --batch manifest replace
+BATCH_CONFLICTS = [
+    ("--name", "name"),
+    ("--enable/--disable", "enable"),
+    ("--set-opts", "set_opts"),
+    ("--config-file-path", "config_file_path"),
+    ("--down-url", "down_url"),
+]
+
+
 def options_to_dict(options):
     opt_dict = {}
     if options:
@@ -37,6 +53,63 @@ def options_to_dict(options):
     return opt_dict
 
 
+def _batch_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+
+def load_batch_manifest(path):
+    """Loads a batch manifest for the 'repo' subcommand.
+
+    The manifest is a JSON or YAML list of repo entries, or a mapping with
+    such a list under the 'repos' key. Each entry accepts the 'name',
+    'set_opts', 'enabled', 'file_path' and 'down_url' keys.
+
+    :param path: manifest file path or '-' to read it from stdin.
+    :return: list of entries to be passed to YumRepoConfig.apply_batch.
+    :raises YumConfigInvalidManifest: if the manifest has no valid entries.
+    """
+    if path == "-":
+        content = sys.stdin.read()
+    else:
+        with open(path, "r") as f:
+            content = f.read()
+    try:
+        manifest = json.loads(content)
+    except ValueError:
+        import yaml
+
+        manifest = yaml.safe_load(content)
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get("repos")
+    if not isinstance(manifest, list):
+        raise exc.YumConfigInvalidManifest(
+            "Batch manifest must be a list of repo entries."
+        )
+
+    entries = []
+    for entry in manifest:
+        if not isinstance(entry, dict) or not entry.get("name"):
+            raise exc.YumConfigInvalidManifest(
+                "Every batch manifest entry must provide a 'name'."
+            )
+        set_opts = entry.get("set_opts") or {}
+        entries.append(
+            {
+                "name": str(entry["name"]),
+                "set_opts": dict((k, _batch_value(v)) for k, v in set_opts.items()),
+                "enabled": entry.get("enabled"),
+                "file_path": entry.get("file_path"),
+                "down_url": entry.get("down_url"),
+            }
+        )
+    return entries
+
+
 def main():
     load_logging(module_name="repo-setup-yum-config")
     # Get release model and version
@@ -82,6 +155,14 @@ def main():
             "set the absolute directory path that holds all repo " "configuration files"
         ),
     )
+    repo_args_parser.add_argument(
+        "--batch",
+        dest="batch",
+        help=(
+            "path to a JSON or YAML manifest with many repos to be added or "
+            "updated in a single pass, or '-' to read it from stdin."
+        ),
+    )
     repo_args_parser.add_argument(
         "--down-url",
         dest="down_url",
@@ -174,10 +255,35 @@ def main():
         default=False,
         help="enable verbose log level for debugging",
     )
+    main_parser.add_argument(
+        "--durability",
+        choices=repos_utils.DURABILITY_LEVELS,
+        default=None,
+        help="how hard to make sure written files reach stable storage, "
+        "defaults to the %s environment variable or '%s'"
+        % (repos_utils.DURABILITY_ENV, repos_utils.DEFAULT_DURABILITY),
+    )
+    main_parser.add_argument(
+        "--timings",
+        default=None,
+        metavar="PATH",
+        help="write a JSON report of the time spent in each HTTP request and "
+        "file write to PATH, '-' for stderr, defaults to the %s environment "
+        "variable" % repos_timing.TIMINGS_ENV,
+    )
+    main_parser.add_argument(
+        "--metrics-dir",
+        default=None,
+        metavar="DIR",
+        help="write Prometheus metrics of the HTTP requests, file writes and "
+        "runs, accumulated over the runs, to DIR/repo-setup-yum-config.prom "
+        "for the node_exporter textfile collector, defaults to the %s "
+        "environment variable" % repos_metrics.METRICS_DIR_ENV,
+    )
     subparsers = main_parser.add_subparsers(dest="command")
 
     # Subcommands
-    subparsers.add_parser(
+    repo_parser = subparsers.add_parser(
         "repo",
         parents=[common_parse, environment_parse, repo_args_parser, options_parse],
         help="updates a yum repository options",
@@ -211,16 +317,40 @@ def main():
         main_parser.print_help()
         sys.exit(2)
 
+    if args.command == "repo" and args.batch is not None:
+        # every entry of the manifest provides its own section arguments
+        ignored = [
+            option
+            for option, dest in BATCH_CONFLICTS
+            if getattr(args, dest) is not None
+        ]
+        if ignored:
+            repo_parser.error(
+                "argument --batch: not allowed with argument %s" % ", ".join(ignored)
+            )
+
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
         logging.debug("Logging level set to DEBUG")
 
+    if args.durability:
+        repos_utils.set_durability(args.durability)
+
+    with repos_timing.recording("repo-setup-yum-config", args.timings) as recorder:
+        repos_metrics.attach(recorder, args.metrics_dir)
+        with repos_timing.span(args.command):
+            _run_command(args)
+
+
+def _run_command(args):
     if args.command == "repo":
         set_dict = options_to_dict(args.set_opts)
         config_obj = cfg.YumRepoConfig(
             dir_path=args.config_dir_path, environment_file=args.env_file
         )
-        if args.name is not None:
+        if args.batch is not None:
+            config_obj.apply_batch(load_batch_manifest(args.batch))
+        elif args.name is not None:
             config_obj.add_or_update_section(
                 args.name,
                 set_dict=set_dict,
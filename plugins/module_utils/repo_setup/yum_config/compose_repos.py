@@ -34,6 +34,11 @@ from .exceptions import (
 )
 from .yum_config import YumConfig
 
+try:
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
+
 __metaclass__ = type
 
 
@@ -41,7 +46,13 @@ class YumComposeRepoConfig(YumConfig):
     """Manages yum repo configuration files for CentOS Compose."""
 
     def __init__(
-        self, compose_url, release, dir_path=None, arch=None, environment_file=None
+        self,
+        compose_url,
+        release,
+        dir_path=None,
+        arch=None,
+        environment_file=None,
+        dry_run=False,
     ):
         conf_dir_path = dir_path or YUM_REPO_DIR
         self.arch = arch or "x86_64"
@@ -77,20 +88,18 @@ class YumComposeRepoConfig(YumConfig):
             dir_path=conf_dir_path,
             file_extension=YUM_REPO_FILE_EXTENSION,
             environment_file=environment_file,
+            dry_run=dry_run,
         )
 
     def _get_compose_info(self):
         """Retrieve compose info for a provided compose-id url."""
         # NOTE(dviroel): works for both centos 8 and 9
-        import urllib.request
-
-        try:
-            logging.debug("Retrieving compose info from url: %s", self.compose_info_url)
-            res = urllib.request.urlopen(self.compose_info_url)
-        except Exception:
+        logging.debug("Retrieving compose info from url: %s", self.compose_info_url)
+        content, status = repos_utils.http_get(self.compose_info_url)
+        if status != 200:
             msg = "Failed to retrieve compose info from url: %s" % self.compose_info_url
             raise YumConfigComposeError(error_msg=msg)
-        compose_info = json.loads(res.read())
+        compose_info = json.loads(content)
         if compose_info["header"]["version"] != "1.2":
             # NOTE(dviroel): Log a warning just in case we receive a different
             #  version here. Code may fail depending on the change.
@@ -182,9 +191,8 @@ class YumComposeRepoConfig(YumConfig):
 
     def add_section(self, section, add_dict, file_path):
         # Create a new file if it does not exists
-        if not os.path.isfile(file_path):
-            with open(file_path, "w+"):
-                pass
+        if not self._file_exists(file_path):
+            self._create_file(file_path)
         super(YumComposeRepoConfig, self).add_section(
             section, add_dict, file_path
         )
@@ -74,3 +74,10 @@ class YumConfigUrlError(Base):
 
     def __init__(self, error_msg):
         super(YumConfigUrlError, self).__init__(error_msg)
+
+
+class YumConfigInvalidManifest(Base):
+    """The batch manifest is not a list of valid repo entries."""
+
+    def __init__(self, error_msg):
+        super(YumConfigInvalidManifest, self).__init__(error_msg)
@@ -15,9 +15,11 @@
 from __future__ import absolute_import, division, print_function
 
 
+import collections
 import io
 import logging
 import os
+import re
 import subprocess
 import sys
 
@@ -44,55 +46,122 @@ except ImportError:
 py_version = sys.version_info.major
 if py_version < 3:
     import ConfigParser as cfg_parser
+    import StringIO as string_io
 
-    def save_section_to_file(file_path, config, section, updates):
-        """Updates a specific 'section' in a 'config' and write to disk.
+    def render_config(config):
+        """Renders a 'config' as the text of an ini file.
 
-        :param file_path: Absolute path to the file to be updated.
-        :param config: configparser object created from the file.
-        :param section: section name to be updated.
-        :param updates: dict with options to update in section.
+        :param config: configparser object to be rendered.
         """
-
-        for k, v in updates.items():
-            config.set(section, k, v)
-        with open(file_path, "w") as f:
-            config.write(f)
+        buf = string_io.StringIO()
+        config.write(buf)
+        # text like on python3, the dry run content is read back through
+        # io.StringIO
+        content = buf.getvalue()
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
 
         # NOTE(dviroel) Need to manually remove whitespaces around "=", to
         #  avoid legacy scripts failing on parsing ini files.
-        with open(file_path, "r+") as f:
-            lines = f.readlines()
-            # erase content before writing again
-            f.truncate(0)
-            f.seek(0)
-            for line in lines:
-                line = line.strip()
-                if "=" in line:
-                    option_kv = line.split("=", 1)
-                    option_kv = list(map(str.strip, option_kv))
-                    f.write("%s%s%s\n" % (option_kv[0], "=", option_kv[1]))
-                else:
-                    f.write(line + "\n")
+        lines = []
+        for line in content.splitlines():
+            line = line.strip()
+            if "=" in line:
+                option_kv = [kv.strip() for kv in line.split("=", 1)]
+                lines.append(u"%s%s%s\n" % (option_kv[0], "=", option_kv[1]))
+            else:
+                lines.append(line + u"\n")
+        return u"".join(lines)
+
+    def update_config_section(config, section, updates):
+        for k, v in updates.items():
+            config.set(section, k, v)
 
 else:
     import configparser as cfg_parser
 
-    def save_section_to_file(file_path, config, section, updates):
-        """Updates a specific 'section' in a 'config' and write to disk.
+    def render_config(config):
+        """Renders a 'config' as the text of an ini file.
 
-        :param file_path: Absolute path to the file to be updated.
-        :param config: configparser object created from the file.
-        :param section: section name to be updated.
-        :param updates: dict with options to update in section.
+        :param config: configparser object to be rendered.
         """
+        buf = io.StringIO()
+        config.write(buf, space_around_delimiters=False)
+        return buf.getvalue()
+
+    def update_config_section(config, section, updates):
         config[section].update(updates)
-        with open(file_path, "w") as f:
-            config.write(f, space_around_delimiters=False)
+
+
+def read_config_string(config, content):
+    """Reads the text of an ini file into a 'config'.
+
+    :param config: configparser object to be filled.
+    :param content: text of the ini file.
+    """
+    if py_version < 3:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        config.readfp(io.StringIO(content))
+    else:
+        config.read_string(content)
+
+
+def get_section_options(config, section):
+    """Returns the options of a 'section' of a 'config' as a dict.
+
+    :return: None if the section doesn't exist.
+    """
+    if section not in config.sections():
+        return None
+    return dict(config.items(section, raw=True))
+
+
+def save_config_to_file(file_path, config):
+    """Writes a 'config' to disk with a single atomic write.
+
+    :param file_path: Absolute path to the file to be written.
+    :param config: configparser object to be written.
+    :return: the written content.
+    """
+    content = render_config(config)
+    repos_utils.atomic_write(file_path, content)
+    return content
+
+
+def save_section_to_file(file_path, config, section, updates):
+    """Updates a specific 'section' in a 'config' and write to disk.
+
+    :param file_path: Absolute path to the file to be updated.
+    :param config: configparser object created from the file.
+    :param section: section name to be updated.
+    :param updates: dict with options to update in section.
+    """
+    update_config_section(config, section, updates)
+    save_config_to_file(file_path, config)
 
 
 __metaclass__ = type
 
+# Matches section headers the same way configparser does
+SECTION_HEADER_RE = re.compile(r"^\s*\[(.+)\]", re.MULTILINE)
+
+# A configuration file changed by a YumConfig object. 'before' is None for
+# a file that didn't exist.
+ConfigChange = collections.namedtuple(
+    "ConfigChange", ["file_path", "sections", "before", "after"]
+)
+
+
+def scan_sections(file_path):
+    """Returns the set of section names of an ini file.
+
+    Only section headers are looked at, which is much cheaper than fully
+    parsing the file with configparser.
+    """
+    with io.open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        return set(SECTION_HEADER_RE.findall(f.read()))
+
 
 def validated_file_path(file_path):
     if os.path.isfile(file_path) and os.access(file_path, os.W_OK):
@@ -121,6 +190,10 @@ class YumConfig:
     ini format. The class validates the if the configuration files exists and
     if it has the the permissions needed. A list of updatable options may be
     provided to the class constructor.
+
+    Only the files with a section whose options actually changed are
+    written. Every change is recorded in 'changes', and in dry run mode
+    nothing is written to disk at all.
     """
 
     def __init__(
@@ -129,6 +202,7 @@ class YumConfig:
         dir_path=None,
         file_extension=None,
         environment_file=None,
+        dry_run=False,
     ):
         """
         Creates a YumConfig object that holds configuration file
@@ -142,11 +216,20 @@ class YumConfig:
             in the search directory.
         :param environment_file: File to be read before updating environment
             variables.
+        :param dry_run: Only record the changes, without writing any file.
         """
         self.dir_path = dir_path
         self.file_extension = file_extension
         self.valid_options = valid_options
         self.env_file = environment_file
+        self.dry_run = dry_run
+        # file path -> ConfigChange, in the order the files were changed
+        self.changes = collections.OrderedDict()
+        # file path -> content that would have been written in dry run mode
+        self._dry_run_files = {}
+        # file path -> [stat signature, set of section names, whether
+        # configparser can read it or None until checked]
+        self._section_index = {}
 
         # Sanity checks
         if dir_path:
@@ -159,6 +242,72 @@ class YumConfig:
         if self.env_file:
             source_env_file(os.path.expanduser(self.env_file), update=True)
 
+    @property
+    def changed(self):
+        """True if any configuration file was changed."""
+        return bool(self.changes)
+
+    def _file_exists(self, file_path):
+        return file_path in self._dry_run_files or os.path.isfile(file_path)
+
+    def _file_content(self, file_path):
+        """Returns the current content of a file, None if it doesn't exist."""
+        if file_path in self._dry_run_files:
+            return self._dry_run_files[file_path]
+        try:
+            with io.open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def _record_change(self, file_path, sections, before, after):
+        """Records a written file, merged with its previous changes."""
+        change = self.changes.pop(file_path, None)
+        if change is not None:
+            before = change.before
+            sections = change.sections + [
+                s for s in sections if s not in change.sections
+            ]
+        if after != before:
+            self.changes[file_path] = ConfigChange(file_path, sections, before, after)
+
+    def _create_file(self, file_path):
+        """Creates an empty configuration file."""
+        before = self._file_content(file_path)
+        if self.dry_run:
+            self._dry_run_files[file_path] = u""
+        else:
+            repos_utils.atomic_write(file_path, u"")
+        self._record_change(file_path, [], before, u"")
+
+    def _write_config(self, file_path, config, sections):
+        """Writes a 'config' and records the change of its 'sections'."""
+        before = self._file_content(file_path)
+        if self.dry_run:
+            after = render_config(config)
+            self._dry_run_files[file_path] = after
+        else:
+            after = save_config_to_file(file_path, config)
+        self._record_change(file_path, sections, before, after)
+
+    def _save_config(self, file_path, config, sections):
+        """Writes a 'config' if any of its 'sections' changed.
+
+        :param sections: dict with the options of every touched section
+            before it was updated, see get_section_options.
+        :return: True if the file was written.
+        """
+        changed = [
+            section
+            for section, before in sections.items()
+            if get_section_options(config, section) != before
+        ]
+        if not changed:
+            logging.debug("Configuration file %s is already up to date.", file_path)
+            return False
+        self._write_config(file_path, config, changed)
+        return True
+
     def _read_config_file(self, file_path, section=None):
         """Reads a configuration file.
 
@@ -174,7 +323,7 @@ class YumConfig:
 
         valid_file_path = None
         for file in file_paths:
-            if validated_file_path(file):
+            if file in self._dry_run_files or validated_file_path(file):
                 valid_file_path = file
                 break
         if not valid_file_path:
@@ -182,7 +331,10 @@ class YumConfig:
             raise YumConfigNotFound(error_msg=msg)
 
         try:
-            config.read(valid_file_path)
+            if valid_file_path in self._dry_run_files:
+                read_config_string(config, self._dry_run_files[valid_file_path])
+            else:
+                config.read(valid_file_path)
         except cfg_parser.Error:
             msg = "Unable to parse configuration file {0}.".format(valid_file_path)
             raise YumConfigFileParseError(error_msg=msg)
@@ -196,6 +348,53 @@ class YumConfig:
 
         return config, valid_file_path
 
+    def _get_file_sections(self, file_path):
+        """Gets the section names of a file from the section index.
+
+        The file is only scanned again when its mtime, size or inode changed
+        since it was indexed.
+        """
+        if file_path in self._dry_run_files:
+            return set(SECTION_HEADER_RE.findall(self._dry_run_files[file_path]))
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self._section_index.pop(file_path, None)
+            return set()
+        signature = (stat.st_mtime, stat.st_size, stat.st_ino)
+        cached = self._section_index.get(file_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            sections = scan_sections(file_path)
+        except (IOError, OSError):
+            return set()
+        self._section_index[file_path] = [signature, sections, None]
+        return sections
+
+    def _is_parsable(self, file_path):
+        """Tells whether configparser can read a file.
+
+        Only called on the files having the wanted section, the result is
+        kept in the section index until the file changes.
+        """
+        entry = self._section_index.get(file_path)
+        if file_path in self._dry_run_files or entry is None:
+            # rendered by configparser, or vanished since it was scanned
+            return file_path in self._dry_run_files
+        if entry[2] is None:
+            try:
+                cfg_parser.ConfigParser().read(file_path)
+                entry[2] = True
+            except cfg_parser.Error as e:
+                logging.debug(
+                    "Skipping configuration file %s, unable to parse it: %s",
+                    file_path,
+                    e,
+                )
+                entry[2] = False
+        return entry[2]
+
     def _get_config_files(self, section):
         """Gets all configuration file paths for a given section.
 
@@ -208,21 +407,26 @@ class YumConfig:
         # Search for a configuration file that has the provided section
         config_files_path = []
         if section and self.dir_path:
-            for file in os.listdir(self.dir_path):
+            files = os.listdir(self.dir_path)
+            # files created in dry run mode only exist in memory
+            for file_path in self._dry_run_files:
+                file = os.path.basename(file_path)
+                if os.path.dirname(file_path) == self.dir_path and file not in files:
+                    files.append(file)
+            for file in files:
                 # Skip files that don't match the file extension or are not
                 # writable
                 if self.file_extension and not file.endswith(self.file_extension):
                     continue
-                if not os.access(os.path.join(self.dir_path, file), os.W_OK):
+                file_path = os.path.join(self.dir_path, file)
+                if file_path not in self._dry_run_files and not os.access(
+                    file_path, os.W_OK
+                ):
                     continue
-
-                tmp_config = cfg_parser.ConfigParser()
-                try:
-                    tmp_config.read(os.path.join(self.dir_path, file))
-                except cfg_parser.Error:
-                    continue
-                if section in tmp_config.sections():
-                    config_files_path.append(os.path.join(self.dir_path, file))
+                if section in self._get_file_sections(
+                    file_path
+                ) and self._is_parsable(file_path):
+                    config_files_path.append(file_path)
 
         return config_files_path
 
@@ -256,8 +460,10 @@ class YumConfig:
             set_dict[k] = os.path.expandvars(v)
         for file in files:
             config, file = self._read_config_file(file, section=section)
+            before = {section: get_section_options(config, section)}
             # Update configuration file with dict updates
-            save_section_to_file(file, config, section, set_dict)
+            update_config_section(config, section, set_dict)
+            self._save_config(file, config, before)
 
         logging.info("Section '%s' was successfully " "updated.", section)
 
@@ -285,7 +491,8 @@ class YumConfig:
         # Add new section
         config.add_section(section)
         # Update configuration file with dict updates
-        save_section_to_file(file_path, config, section, add_dict)
+        update_config_section(config, section, add_dict)
+        self._write_config(file_path, config, [section])
 
         logging.info("Section '%s' was successfully " "added.", section)
 
@@ -302,8 +509,11 @@ class YumConfig:
                 raise YumConfigInvalidOption(error_msg=msg)
 
         config, file_path = self._read_config_file(file_path)
+        before = {}
         for section in config.sections():
-            save_section_to_file(file_path, config, section, set_dict)
+            before[section] = get_section_options(config, section)
+            update_config_section(config, section, set_dict)
+        self._save_config(file_path, config, before)
 
         logging.info("All sections for '%s' were successfully " "updated.", file_path)
 
@@ -317,11 +527,7 @@ class YumConfig:
             logging.error(msg)
             raise YumConfigUrlError(error_msg=msg)
         config = cfg_parser.ConfigParser()
-        if py_version < 3:
-            sfile = io.StringIO(content)
-            config.readfp(sfile)
-        else:
-            config.read_string(content)
+        read_config_string(config, content)
         return config
 
     def get_options_from_url(self, url, section):
@@ -338,7 +544,7 @@ class YumConfig:
 class YumRepoConfig(YumConfig):
     """Manages yum repo configuration files."""
 
-    def __init__(self, dir_path=None, environment_file=None):
+    def __init__(self, dir_path=None, environment_file=None, dry_run=False):
         conf_dir_path = dir_path or YUM_REPO_DIR
 
         super(YumRepoConfig, self).__init__(
@@ -346,6 +552,7 @@ class YumRepoConfig(YumConfig):
             dir_path=conf_dir_path,
             file_extension=YUM_REPO_FILE_EXTENSION,
             environment_file=environment_file,
+            dry_run=dry_run,
         )
 
     def update_section(
@@ -393,8 +600,7 @@ class YumRepoConfig(YumConfig):
                 # there is nothing to do, we can't create a new config file
                 raise
             # Create a new file if it does not exists
-            with open(file_path, "w+"):
-                pass
+            self._create_file(file_path)
             self.add_section(section, new_set_dict, file_path, enabled=enabled)
 
         except YumConfigInvalidSection:
@@ -431,11 +637,108 @@ class YumRepoConfig(YumConfig):
                 create_if_not_exists=create_if_not_exists,
             )
 
+    def apply_batch(self, entries, create_if_not_exists=True):
+        """Adds or updates many repo sections in a single pass.
+
+        Every affected configuration file is parsed once and written once,
+        after all entries were applied in memory, so an invalid entry leaves
+        all files untouched.
+
+        :param entries: list of dicts with the keys 'name' (required),
+            'set_opts', 'enabled', 'file_path' and 'down_url', with the same
+            meaning as the arguments of add_or_update_section.
+        :param create_if_not_exists: Create missing sections, and missing
+            files when 'file_path' is provided.
+        :return: list of written file paths, only the ones with a changed
+            section.
+        """
+        # requested path -> resolved path, resolved path -> parsed config
+        resolved = {}
+        staged = collections.OrderedDict()
+
+        def stage(path, create=False):
+            if path not in resolved:
+                try:
+                    config, valid_path = self._read_config_file(path)
+                except YumConfigNotFound:
+                    if not create:
+                        raise
+                    config, valid_path = cfg_parser.ConfigParser(), path
+                resolved[path] = valid_path
+                staged.setdefault(valid_path, config)
+            return resolved[path]
+
+        # resolved path -> section name -> options before the batch
+        original = collections.OrderedDict()
+        for entry in entries:
+            section = entry.get("name")
+            if not section:
+                msg = "Every batch entry must provide a repo 'name'."
+                raise YumConfigInvalidSection(error_msg=msg)
+            from_url = entry.get("down_url")
+            update_dict = (
+                self.get_options_from_url(from_url, section) if from_url else {}
+            )
+            update_dict.update(entry.get("set_opts") or {})
+            update_dict.setdefault("name", section)
+            if entry.get("enabled") is not None:
+                update_dict["enabled"] = "1" if entry["enabled"] else "0"
+            if self.valid_options:
+                if not all(key in self.valid_options for key in update_dict):
+                    msg = "One or more provided options are not valid."
+                    raise YumConfigInvalidOption(error_msg=msg)
+            for k, v in update_dict.items():
+                update_dict[k] = os.path.expandvars(v)
+
+            if entry.get("file_path"):
+                files = [stage(entry["file_path"], create=create_if_not_exists)]
+            else:
+                # sections added earlier in this batch are not on disk yet
+                files = [
+                    path for path, config in staged.items() if config.has_section(section)
+                ]
+                for path in self._get_config_files(section):
+                    path = stage(path)
+                    if path not in files:
+                        files.append(path)
+            if not files:
+                msg = (
+                    "No configuration files were found for the provided "
+                    "section {0}".format(section)
+                )
+                raise YumConfigNotFound(error_msg=msg)
+
+            for path in files:
+                config = staged[path]
+                sections = original.setdefault(path, {})
+                if section not in sections:
+                    sections[section] = get_section_options(config, section)
+                if not config.has_section(section):
+                    if not create_if_not_exists:
+                        msg = (
+                            'The provided section "{0}" was not found in the '
+                            "configuration file {1}."
+                        ).format(section, path)
+                        raise YumConfigInvalidSection(error_msg=msg)
+                    config.add_section(section)
+                update_config_section(config, section, update_dict)
+
+        written = [
+            path
+            for path, sections in original.items()
+            if self._save_config(path, staged[path], sections)
+        ]
+        logging.info("Batch updated %d repo configuration files.", len(written))
+        return written
+
 
 class YumGlobalConfig(YumConfig):
     """Manages yum global configuration file."""
 
-    def __init__(self, file_path=None, environment_file=None):
+    def __init__(self, file_path=None, environment_file=None, dry_run=False):
+        super(YumGlobalConfig, self).__init__(
+            environment_file=environment_file, dry_run=dry_run
+        )
         self.conf_file_path = file_path or YUM_GLOBAL_CONFIG_FILE_PATH
         logging.info(
             "Using '%s' as yum global configuration " "file.", self.conf_file_path
@@ -451,10 +754,7 @@ class YumGlobalConfig(YumConfig):
                 config = cfg_parser.ConfigParser()
                 config.read(self.conf_file_path)
                 config.add_section("main")
-                with open(self.conf_file_path, "w+") as file:
-                    config.write(file)
-
-        super(YumGlobalConfig, self).__init__(environment_file=environment_file)
+                self._write_config(self.conf_file_path, config, ["main"])
 
     def update_section(self, section, set_dict, file_path=None):
         super(YumGlobalConfig, self).update_section(
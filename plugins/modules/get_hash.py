@@ -39,7 +39,11 @@ options:
         type: str
         default: current-podified
     dlrn_url:
-        description: The url of the DLRN server to use for hash queries
+        description:
+          - The url of the DLRN server to use for hash queries.
+          - A comma separated list of equivalent DLRN servers may be given in
+            order of preference. The next server is also queried when the
+            previous one is slow or fails and the first answer is used.
         required: false
         type: str
         default: https://trunk.rdoproject.org
@@ -48,7 +52,32 @@ options:
         required: false
         type: str
         default: None
-
+    queries:
+        description:
+          - List of queries resolved concurrently in a single module run.
+          - Every query accepts the os_version, release, component, tag and
+            dlrn_hash_tag keys, missing keys default to the module options.
+          - A failed query is reported in its result and does not fail the
+            task. Two queries resolving to the same result key fail the task.
+        required: false
+        type: list
+        elements: dict
+    workers:
+        description: Maximum number of queries resolved concurrently
+        required: false
+        type: int
+        default: 8
+    backend:
+        description:
+          - How queries are resolved. C(files) fetches the commit.yaml or
+            delorean.repo.md5 file of each query.
+          - C(api) asks the promotions endpoint of the DLRN API for many
+            components at once and falls back to C(files) for the queries
+            it can't answer.
+        required: false
+        type: str
+        default: files
+        choices: [files, api]
 
 author:
     - Marios Andreou (@marios)
@@ -61,6 +90,21 @@ EXAMPLES = r"""
     release: victoria
     component: tripleo
     dlrn_url: 'https://foo.bar.baz'
+
+- name: Get the hash info of several components in one run
+  repo_setup_get_hash:
+    os_version: centos9
+    tag: current-podified
+    queries:
+      - component: common
+      - component: tripleo
+      - component: tripleo
+        release: antelope
+  register: hashes
+
+- name: Show the full hash of the master common component
+  debug:
+    msg: "{{ hashes.results['centos9/master/common/current-podified'].full_hash }}"
 """
 
 RETURN = r"""
@@ -94,10 +138,91 @@ dlrn_api_url:
     type: str
     returned: always
     sample: 'https://trunk.rdoproject.org/api-centos-master-uc'  # noqa E501
+results:
+    description:
+      - Hash info of every query, keyed by
+        os_version/release/component/tag, with "@dlrn_hash_tag" appended
+        when set and an empty component when not set.
+      - Each entry has the same keys as a single query plus success, and an
+        error message when it failed.
+    type: dict
+    returned: when queries is set
+    sample:
+      centos9/master/common/current-podified:
+        success: true
+        full_hash: 'f47f1db5af04ddd1ab4cc3ccadf95884d335b3f3_92f50ace'
+        commit_hash: 'f47f1db5af04ddd1ab4cc3ccadf95884d335b3f3'
+        distro_hash: '92f50acecd0a218936b7163e8362e75913b62af2'
+        extended_hash: None
+        dlrn_url: 'https://trunk.rdoproject.org/centos9-master/component/common/current-podified/commit.yaml'  # noqa E501
+        dlrn_api_url: 'https://trunk.rdoproject.org/api-centos9-master-uc'
 """
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 
+try:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.get_hash import (
+        dlrn_api,
+        hash_info,
+    )
+except ImportError:
+    from repo_setup.get_hash import dlrn_api, hash_info
+
+RESULT_KEYS = [
+    "commit_hash",
+    "distro_hash",
+    "full_hash",
+    "extended_hash",
+    "dlrn_url",
+    "dlrn_api_url",
+]
+
+
+def query_key(query):
+    key = "/".join(
+        query.get(k) or "" for k in ["os_version", "release", "component", "tag"]
+    )
+    if query.get("dlrn_hash_tag"):
+        key += "@" + query["dlrn_hash_tag"]
+    return key
+
+
+def resolve_queries(module, dlrn_url):
+    if module.params.get("backend") == "api":
+        iter_resolved = dlrn_api.iter_resolved
+    else:
+        iter_resolved = hash_info.iter_resolved
+
+    queries = []
+    keys = set()
+    for entry in module.params.get("queries"):
+        unknown = set(entry) - set(hash_info.QUERY_KEYS)
+        if unknown:
+            module.fail_json(
+                msg="Unsupported keys in query: %s" % ", ".join(sorted(unknown))
+            )
+        query = dict((k, module.params.get(k)) for k in hash_info.QUERY_KEYS)
+        query.update((k, v) for k, v in entry.items() if v is not None)
+        # the results are keyed by query, a duplicate would overwrite one
+        if query_key(query) in keys:
+            module.fail_json(msg="Duplicate query: %s" % query_key(query))
+        keys.add(query_key(query))
+        queries.append(query)
+
+    results = {}
+    for query, hash_result in iter_resolved(
+        queries,
+        config={"dlrn_url": dlrn_url},
+        workers=module.params.get("workers"),
+    ):
+        if isinstance(hash_result, Exception):
+            results[query_key(query)] = dict(success=False, error=str(hash_result))
+        else:
+            entry = dict((k, getattr(hash_result, k)) for k in RESULT_KEYS)
+            entry["success"] = True
+            results[query_key(query)] = entry
+    return results
+
 
 def run_module():
     result = dict(
@@ -115,31 +240,35 @@ def run_module():
             type="str", required=False, default="https://trunk.rdoproject.org"
         ),
         dlrn_hash_tag=dict(type="str", required=False, default=None),
-
+        queries=dict(type="list", elements="dict", required=False, default=None),
+        workers=dict(type="int", required=False, default=8),
+        backend=dict(
+            type="str", required=False, default="files", choices=["files", "api"]
+        ),
     )
 
     module = AnsibleModule(argument_spec, supports_check_mode=False)
 
     try:
-        from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.get_hash.hash_info import (
-            HashInfo,
-        )
-
         os_version = module.params.get("os_version")
         release = module.params.get("release")
         component = module.params.get("component")
         tag = module.params.get("tag")
         dlrn_url = module.params.get("dlrn_url")
 
-        hash_result = HashInfo(
-            os_version, release, component, tag, config={"dlrn_url": dlrn_url}
-        )
-        result["commit_hash"] = hash_result.commit_hash
-        result["distro_hash"] = hash_result.distro_hash
-        result["full_hash"] = hash_result.full_hash
-        result["extended_hash"] = hash_result.extended_hash
-        result["dlrn_url"] = hash_result.dlrn_url
-        result["dlrn_api_url"] = hash_result.dlrn_api_url
+        if module.params.get("queries") is not None:
+            result["results"] = resolve_queries(module, dlrn_url)
+        else:
+            resolve = dlrn_api.resolve if module.params.get("backend") == "api" else hash_info.HashInfo
+            hash_result = resolve(
+                os_version, release, component, tag, config={"dlrn_url": dlrn_url}
+            )
+            result["commit_hash"] = hash_result.commit_hash
+            result["distro_hash"] = hash_result.distro_hash
+            result["full_hash"] = hash_result.full_hash
+            result["extended_hash"] = hash_result.extended_hash
+            result["dlrn_url"] = hash_result.dlrn_url
+            result["dlrn_api_url"] = hash_result.dlrn_api_url
         result["success"] = True
     except Exception as exc:
         result["error"] = str(exc)
@@ -0,0 +1,312 @@
+#!/usr/bin/python
+# Copyright 2021 Red Hat, Inc.
+# GNU General Public License v3.0+ (see COPYING or
+# https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import absolute_import, division, print_function
+
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+---
+module: repo_setup
+
+short_description: Install the RDO Trunk, Ceph and base OS repo files
+
+version_added: "1.0.0"
+
+description:
+    - Runs the repo-setup installer in-process. Repo files are only written
+      when their content differs and the dnf metadata is only cleaned for
+      changed repos, so the task reports changed only when a repo file was
+      written or removed.
+    - Supports check mode and diff mode. Check mode leaves the host
+      untouched, the download cache and the mirror ranking are only read.
+
+requirements:
+    - python >= 3
+
+options:
+    repos:
+        description:
+          - The repos to install, e.g. current-podified, deps and ceph.
+        required: true
+        type: list
+        elements: str
+    distro:
+        description:
+          - Target distro, e.g. centos9. Defaults to the distro of the host.
+        type: str
+    branch:
+        description:
+          - Target branch, the lowercase name of the OpenStack release.
+        type: str
+        default: master
+    output_path:
+        description:
+          - Directory in which to save the repos.
+        type: path
+        default: /etc/yum.repos.d
+    targets:
+        description:
+          - Install the repos for many distro and branch pairs, each in its
+            own output_path, sharing the downloads. Replaces distro, branch
+            and output_path.
+          - The dnf metadata is only cleaned for targets in /etc/yum.repos.d.
+        type: list
+        elements: dict
+        suboptions:
+            distro:
+                description: Target distro.
+                type: str
+                required: true
+            branch:
+                description: Target branch.
+                type: str
+                required: true
+            output_path:
+                description: Directory in which to save the repos.
+                type: path
+                required: true
+    mirror:
+        description:
+          - Server from which to install base OS packages, 'auto' picks the
+            fastest of the default mirror and mirror_candidates.
+        type: str
+    mirror_candidates:
+        description:
+          - Comma separated base OS mirrors ranked when mirror is 'auto'.
+        type: str
+    rdo_mirror:
+        description:
+          - Server from which to install RDO packages, or a comma separated
+            list of equivalent servers in order of preference.
+        type: str
+        default: https://trunk.rdoproject.org
+    dlrn_hash_tag:
+        description:
+          - Install the DLRN repos of this specific hash.
+        type: str
+    stream:
+        description:
+          - Install the CentOS Stream repos.
+        type: bool
+        default: true
+    clean_mode:
+        description:
+          - Which dnf metadata to clean after the repos changed.
+        type: str
+        choices: [all, changed, none]
+        default: changed
+    cache:
+        description:
+          - Revalidate the downloaded repo files against the copies cached in
+            cache_dir.
+        type: bool
+        default: true
+    cache_dir:
+        description:
+          - Directory of the download cache.
+        type: path
+        default: /var/cache/repo-setup
+    durability:
+        description:
+          - How hard to make sure written files reach stable storage.
+        type: str
+        choices: [none, file, full]
+
+author:
+    - OpenStack K8s Operators (@openstack-k8s-operators)
+"""
+
+EXAMPLES = r"""
+- name: Install the current-podified and ceph repos
+  become: true
+  repo_setup.repos.repo_setup:
+    repos:
+      - current-podified
+      - ceph
+    branch: antelope
+  notify: Rebuild the dnf cache
+
+- name: Render the repos of several images
+  repo_setup.repos.repo_setup:
+    repos:
+      - current-podified
+    targets:
+      - distro: centos9
+        branch: master
+        output_path: /srv/images/centos9-master/etc/yum.repos.d
+      - distro: rhel9
+        branch: antelope
+        output_path: /srv/images/rhel9-antelope/etc/yum.repos.d
+"""
+
+RETURN = r"""
+written:
+    description: Repo files written, or that would be in check mode.
+    type: list
+    elements: str
+    returned: always
+    sample: ['/etc/yum.repos.d/delorean.repo']
+removed:
+    description: Old repo files removed, or that would be in check mode.
+    type: list
+    elements: str
+    returned: always
+    sample: ['/etc/yum.repos.d/delorean-current-podified.repo']
+unchanged:
+    description: Repo files whose content was already up to date.
+    type: list
+    elements: str
+    returned: always
+    sample: ['/etc/yum.repos.d/delorean-deps.repo']
+changed_repo_ids:
+    description: Ids of the repos defined in the written and removed files.
+    type: list
+    elements: str
+    returned: always
+    sample: ['delorean', 'delorean-antelope-testing']
+fetched:
+    description: Repo file urls downloaded, from the RDO mirror that served each.
+    type: list
+    elements: str
+    returned: always
+    sample: ['https://trunk.rdoproject.org/centos9-master/current-podified/delorean.repo']
+timings:
+    description: Seconds spent in each phase of the run.
+    type: dict
+    returned: always
+    sample: {validate: 0.01, install: 0.42, remove: 0.0, clean: 0.03}
+"""
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+try:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+        cache as repos_cache,
+        main as repo_setup_main,
+        utils as repos_utils,
+    )
+except ImportError:
+    from repo_setup import cache as repos_cache
+    from repo_setup import main as repo_setup_main
+    from repo_setup import utils as repos_utils
+
+
+def build_diff(repo_files):
+    """Returns the before/after diff of every changed repo file"""
+    return [
+        dict(
+            before_header=repo_file.path,
+            after_header=repo_file.path,
+            before=repo_file.old_content or "",
+            after=repo_file.content or "",
+        )
+        for repo_file in repo_files
+        if repo_file.changed
+    ]
+
+
+def run_module():
+    argument_spec = dict(
+        repos=dict(type="list", elements="str", required=True),
+        distro=dict(type="str", required=False, default=None),
+        branch=dict(type="str", required=False, default="master"),
+        output_path=dict(
+            type="path", required=False, default=repo_setup_main.DEFAULT_OUTPUT_PATH
+        ),
+        targets=dict(
+            type="list",
+            elements="dict",
+            required=False,
+            default=None,
+            options=dict(
+                distro=dict(type="str", required=True),
+                branch=dict(type="str", required=True),
+                output_path=dict(type="path", required=True),
+            ),
+        ),
+        mirror=dict(type="str", required=False, default=None),
+        mirror_candidates=dict(type="str", required=False, default=None),
+        rdo_mirror=dict(
+            type="str", required=False, default=repo_setup_main.DEFAULT_RDO_MIRROR
+        ),
+        dlrn_hash_tag=dict(type="str", required=False, default=None),
+        stream=dict(type="bool", required=False, default=True),
+        clean_mode=dict(
+            type="str",
+            required=False,
+            default="changed",
+            choices=repo_setup_main.CLEAN_MODES,
+        ),
+        cache=dict(type="bool", required=False, default=True),
+        cache_dir=dict(
+            type="path", required=False, default=repos_cache.DEFAULT_CACHE_DIR
+        ),
+        durability=dict(
+            type="str",
+            required=False,
+            default=None,
+            choices=repos_utils.DURABILITY_LEVELS,
+        ),
+    )
+
+    module = AnsibleModule(argument_spec, supports_check_mode=True)
+    params = module.params
+
+    targets = None
+    if params["targets"]:
+        targets = [
+            repo_setup_main.Target(t["distro"], t["branch"], t["output_path"])
+            for t in params["targets"]
+        ]
+    options = repo_setup_main.RepoSetupOptions(
+        params["repos"],
+        distro=params["distro"],
+        branch=params["branch"],
+        output_path=params["output_path"],
+        targets=targets,
+        mirror=params["mirror"],
+        mirror_candidates=params["mirror_candidates"],
+        rdo_mirror=params["rdo_mirror"],
+        dlrn_hash_tag=params["dlrn_hash_tag"],
+        stream=params["stream"],
+        no_stream=not params["stream"],
+        clean_mode=params["clean_mode"],
+        cache_dir=params["cache_dir"],
+        no_cache=not params["cache"],
+        durability=params["durability"],
+        dry_run=module.check_mode,
+    )
+
+    try:
+        run_result = repo_setup_main.run(options)
+    except Exception as exc:
+        module.fail_json(msg=str(exc))
+
+    changed_repo_ids = set()
+    for repo_file in run_result.repo_files:
+        if repo_file.changed:
+            changed_repo_ids.update(repo_file.repo_ids)
+    result = dict(
+        changed=bool(run_result.written or run_result.removed),
+        written=run_result.written,
+        removed=run_result.removed,
+        unchanged=run_result.unchanged,
+        changed_repo_ids=sorted(changed_repo_ids),
+        fetched=run_result.fetched,
+        timings=dict(run_result.timings),
+    )
+    if module._diff:
+        result["diff"] = build_diff(run_result.repo_files)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,10 @@ version_added: "1.0.0"
 description:
     - Update specific options for different yum configuration files like
       yum repos, yum modules and yum global configuration.
+    - Configuration files are only written when an option actually changed,
+      so the task reports changed only when a file was written.
+    - Supports check mode and diff mode, except for the type 'module' that
+      is skipped in check mode.
 
 options:
     type:
@@ -177,7 +181,14 @@ EXAMPLES = r"""
       - /etc/yum.repos.d/CentOS-Linux-BaseOS.repo
 """
 
-RETURN = r""" # """
+RETURN = r"""
+changed_files:
+    description: Configuration files written, or that would be in check mode.
+    type: list
+    elements: str
+    returned: always
+    sample: ['/etc/yum.repos.d/CentOS-Stream-AppStream.repo']
+"""
 
 import os  # noqa: E402
 
@@ -185,6 +196,19 @@ from ansible.module_utils import six  # noqa: E402
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 
 
+def build_diff(changes):
+    """Returns the before/after diff of every changed configuration file"""
+    return [
+        dict(
+            before_header=change.file_path,
+            after_header=change.file_path,
+            before=change.before or "",
+            after=change.after,
+        )
+        for change in changes
+    ]
+
+
 def run_module():
     try:
         import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.yum_config.constants as const
@@ -226,7 +250,7 @@ def run_module():
     module = AnsibleModule(
         argument_spec=module_args,
         required_if=required_if_params,
-        supports_check_mode=False,
+        supports_check_mode=True,
     )
 
     operations_not_supp_in_py2 = ["module", "enable-compose-repos"]
@@ -262,6 +286,14 @@ def run_module():
             "({0}-{1}).".format(distro, major_version)
         )
         module.fail_json(msg=msg)
+    if module.params["type"] == "module" and module.check_mode:
+        # dnf can't tell what a module transaction would change
+        module.exit_json(
+            changed=False,
+            skipped=True,
+            changed_files=[],
+            msg="Check mode is not supported for configuration type 'module'.",
+        )
 
     # 'set_options' expects a dict that can also contains a list of values.
     # List of elements will be converted to a comma-separated list
@@ -274,6 +306,7 @@ def run_module():
                 m_set_opts[k] = str(v)
 
     # Module execution
+    config_obj = None
     try:
         try:
             import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.yum_config.yum_config as cfg
@@ -284,6 +317,7 @@ def run_module():
             config_obj = cfg.YumRepoConfig(
                 dir_path=module.params["dir_path"],
                 environment_file=module.params["environment_file"],
+                dry_run=module.check_mode,
             )
             if module.params["name"]:
                 config_obj.add_or_update_section(
@@ -305,6 +339,7 @@ def run_module():
             config_obj = cfg.YumGlobalConfig(
                 file_path=module.params["file_path"],
                 environment_file=module.params["environment_file"],
+                dry_run=module.check_mode,
             )
             config_obj.update_section("main", m_set_opts)
 
@@ -315,15 +350,16 @@ def run_module():
                 import repo_setup.yum_config.compose_repos as repos
 
             # 1. Create compose repo config object
-            repo_obj = repos.YumComposeRepoConfig(
+            config_obj = repos.YumComposeRepoConfig(
                 module.params["compose_url"],
                 module.params["centos_release"],
                 dir_path=module.params["dir_path"],
                 arch=module.params["arch"],
                 environment_file=module.params["environment_file"],
+                dry_run=module.check_mode,
             )
             # 2. enable CentOS compose repos
-            repo_obj.enable_compose_repos(
+            config_obj.enable_compose_repos(
                 variants=module.params["variants"],
                 override_repos=module.params["disable_conflicting_variants"],
             )
@@ -338,7 +374,7 @@ def run_module():
                     valid_path = rel_path
 
                 if valid_path is not None:
-                    repo_obj.update_all_sections(valid_path, enabled=False)
+                    config_obj.update_all_sections(valid_path, enabled=False)
 
         elif module.params["type"] == "module":
             try:
@@ -373,12 +409,24 @@ def run_module():
         module.fail_json(msg=str(exc))
 
     # Successful module execution
+    if config_obj is None:
+        # dnf modules are always reported as changed
+        changes = []
+        changed = True
+    else:
+        changes = list(config_obj.changes.values())
+        changed = config_obj.changed
+    if changed:
+        msg = "Yum {0} configuration was successfully updated."
+    else:
+        msg = "Yum {0} configuration was already up to date."
     result = {
-        "changed": True,
-        "msg": "Yum {0} configuration was successfully updated.".format(
-            module.params["type"]
-        ),
+        "changed": changed,
+        "changed_files": [change.file_path for change in changes],
+        "msg": msg.format(module.params["type"]),
     }
+    if module._diff:
+        result["diff"] = build_diff(changes)
     module.exit_json(**result)
 
 
@@ -0,0 +1,98 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Compares the fast commit.yaml extraction with a full YAML parse.
+
+Usage: python -m tests.benchmarks.bench_commit_yaml [--commits N ...]
+"""
+
+import argparse
+import hashlib
+import timeit
+
+import yaml
+
+import repo_setup.get_hash.hash_info as hash_info
+
+COMMIT_TEMPLATE = """- artifacts: repos/component/common/{h[0]}{h[1]}/{h[2]}{h[3]}/{h}_{d8}/openstack-fake-1.0.0-0.el9.src.rpm,repos/component/common/{h[0]}{h[1]}/{h[2]}{h[3]}/{h}_{d8}/python3-fake-1.0.0-0.el9.noarch.rpm
+  civotes: '[]'
+  commit_branch: master
+  commit_hash: {h}
+  component: common
+  distgit_dir: /home/centos9-master-uc/data/openstack-fake_distro/
+  distro_hash: {d}
+  dt_build: '1616646776'
+  dt_commit: '1616646661.0'
+  dt_distro: '1616411951'
+  dt_extended: '0'
+  extended_hash: None
+  flags: '0'
+  id: '{i}'
+  notes: OK
+  project_name: openstack-fake-{i}
+  promotions: '[]'
+  repo_dir: /home/centos9-master-uc/data/openstack-fake
+  status: SUCCESS
+  type: rpm
+"""
+
+
+def make_commit_yaml(commits):
+    entries = []
+    for i in range(commits):
+        h = hashlib.sha1(str(i).encode()).hexdigest()
+        d = hashlib.sha1(str(-i).encode()).hexdigest()
+        entries.append(COMMIT_TEMPLATE.format(h=h, d=d, d8=d[:8], i=i))
+    return "commits:\n" + "".join(entries)
+
+
+def full_parse(content):
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    first = yaml.load(content, Loader=loader)["commits"][0]
+    return dict((k, first[k]) for k in hash_info.COMMIT_YAML_KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--commits",
+        type=int,
+        nargs="+",
+        default=[1, 100, 1000, 10000],
+        help="number of commits in the synthetic commit.yaml files",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs per measurement"
+    )
+    args = parser.parse_args()
+
+    print("libyaml C loader available: %s" % hasattr(yaml, "CSafeLoader"))
+    print("%10s %12s %14s %12s" % ("commits", "size (KiB)", "full (ms)", "fast (ms)"))
+    for commits in args.commits:
+        content = make_commit_yaml(commits)
+        fast = hash_info.first_commit_from_commit_yaml(content)
+        assert fast == full_parse(content), "fast path result differs"
+        timings = []
+        for func in (full_parse, hash_info.first_commit_from_commit_yaml):
+            best = min(
+                timeit.repeat(lambda: func(content), number=1, repeat=args.repeat)
+            )
+            timings.append(best * 1000)
+        print(
+            "%10d %12.1f %14.3f %12.3f"
+            % (commits, len(content) / 1024.0, timings[0], timings[1])
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@
 #
 #
 
+import json
+
 TEST_COMMIT_YAML_COMPONENT = """
     commits:
     - artifacts: repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/openstack-tacker-4.1.0-0.20210325043415.476a52d.el8.src.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/python3-tacker-doc-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/python3-tacker-tests-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/openstack-tacker-common-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/python3-tacker-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/openstack-tacker-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm
@@ -92,3 +94,54 @@ os_versions:
   - rhel9
 
 """
+
+TEST_PROMOTIONS = [
+    {
+        'commit_hash': '476a52df13202a44336c8b01419f8b73b93d93eb',
+        'distro_hash': '1f5a41f31db8e3eb51caa9c0e201ab0583747be8',
+        'extended_hash': None,
+        'aggregate_hash': 'a96366960d5f9b08f78075b7560514e7',
+        'component': 'common',
+        'promote_name': 'current-podified',
+        'timestamp': 1616646776,
+    },
+    {
+        'commit_hash': 'f47f1db5af04ddd1ab4cc3ccadf95884d335b3f3',
+        'distro_hash': '92f50acecd0a218936b7163e8362e75913b62af2',
+        'extended_hash': None,
+        'aggregate_hash': '8f4a0d3b4e4f2c8d8d0fb22ea3b8a8e1',
+        'component': 'tripleo',
+        'promote_name': 'current-podified',
+        'timestamp': 1616640000,
+    },
+    {
+        'commit_hash': '0123456789abcdef0123456789abcdef01234567',
+        'distro_hash': 'fedcba9876543210fedcba9876543210fedcba98',
+        'extended_hash': None,
+        'aggregate_hash': '00000000000000000000000000000000',
+        'component': 'common',
+        'promote_name': 'current-podified',
+        'timestamp': 1616000000,
+    },
+]
+
+
+class FakeDlrn(object):
+    """Fake DLRN server and API, to be used as a replacement of http_get.
+
+    Known URLs return their configured (content, status), any other URL
+    returns a 404. All requested URLs are recorded in 'requests'.
+    """
+
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.requests = []
+
+    def add_promotions(self, dlrn_api_url, tag, promotions, limit=100):
+        url = '%s/api/promotions?promote_name=%s&limit=%d' % (
+            dlrn_api_url, tag, limit)
+        self.responses[url] = (json.dumps(promotions), 200)
+
+    def __call__(self, url):
+        self.requests.append(url)
+        return self.responses.get(url, ('Not Found', 404))
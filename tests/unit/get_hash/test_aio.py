@@ -0,0 +1,167 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import mock_open, MagicMock, patch
+
+import repo_setup.get_hash.aio as aio
+import repo_setup.get_hash.exceptions as exc
+import repo_setup.get_hash.hash_info as thi
+from . import fakes as test_fakes
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@mock.patch(
+    'builtins.open', new_callable=mock_open, read_data=test_fakes.CONFIG_FILE
+)
+class TestAio(unittest.TestCase):
+    """Tests for the asyncio hash info API. The builtin 'open' function is
+    mocked at a class level so we can mock the config.yaml with the
+    contents of the fakes.CONFIG_FILE
+    """
+
+    def setUp(self):
+        super(TestAio, self).setUp()
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+
+    def test_create(self, mock_config):
+        mocked = MagicMock(
+            return_value=(test_fakes.TEST_COMMIT_YAML_COMPONENT, 200))
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            result = run(aio.create(
+                'centos8', 'master', 'common', 'current-podified'))
+            expected = thi.HashInfo(
+                'centos8', 'master', 'common', 'current-podified')
+        self.assertIsInstance(result, thi.HashInfo)
+        self.assertEqual(vars(expected), vars(result))
+
+    def test_create_invalid_response(self, mock_config):
+        mocked = MagicMock(return_value=('Not found', 404))
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            self.assertRaises(
+                exc.HashInvalidDLRNResponse, run,
+                aio.create('centos8', 'master', None, 'current-podified'))
+
+    def test_create_mirrors(self, mock_config):
+        def fake_http_get(url):
+            if url.startswith('https://woo/'):
+                return 'Great Scott!', -1
+            return test_fakes.TEST_REPO_MD5, 200
+
+        config = {'dlrn_url': 'https://woo,https://yay'}
+        mocked = MagicMock(side_effect=fake_http_get)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            result = run(aio.create('centos8', 'master', None,
+                                    'current-podified', config=config,
+                                    limiter=aio.HostLimiter()))
+        self.assertEqual(test_fakes.TEST_REPO_MD5, result.full_hash)
+        self.assertEqual(
+            'https://yay/centos8-master/current-podified/delorean.repo.md5',
+            result.dlrn_url)
+        self.assertEqual('https://yay/api-centos8-master-uc',
+                         result.dlrn_api_url)
+        self.assertEqual(2, mocked.call_count)
+
+    def test_create_mirrors_limiter(self, mock_config):
+        class RecordingLimiter(aio.HostLimiter):
+            def for_url(self, url):
+                hosts.append(url.split('/')[2])
+                return super(RecordingLimiter, self).for_url(url)
+
+        hosts = []
+        config = {'dlrn_url': 'https://woo,https://yay'}
+        mocked = MagicMock(side_effect=[
+            ('Not found', 404), (test_fakes.TEST_REPO_MD5, 200)])
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            run(aio.create('centos8', 'master', None, 'current-podified',
+                           config=config, limiter=RecordingLimiter()))
+        # each request takes a slot of the host it is sent to
+        self.assertEqual(['woo', 'yay'], hosts)
+
+    @mock.patch('repo_setup.utils.hedge_delay', return_value=0.01)
+    def test_create_mirrors_hedged(self, mock_delay, mock_config):
+        def fake_http_get(url):
+            if url.startswith('https://woo/'):
+                time.sleep(0.2)
+            return test_fakes.TEST_REPO_MD5, 200
+
+        config = {'dlrn_url': 'https://woo,https://yay'}
+        mocked = MagicMock(side_effect=fake_http_get)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            result = run(aio.create('centos8', 'master', None,
+                                    'current-podified', config=config))
+        self.assertEqual(
+            'https://yay/centos8-master/current-podified/delorean.repo.md5',
+            result.dlrn_url)
+        self.assertEqual(2, mocked.call_count)
+
+    def test_resolve_many(self, mock_config):
+        def fake_http_get(url):
+            if 'centos8-zed' in url:
+                return 'Not found', 404
+            return test_fakes.TEST_REPO_MD5, 200
+
+        queries = [{'os_version': 'centos8', 'release': release,
+                    'tag': 'current-podified'}
+                   for release in ('master', 'zed', 'wallaby')]
+        mocked = MagicMock(side_effect=fake_http_get)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            results = run(aio.resolve_many(queries))
+        self.assertEqual('master', results[0].release)
+        self.assertIsInstance(results[1], exc.HashInvalidDLRNResponse)
+        self.assertEqual('wallaby', results[2].release)
+
+    def test_resolve_many_per_host_limit(self, mock_config):
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def fake_http_get(url):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return test_fakes.TEST_REPO_MD5, 200
+
+        queries = [{'os_version': 'centos8', 'release': 'master',
+                    'tag': tag} for tag in ['current', 'consistent'] * 4]
+        mocked = MagicMock(side_effect=fake_http_get)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            results = run(aio.resolve_many(queries, per_host_limit=2))
+        self.assertEqual(8, len(results))
+        self.assertEqual(2, peak[0])
+
+    def test_host_limiter(self, mock_config):
+        limiter = aio.HostLimiter(per_host_limit=1)
+        self.assertIs(limiter.for_url('https://trunk.rdoproject.org/a'),
+                      limiter.for_url('https://trunk.rdoproject.org/b'))
+        self.assertIsNot(limiter.for_url('https://trunk.rdoproject.org/a'),
+                         limiter.for_url('https://awoo.com/a'))
+        self.assertRaises(ValueError, aio.HostLimiter, 0)
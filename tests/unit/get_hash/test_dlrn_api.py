@@ -0,0 +1,136 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import unittest
+from unittest import mock
+from unittest.mock import mock_open, patch
+
+import repo_setup.get_hash.dlrn_api as dlrn_api
+import repo_setup.get_hash.exceptions as exc
+import repo_setup.get_hash.hash_info as thi
+from . import fakes as test_fakes
+
+DLRN_URL = 'https://trunk.rdoproject.org'
+API_URL = DLRN_URL + '/api-centos9-master-uc'
+
+
+@mock.patch(
+    'builtins.open', new_callable=mock_open, read_data=test_fakes.CONFIG_FILE
+)
+class TestDlrnApi(unittest.TestCase):
+    """Tests for the DLRN API promotions backend, served by a fake DLRN.
+    The builtin 'open' function is mocked at a class level so we can mock
+    the config.yaml with the contents of the fakes.CONFIG_FILE
+    """
+
+    def setUp(self):
+        super(TestDlrnApi, self).setUp()
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+        self.dlrn = test_fakes.FakeDlrn()
+        self.dlrn.add_promotions(API_URL, 'current-podified',
+                                 test_fakes.TEST_PROMOTIONS)
+        patcher = patch('repo_setup.get_hash.hash_info.http_get', self.dlrn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _query(self, component=None, tag='current-podified', **kwargs):
+        query = {'os_version': 'centos9', 'release': 'master',
+                 'component': component, 'tag': tag}
+        query.update(kwargs)
+        return query
+
+    def test_iter_resolved_single_request(self, mock_config):
+        queries = [self._query('common'), self._query('tripleo'),
+                   self._query()]
+        results = dict((query['component'], result) for query, result in
+                       dlrn_api.iter_resolved(queries))
+
+        self.assertEqual(1, len(self.dlrn.requests))
+        common = results['common']
+        self.assertIsInstance(common, thi.HashInfo)
+        self.assertEqual('476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3',
+                         common.full_hash)
+        self.assertEqual('1f5a41f31db8e3eb51caa9c0e201ab0583747be8',
+                         common.distro_hash)
+        self.assertEqual(
+            DLRN_URL + '/centos9-master/component/common/current-podified/'
+            'commit.yaml', common.dlrn_url)
+        self.assertEqual('f47f1db5af04ddd1ab4cc3ccadf95884d335b3f3_92f50ace',
+                         results['tripleo'].full_hash)
+        # the newest aggregate hash of the tag
+        self.assertEqual(test_fakes.TEST_REPO_MD5, results[None].full_hash)
+        self.assertIsNone(results[None].commit_hash)
+
+    def test_iter_resolved_mirrors(self, mock_config):
+        config = {'dlrn_url': 'https://woo,' + DLRN_URL}
+        queries = [self._query('common'), self._query('tripleo')]
+        results = dict((query['component'], result) for query, result in
+                       dlrn_api.iter_resolved(queries, config=config))
+
+        # the first mirror failed, the second answered for both queries
+        self.assertEqual(
+            [dlrn_api.promotions_url('https://woo/api-centos9-master-uc',
+                                     'current-podified'),
+             dlrn_api.promotions_url(API_URL, 'current-podified')],
+            self.dlrn.requests)
+        common = results['common']
+        self.assertEqual('476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3',
+                         common.full_hash)
+        self.assertEqual(
+            DLRN_URL + '/centos9-master/component/common/current-podified/'
+            'commit.yaml', common.dlrn_url)
+        self.assertEqual(API_URL, common.dlrn_api_url)
+
+    def test_iter_resolved_fallback(self, mock_config):
+        commit_yaml_url = (DLRN_URL + '/centos9-master/component/cinder/'
+                           'current-podified/commit.yaml')
+        self.dlrn.responses[commit_yaml_url] = (
+            test_fakes.TEST_COMMIT_YAML_COMPONENT, 200)
+        queries = [self._query('cinder'), self._query('common', tag='current')]
+
+        results = [result for _, result in dlrn_api.iter_resolved(queries)]
+
+        self.assertEqual(
+            '476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3',
+            results[0].full_hash)
+        self.assertEqual('cinder', results[0].component)
+        # there are no promotions and no file for the current tag
+        self.assertIsInstance(results[1], exc.HashInvalidDLRNResponse)
+        self.assertIn(commit_yaml_url, self.dlrn.requests)
+
+    def test_iter_resolved_dlrn_hash_tag_uses_files(self, mock_config):
+        queries = [self._query('common', dlrn_hash_tag='476a52df')]
+        results = list(dlrn_api.iter_resolved(queries))
+
+        self.assertEqual(1, len(self.dlrn.requests))
+        self.assertTrue(self.dlrn.requests[0].endswith(
+            '/47/6a/476a52df/commit.yaml'))
+        self.assertIsInstance(results[0][1], exc.HashInvalidDLRNResponse)
+
+    def test_fetch_promotions_malformed(self, mock_config):
+        self.dlrn.responses[dlrn_api.promotions_url(API_URL, 'current')] = (
+            '{"error": "awoo"}', 200)
+        self.assertRaises(exc.HashInvalidDLRNResponse,
+                          dlrn_api.fetch_promotions, API_URL, 'current')
+
+    def test_resolve(self, mock_config):
+        result = dlrn_api.resolve('centos9', 'master', 'tripleo',
+                                  'current-podified')
+        self.assertEqual('f47f1db5af04ddd1ab4cc3ccadf95884d335b3f3',
+                         result.commit_hash)
+        self.assertRaises(exc.HashInvalidDLRNResponse, dlrn_api.resolve,
+                          'centos9', 'master', 'tripleo', 'current')
@@ -14,6 +14,8 @@
 #
 #
 
+import io
+import json
 import sys
 import unittest
 from unittest import mock
@@ -21,6 +23,7 @@ from unittest.mock import mock_open, MagicMock, patch
 import yaml
 
 import repo_setup.get_hash.__main__ as tgh
+import repo_setup.get_hash.hash_info as thi
 from . import fakes as test_fakes
 
 
@@ -34,6 +37,11 @@ class TestGetHash(unittest.TestCase):
     fakes.CONFIG_FILE
     """
 
+    def setUp(self):
+        super(TestGetHash, self).setUp()
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+
     def test_centos_8_current_repo_setup_stable(self, mock_config):
         mocked = MagicMock(
             return_value=(test_fakes.TEST_REPO_MD5, 200))
@@ -212,6 +220,107 @@ class TestGetHash(unittest.TestCase):
                 "/delorean.repo.md5", main_res.dlrn_url,
             )
 
+    def test_several_values_without_matrix(self, mock_config):
+        args = ['--os-version', 'centos8', 'centos9']
+        sys.argv[1:] = args
+        self.assertRaises(SystemExit, lambda: tgh.main())
+
+    @mock.patch('repo_setup.get_hash.__main__._run_watch')
+    def test_watch_backend(self, mock_watch, mock_config):
+        sys.argv[1:] = ['--watch', '--backend', 'api']
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertRaises(SystemExit, tgh.main)
+        self.assertIn('--backend is not supported with --watch',
+                      stderr.getvalue())
+        mock_watch.assert_not_called()
+
+        sys.argv[1:] = ['--watch']
+        tgh.main()
+        args = mock_watch.call_args[0][0]
+        self.assertEqual('files', args.backend)
+
+    def test_matrix(self, mock_config):
+        def fake_http_get(url):
+            if 'centos9-master/current/' in url:
+                return 'Not found', 404
+            return test_fakes.TEST_REPO_MD5, 200
+
+        mocked = MagicMock(side_effect=fake_http_get)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked), \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            args = ['--matrix', '--os-version', 'centos8', 'centos9',
+                    '--tag', 'current', 'current-podified']
+            sys.argv[1:] = args
+            main_res = tgh.main()
+
+        self.assertEqual(4, len(main_res))
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(4, len(lines))
+        errors = [line for line in lines if 'error' in line]
+        self.assertEqual(1, len(errors))
+        self.assertEqual(('centos9', 'current'),
+                         (errors[0]['os_version'], errors[0]['tag']))
+        self.assertCountEqual(
+            [('centos8', 'current'), ('centos8', 'current-podified'),
+             ('centos9', 'current-podified')],
+            [(line['os_version'], line['tag']) for line in lines
+             if 'error' not in line])
+
+    def test_matrix_exit_code(self, mock_config):
+        mocked = MagicMock(side_effect=[
+            (test_fakes.TEST_REPO_MD5, 200), ('Not found', 404)])
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked), \
+                patch('sys.stdout', new_callable=io.StringIO):
+            args = ['--matrix', '--os-version', 'centos8', 'centos9',
+                    '--workers', '1']
+            sys.argv[1:] = args
+            with self.assertRaises(SystemExit) as cm:
+                tgh.cli_entrypoint()
+        self.assertEqual(1, cm.exception.code)
+
+        mocked.side_effect = None
+        mocked.return_value = (test_fakes.TEST_REPO_MD5, 200)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked), \
+                patch('sys.stdout', new_callable=io.StringIO):
+            with self.assertRaises(SystemExit) as cm:
+                tgh.cli_entrypoint()
+        self.assertEqual(0, cm.exception.code)
+
+    def test_matrix_query_file(self, mock_config):
+        queries = [{'os_version': 'centos9', 'release': 'master',
+                    'tag': 'current'},
+                   {'os_version': 'centos9', 'release': 'zed',
+                    'component': 'common', 'tag': 'current'}]
+        mocked = MagicMock(side_effect=[
+            (test_fakes.TEST_REPO_MD5, 200),
+            (test_fakes.TEST_COMMIT_YAML_COMPONENT, 200)])
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked), \
+                patch('sys.stdin', io.StringIO(json.dumps(queries))), \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            args = ['--query-file', '-', '--workers', '1']
+            sys.argv[1:] = args
+            main_res = tgh.main()
+
+        self.assertEqual(['master', 'zed'],
+                         [result.release for result in main_res])
+        self.assertEqual(2, len(stdout.getvalue().splitlines()))
+
+    def test_matrix_api_backend(self, mock_config):
+        dlrn = test_fakes.FakeDlrn()
+        dlrn.add_promotions(
+            'https://trunk.rdoproject.org/api-centos9-master-uc',
+            'current-podified', test_fakes.TEST_PROMOTIONS)
+        with patch('repo_setup.get_hash.hash_info.http_get', dlrn), \
+                patch('sys.stdout', new_callable=io.StringIO):
+            args = ['--matrix', '--backend', 'api', '--os-version', 'centos9',
+                    '--component', 'common', 'tripleo']
+            sys.argv[1:] = args
+            main_res = tgh.main()
+
+        self.assertEqual(1, len(dlrn.requests))
+        self.assertCountEqual(['common', 'tripleo'],
+                              [result.component for result in main_res])
+
 
 if __name__ == '__main__':
     unittest.main()
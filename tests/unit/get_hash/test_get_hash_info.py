@@ -14,6 +14,9 @@
 #
 #
 
+import os
+import subprocess
+import sys
 import unittest
 import repo_setup.get_hash.hash_info as thi
 import repo_setup.get_hash.exceptions as exc
@@ -32,6 +35,11 @@ class TestGetHashInfo(unittest.TestCase):
     fakes.CONFIG_FILE
     """
 
+    def setUp(self):
+        super(TestGetHashInfo, self).setUp()
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+
     def test_hashes_from_commit_yaml(self, mock_config):
         sample_commit_yaml = test_fakes.TEST_COMMIT_YAML_COMPONENT
         expected_result = (
@@ -52,6 +60,124 @@ class TestGetHashInfo(unittest.TestCase):
             )
             self.assertEqual(expected_result, actual_result)
 
+    def test_repr(self, mock_config):
+        mocked = MagicMock(return_value=(test_fakes.TEST_REPO_MD5, 200))
+        config = {'dlrn_url': 'https://woo,https://yay'}
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get', mocked):
+            hash_info = thi.HashInfo(
+                'centos8', 'master', None, 'current-podified', config=config
+            )
+        # the printed output of repo-setup-get-hash
+        self.assertEqual(
+            'os_version: centos8,\n'
+            'release: master,\n'
+            'component: None,\n'
+            'tag: current-podified,\n'
+            'dlrn_hash_tag: None,\n'
+            'dlrn_url: https://woo/centos8-master/current-podified/'
+            'delorean.repo.md5,\n'
+            'dlrn_api_url: https://woo/api-centos8-master-uc,\n'
+            'full_hash: %s,\n'
+            'commit_hash: None,\n'
+            'distro_hash: None,\n'
+            'extended_hash: None' % test_fakes.TEST_REPO_MD5,
+            repr(hash_info))
+
+    def test_mirrors(self, mock_config):
+        config = {'dlrn_url': 'https://woo,https://yay'}
+        hash_info = thi.HashInfo.unresolved(
+            'centos9', 'master', 'common', 'current', config=config)
+
+        self.assertEqual(['https://woo', 'https://yay'], hash_info.mirrors())
+        self.assertEqual(
+            ['https://woo/centos9-master/component/common/current/'
+             'commit.yaml',
+             'https://yay/centos9-master/component/common/current/'
+             'commit.yaml'],
+            hash_info.mirror_urls())
+        self.assertEqual('https://yay/api-centos9-master-uc',
+                         hash_info.api_url_for('https://yay'))
+
+        hash_info.use_mirror('https://yay')
+        self.assertEqual(hash_info.mirror_urls()[1], hash_info.dlrn_url)
+        self.assertEqual('https://yay/api-centos9-master-uc',
+                         hash_info.dlrn_api_url)
+
+    def test_first_commit_from_commit_yaml(self, mock_config):
+        content = ("commits:\n"
+                   "- commit_hash: 'a1b2'\n"
+                   "  notes: |\n"
+                   "    distro_hash: not-a-key\n"
+                   "  distro_hash: \"c3d4e5f6a7b8\"\n"
+                   "  extended_hash: null\n"
+                   "- commit_hash: second\n"
+                   "  distro_hash: second\n"
+                   "  extended_hash: second\n")
+        self.assertEqual({'commit_hash': 'a1b2',
+                          'distro_hash': 'c3d4e5f6a7b8',
+                          'extended_hash': None},
+                         thi.first_commit_from_commit_yaml(content))
+
+    def test_first_commit_from_commit_yaml_matches_parser(self, mock_config):
+        content = test_fakes.TEST_COMMIT_YAML_COMPONENT
+        expected = thi.HashInfo.load_yaml(content)['commits'][0]
+        result = thi.first_commit_from_commit_yaml(content)
+        for key in thi.COMMIT_YAML_KEYS:
+            self.assertEqual(expected[key], result[key])
+
+    def test_first_commit_from_commit_yaml_unexpected(self, mock_config):
+        for content in ('commits: [{commit_hash: a1b2}]\n',
+                        'other: value\ncommits:\n- commit_hash: a1b2\n',
+                        'commits:\n- commit_hash: [a1b2]\n',
+                        'commits:\n- commit_hash: a1b2\n'):
+            self.assertIsNone(thi.first_commit_from_commit_yaml(content))
+
+    def test_hashes_from_commit_yaml_fallback(self, mock_config):
+        content = ('commits: [{commit_hash: a1b2, distro_hash: c3d4e5f6a7b8,'
+                   ' extended_hash: None}]\n')
+        mocked = MagicMock(return_value=(content, 200))
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get', mocked):
+            hash_info = thi.HashInfo(
+                'centos8', 'master', 'common', 'current-podified', None
+            )
+        self.assertEqual('a1b2_c3d4e5f6', hash_info.full_hash)
+        self.assertEqual('None', hash_info.extended_hash)
+
+    def test_hash_info_mirrors(self, mock_config):
+        def http_get(url):
+            if url.startswith('https://woo/'):
+                return 'Great Scott!', -1
+            return test_fakes.TEST_REPO_MD5, 200
+        config = {'dlrn_url': 'https://woo, https://yay'}
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get',
+                MagicMock(side_effect=http_get)) as mocked:
+            hash_info = thi.HashInfo(
+                'centos8', 'master', None, 'current-podified', config=config
+            )
+        self.assertEqual(test_fakes.TEST_REPO_MD5, hash_info.full_hash)
+        self.assertEqual(
+            'https://yay/centos8-master/current-podified/delorean.repo.md5',
+            hash_info.dlrn_url)
+        self.assertEqual('https://yay/api-centos8-master-uc',
+                         hash_info.dlrn_api_url)
+        self.assertEqual(2, mocked.call_count)
+
+    def test_hash_info_mirrors_first_answers(self, mock_config):
+        mocked = MagicMock(return_value=(test_fakes.TEST_REPO_MD5, 200))
+        config = {'dlrn_url': ['https://woo', 'https://yay']}
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get', mocked):
+            hash_info = thi.HashInfo(
+                'centos8', 'master', None, 'current-podified', config=config
+            )
+        mocked.assert_called_once_with(
+            'https://woo/centos8-master/current-podified/delorean.repo.md5')
+        self.assertEqual('https://woo/api-centos8-master-uc',
+                         hash_info.dlrn_api_url)
+
     def test_resolve_repo_url_component_commit_yaml(self, mock_config):
         mocked = MagicMock(
             return_value=(test_fakes.TEST_COMMIT_YAML_COMPONENT, 200))
@@ -96,6 +222,69 @@ class TestGetHashInfo(unittest.TestCase):
             self.assertEqual(created_hash_info.os_version, 'centos8')
             self.assertEqual(created_hash_info.release, 'master')
 
+    def test_load_config_memoized(self, mock_config):
+        first = thi.HashInfo.load_config()
+        second = thi.HashInfo.load_config({'dlrn_url': 'https://awoo.com'})
+        self.assertEqual(1, mock_config.call_count)
+        self.assertEqual('https://trunk.rdoproject.org', first['dlrn_url'])
+        self.assertEqual('https://awoo.com', second['dlrn_url'])
+        self.assertEqual(first['os_versions'], second['os_versions'])
+
+    def test_load_config_reloaded_on_mtime_change(self, mock_config):
+        with patch('os.path.getmtime', MagicMock(side_effect=[1, 1, 2])):
+            for i in range(3):
+                thi.HashInfo.load_config()
+        self.assertEqual(2, mock_config.call_count)
+
+    def test_load_config_complete_passed_config(self, mock_config):
+        passed_config = thi.HashInfo.load_config()
+        mock_config.reset_mock()
+        thi.HashInfo.clear_config_cache()
+        with patch('os.path.isfile') as mock_isfile:
+            result = thi.HashInfo.load_config(passed_config)
+        self.assertEqual(passed_config, result)
+        mock_isfile.assert_not_called()
+        mock_config.assert_not_called()
+
+    def test_to_dict(self, mock_config):
+        mocked = MagicMock(
+            return_value=(test_fakes.TEST_REPO_MD5, 200))
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get', mocked):
+            created_hash_info = thi.HashInfo(
+                'centos8', 'master', None, 'current-podified', None
+            )
+        result = created_hash_info.to_dict()
+        self.assertEqual(test_fakes.TEST_REPO_MD5, result['full_hash'])
+        self.assertEqual('current-podified', result['tag'])
+        self.assertIsNone(result['component'])
+
+    def test_iter_resolved(self, mock_config):
+        mocked = MagicMock(
+            return_value=(test_fakes.TEST_REPO_MD5, 200))
+        queries = [{'os_version': 'centos8', 'release': release,
+                    'tag': 'current-podified'}
+                   for release in ('master', 'zed', 'wallaby')]
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get', mocked):
+            results = list(thi.iter_resolved(queries, workers=2))
+        self.assertEqual(3, len(results))
+        self.assertCountEqual(
+            ['master', 'zed', 'wallaby'],
+            [result.release for _, result in results])
+        for query, result in results:
+            self.assertEqual(query['release'], result.release)
+
+    def test_iter_resolved_error(self, mock_config):
+        mocked = MagicMock(return_value=('Not found', 404))
+        queries = [{'os_version': 'centos8', 'release': 'master',
+                    'tag': 'current-podified'}]
+        with patch(
+                'repo_setup.get_hash.hash_info.http_get', mocked):
+            results = list(thi.iter_resolved(queries))
+        self.assertEqual(1, len(results))
+        self.assertIsInstance(results[0][1], exc.HashInvalidDLRNResponse)
+
     def test_get_hash_info_component(self, mock_config):
         expected_commit_hash = '476a52df13202a44336c8b01419f8b73b93d93eb'
         expected_distro_hash = '1f5a41f31db8e3eb51caa9c0e201ab0583747be8'
@@ -172,3 +361,15 @@ class TestGetHashInfo(unittest.TestCase):
                 "create HashInfo object."
             ).format(bad_dlrn_url, '404', response_text_404)
             self.assertIn(error_str, debug_msgs)
+
+
+class TestGetHashInfoImport(unittest.TestCase):
+    def test_import_without_concurrent_futures(self):
+        # python2 targets of the get_hash module lack concurrent.futures
+        script = ("import sys\n"
+                  "sys.modules['concurrent'] = None\n"
+                  "sys.modules['concurrent.futures'] = None\n"
+                  "import repo_setup.get_hash.hash_info\n")
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(thi.__file__)))))
+        subprocess.check_call([sys.executable, '-c', script], env=env)
@@ -0,0 +1,157 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import unittest
+from unittest import mock
+
+import repo_setup.get_hash.exceptions as exc
+from .. import modules
+
+get_hash_module = modules.load_module('get_hash')
+
+DLRN_URL = 'https://trunk.rdoproject.org'
+
+
+def _hash_info(component):
+    commit_hash = 'f47f1db5af04ddd1ab4cc3ccadf95884d335b3f3'
+    return mock.Mock(
+        commit_hash=commit_hash,
+        distro_hash='92f50acecd0a218936b7163e8362e75913b62af2',
+        full_hash=commit_hash + '_92f50ace',
+        extended_hash=None,
+        dlrn_url=DLRN_URL + '/centos9-master/component/%s/'
+        'current-podified/commit.yaml' % component,
+        dlrn_api_url=DLRN_URL + '/api-centos9-master-uc')
+
+
+def _iter_resolved(queries, config=None, workers=None):
+    for query in queries:
+        if query['component'] == 'bogus':
+            yield query, exc.HashInvalidDLRNResponse('Invalid component')
+        else:
+            yield query, _hash_info(query['component'])
+
+
+class TestGetHashModule(unittest.TestCase):
+    """Tests of the get_hash Ansible module, with the hash resolution
+    mocked out.
+    """
+
+    @mock.patch('repo_setup.get_hash.hash_info.HashInfo')
+    def test_single_query(self, mock_hash_info):
+        mock_hash_info.return_value = _hash_info('common')
+        result = modules.run_module(get_hash_module, {
+            'os_version': 'centos9', 'component': 'common'})
+
+        self.assertTrue(result['success'])
+        self.assertEqual(_hash_info('common').full_hash, result['full_hash'])
+        self.assertNotIn('results', result)
+        mock_hash_info.assert_called_once_with(
+            'centos9', 'master', 'common', 'current-podified',
+            config={'dlrn_url': DLRN_URL})
+
+    @mock.patch('repo_setup.get_hash.hash_info.HashInfo')
+    @mock.patch('repo_setup.get_hash.dlrn_api.resolve')
+    def test_single_query_api(self, mock_resolve, mock_hash_info):
+        mock_resolve.return_value = _hash_info('common')
+        result = modules.run_module(get_hash_module, {
+            'os_version': 'centos9', 'component': 'common',
+            'backend': 'api'})
+
+        self.assertTrue(result['success'])
+        mock_resolve.assert_called_once_with(
+            'centos9', 'master', 'common', 'current-podified',
+            config={'dlrn_url': DLRN_URL})
+        mock_hash_info.assert_not_called()
+
+    @mock.patch('repo_setup.get_hash.dlrn_api.iter_resolved')
+    @mock.patch('repo_setup.get_hash.hash_info.iter_resolved')
+    def test_queries(self, mock_iter, mock_api_iter):
+        mock_iter.side_effect = _iter_resolved
+        result = modules.run_module(get_hash_module, {
+            'os_version': 'centos9',
+            'queries': [
+                {'component': 'common'},
+                {'component': 'tripleo', 'release': 'antelope'},
+                {'component': 'bogus', 'dlrn_hash_tag': 'abc123'},
+            ],
+            'workers': 2,
+        })
+
+        self.assertTrue(result['success'])
+        results = result['results']
+        self.assertEqual(
+            ['centos9/antelope/tripleo/current-podified',
+             'centos9/master/bogus/current-podified@abc123',
+             'centos9/master/common/current-podified'],
+            sorted(results))
+        common = results['centos9/master/common/current-podified']
+        self.assertTrue(common['success'])
+        self.assertEqual(_hash_info('common').full_hash, common['full_hash'])
+        # a failed query doesn't fail the task
+        bogus = results['centos9/master/bogus/current-podified@abc123']
+        self.assertEqual(dict(success=False, error='Invalid component'),
+                         bogus)
+        queries, = mock_iter.call_args[0]
+        # missing keys default to the module options
+        self.assertEqual(
+            dict(os_version='centos9', release='antelope',
+                 component='tripleo', tag='current-podified',
+                 dlrn_hash_tag=None), queries[1])
+        self.assertEqual(dict(config={'dlrn_url': DLRN_URL}, workers=2),
+                         mock_iter.call_args[1])
+        mock_api_iter.assert_not_called()
+
+    @mock.patch('repo_setup.get_hash.dlrn_api.iter_resolved')
+    @mock.patch('repo_setup.get_hash.hash_info.iter_resolved')
+    def test_queries_api(self, mock_iter, mock_api_iter):
+        mock_api_iter.side_effect = _iter_resolved
+        result = modules.run_module(get_hash_module, {
+            'os_version': 'centos9',
+            'queries': [{'component': 'common'}],
+            'backend': 'api',
+        })
+
+        self.assertEqual(['centos9/master/common/current-podified'],
+                         list(result['results']))
+        self.assertEqual(8, mock_api_iter.call_args[1]['workers'])
+        mock_iter.assert_not_called()
+
+    @mock.patch('repo_setup.get_hash.hash_info.iter_resolved')
+    def test_queries_unknown_key(self, mock_iter):
+        with self.assertRaises(modules.ModuleFail) as cm:
+            modules.run_module(get_hash_module, {
+                'queries': [{'component': 'common', 'flux': 'capacitor'}]})
+        self.assertEqual('Unsupported keys in query: flux',
+                         cm.exception.result['msg'])
+        mock_iter.assert_not_called()
+
+    @mock.patch('repo_setup.get_hash.hash_info.iter_resolved')
+    def test_queries_duplicate(self, mock_iter):
+        with self.assertRaises(modules.ModuleFail) as cm:
+            modules.run_module(get_hash_module, {
+                'os_version': 'centos9',
+                'queries': [{'component': 'common'},
+                            {'component': 'common', 'release': 'master'}]})
+        self.assertEqual(
+            'Duplicate query: centos9/master/common/current-podified',
+            cm.exception.result['msg'])
+        mock_iter.assert_not_called()
+
+    def test_invalid_backend(self):
+        with self.assertRaises(modules.ModuleFail) as cm:
+            modules.run_module(get_hash_module, {'backend': 'delorean'})
+        self.assertIn('backend', cm.exception.result['msg'])
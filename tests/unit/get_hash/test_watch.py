@@ -0,0 +1,176 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import io
+import json
+import sys
+import unittest
+from unittest import mock
+from unittest.mock import mock_open, MagicMock, patch
+
+import repo_setup.get_hash.__main__ as tgh
+import repo_setup.get_hash.hash_info as thi
+import repo_setup.get_hash.watch as watch
+from . import fakes as test_fakes
+
+MD5_URL = ('https://trunk.rdoproject.org/centos9-master/current-podified/'
+           'delorean.repo.md5')
+
+
+def response(status_code, content='', headers=None):
+    return mock.Mock(status_code=status_code, content=content.encode(),
+                     headers=headers or {})
+
+
+@mock.patch(
+    'builtins.open', new_callable=mock_open, read_data=test_fakes.CONFIG_FILE
+)
+class TestHashWatcher(unittest.TestCase):
+    """Tests for the get-hash watch mode. The builtin 'open' function is
+    mocked at a class level so we can mock the config.yaml with the contents
+    of the fakes.CONFIG_FILE
+    """
+
+    def setUp(self):
+        super(TestHashWatcher, self).setUp()
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+        patcher = patch('repo_setup.utils.get_session')
+        self.session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.queries = [{'os_version': 'centos9', 'release': 'master',
+                         'tag': 'current-podified'}]
+
+    def test_poll_reports_changes_only(self, mock_config):
+        self.session.get.side_effect = [
+            response(200, 'a96366', {'ETag': '"1"'}),
+            response(304),
+            response(200, 'b12345', {'ETag': '"2"'}),
+        ]
+        watcher = watch.HashWatcher(self.queries)
+
+        self.assertEqual([], watcher.poll())
+        self.assertEqual([], watcher.poll())
+        events = watcher.poll()
+
+        self.assertEqual(1, len(events))
+        self.assertEqual('b12345', events[0]['full_hash'])
+        self.assertEqual('a96366', events[0]['previous_full_hash'])
+        self.assertEqual(MD5_URL, events[0]['dlrn_url'])
+        self.assertEqual(
+            [mock.call(MD5_URL, headers={}, timeout=mock.ANY),
+             mock.call(MD5_URL, headers={'If-None-Match': '"1"'},
+                       timeout=mock.ANY),
+             mock.call(MD5_URL, headers={'If-None-Match': '"1"'},
+                       timeout=mock.ANY)],
+            self.session.get.call_args_list)
+
+    def test_poll_mirrors(self, mock_config):
+        responses = {
+            MD5_URL: [response(200, 'a96366', {'ETag': '"1"'}),
+                      response(304),
+                      response(200, 'b12345', {'ETag': '"2"'})],
+        }
+
+        def get(url, headers=None, timeout=None):
+            if url not in responses:
+                raise IOError('Great Scott!')
+            return responses[url].pop(0)
+
+        self.session.get.side_effect = get
+        config = {'dlrn_url': 'https://woo,https://trunk.rdoproject.org'}
+        watcher = watch.HashWatcher(self.queries, config=config)
+
+        self.assertEqual([], watcher.poll())
+        self.assertEqual([], watcher.poll())
+        events = watcher.poll()
+
+        self.assertEqual('b12345', events[0]['full_hash'])
+        self.assertEqual(MD5_URL, events[0]['dlrn_url'])
+        self.assertEqual('https://trunk.rdoproject.org/api-centos9-master-uc',
+                         events[0]['dlrn_api_url'])
+        # every poll tries the first mirror, then the answering one with the
+        # validators of its own last response
+        woo_url = MD5_URL.replace('https://trunk.rdoproject.org',
+                                  'https://woo')
+        woo_call = mock.call(woo_url, headers={}, timeout=mock.ANY)
+        self.assertEqual(
+            [woo_call, mock.call(MD5_URL, headers={}, timeout=mock.ANY),
+             woo_call, mock.call(MD5_URL, headers={'If-None-Match': '"1"'},
+                                 timeout=mock.ANY),
+             woo_call, mock.call(MD5_URL, headers={'If-None-Match': '"1"'},
+                                 timeout=mock.ANY)],
+            self.session.get.call_args_list)
+
+    def test_poll_errors(self, mock_config):
+        self.session.get.side_effect = [
+            response(200, 'a96366'),
+            IOError('Great Scott!'),
+            response(404, 'Not found'),
+            response(200, 'a96366'),
+        ]
+        watcher = watch.HashWatcher(self.queries)
+        for i in range(4):
+            self.assertEqual([], watcher.poll())
+
+    def test_run_backoff(self, mock_config):
+        self.session.get.side_effect = [
+            response(200, 'a96366'),
+            response(304),
+            response(304),
+            response(200, 'b12345'),
+            response(304),
+        ]
+        mock_sleep = MagicMock()
+        on_change = MagicMock()
+        watcher = watch.HashWatcher(self.queries, interval=10,
+                                    max_interval=30, on_change=on_change,
+                                    sleep=mock_sleep)
+
+        self.assertEqual(1, watcher.run(max_polls=5))
+
+        self.assertEqual([mock.call(10), mock.call(20), mock.call(30),
+                          mock.call(10)], mock_sleep.call_args_list)
+        on_change.assert_called_once_with(mock.ANY)
+
+    def test_cli_watch(self, mock_config):
+        self.session.get.side_effect = [
+            response(200, 'a96366'),
+            response(200, 'b12345'),
+        ]
+
+        original_run = watch.HashWatcher.run
+
+        def run(watcher):
+            return original_run(watcher, max_polls=2)
+
+        with patch.object(watch.HashWatcher, 'run', autospec=True,
+                          side_effect=run), \
+                patch('time.sleep'), \
+                patch('subprocess.Popen') as mock_popen, \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            mock_popen.return_value.returncode = 0
+            sys.argv[1:] = ['--watch', '--os-version', 'centos9',
+                            '--exec', 'echo changed']
+            self.assertEqual(1, tgh.main())
+
+        event = json.loads(stdout.getvalue())
+        self.assertEqual('b12345', event['full_hash'])
+        env = mock_popen.call_args[1]['env']
+        self.assertEqual('b12345', env['REPO_SETUP_FULL_HASH'])
+        self.assertEqual('a96366', env['REPO_SETUP_PREVIOUS_FULL_HASH'])
+        mock_popen.return_value.communicate.assert_called_once_with(
+            stdout.getvalue().strip().encode())
@@ -0,0 +1,90 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Helpers to run the Ansible modules of plugins/modules in unit tests."""
+
+import contextlib
+import importlib.util
+import json
+import os
+from unittest import mock
+
+from ansible.module_utils import basic
+
+MODULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', '..', 'plugins', 'modules')
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    # ansible-core < 2.19
+    @contextlib.contextmanager
+    def patch_module_args(args):
+        data = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+        with mock.patch.object(basic, '_ANSIBLE_ARGS', data):
+            yield
+
+
+class ModuleExit(SystemExit):
+    """Raised instead of exit_json, with the module result
+
+    A SystemExit like the one of exit_json, so the modules' "except Exception"
+    blocks let it through.
+    """
+
+    def __init__(self, result):
+        super(ModuleExit, self).__init__(result)
+        self.result = result
+
+
+class ModuleFail(SystemExit):
+    """Raised instead of fail_json, with the module result
+
+    A SystemExit like the one of fail_json, so the modules' "except Exception"
+    blocks let it through.
+    """
+
+    def __init__(self, result):
+        super(ModuleFail, self).__init__(result)
+        self.result = result
+
+
+def load_module(name):
+    """Import plugins/modules/<name>.py"""
+    spec = importlib.util.spec_from_file_location(
+        'repo_setup_module_' + name, os.path.join(MODULES_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_module(module, args, check_mode=False, diff=False):
+    """Run module with args and return its result.
+
+    :raises ModuleFail if the module called fail_json.
+    """
+    def exit_json(self, **result):
+        raise ModuleExit(result)
+
+    def fail_json(self, **result):
+        raise ModuleFail(result)
+
+    args = dict(args, _ansible_check_mode=check_mode, _ansible_diff=diff)
+    with patch_module_args(args), \
+            mock.patch.object(basic.AnsibleModule, 'exit_json', exit_json), \
+            mock.patch.object(basic.AnsibleModule, 'fail_json', fail_json):
+        try:
+            module.main()
+        except ModuleExit as e:
+            return e.result
+    raise AssertionError('%s did not exit' % module.__name__)
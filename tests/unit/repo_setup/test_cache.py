@@ -0,0 +1,101 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import testtools
+
+import repo_setup.cache as repos_cache
+
+FAKE_URL = 'http://lone/pine/mall/delorean.repo'
+FAKE_HEADERS = {'ETag': '"88mph"', 'Last-Modified': 'Sat, 26 Oct 1985'}
+
+
+class TestHttpCache(testtools.TestCase):
+    def setUp(self):
+        super(TestHttpCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = repos_cache.HttpCache(self.cache_dir)
+
+    def test_creates_cache_dir(self):
+        cache_dir = os.path.join(self.cache_dir, 'sub')
+        repos_cache.HttpCache(cache_dir)
+        self.assertTrue(os.path.isdir(cache_dir))
+
+    def test_miss(self):
+        self.assertEqual({}, self.cache.conditional_headers(FAKE_URL))
+        self.assertIsNone(self.cache.get(FAKE_URL))
+
+    def test_store_and_get(self):
+        self.cache.store(FAKE_URL, '[delorean]\n', FAKE_HEADERS)
+        self.assertEqual('[delorean]\n', self.cache.get(FAKE_URL))
+        self.assertEqual({'If-None-Match': '"88mph"',
+                          'If-Modified-Since': 'Sat, 26 Oct 1985'},
+                         self.cache.conditional_headers(FAKE_URL))
+
+    def test_store_without_validators(self):
+        self.cache.store(FAKE_URL, '[delorean]\n', {})
+        self.assertIsNone(self.cache.get(FAKE_URL))
+
+    def test_evict_expired(self):
+        self.cache.store(FAKE_URL, '[delorean]\n', FAKE_HEADERS)
+        self.cache.store(FAKE_URL + '.md5', 'a96366', FAKE_HEADERS)
+        old = time.time() - self.cache.max_age - 1
+        body_path = self.cache._entry_path(FAKE_URL, repos_cache.BODY_SUFFIX)
+        os.utime(body_path, (old, old))
+        self.assertEqual(1, self.cache.evict())
+        self.assertIsNone(self.cache.get(FAKE_URL))
+        self.assertEqual('a96366', self.cache.get(FAKE_URL + '.md5'))
+
+    def test_evict_oversized(self):
+        self.cache.max_size = 0
+        self.cache.store(FAKE_URL, '[delorean]\n', FAKE_HEADERS)
+        self.assertEqual(1, self.cache.evict())
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_read_only(self):
+        self.cache.store(FAKE_URL, '[delorean]\n', FAKE_HEADERS)
+        with mock.patch('os.access', return_value=False):
+            cache = repos_cache.HttpCache(self.cache_dir)
+        self.assertTrue(cache.read_only)
+        cache.max_size = 0
+        with mock.patch('os.utime') as mock_utime:
+            self.assertEqual('[delorean]\n', cache.get(FAKE_URL))
+        mock_utime.assert_not_called()
+        cache.store(FAKE_URL + '.md5', 'a96366', FAKE_HEADERS)
+        self.assertEqual(0, cache.evict())
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+        # a read only cache doesn't create its directory either
+        cache_dir = os.path.join(self.cache_dir, 'sub')
+        repos_cache.HttpCache(cache_dir, read_only=True)
+        self.assertFalse(os.path.exists(cache_dir))
+
+    @mock.patch('os.utime', mock.Mock(side_effect=OSError('Read-only')))
+    def test_get_read_only_filesystem(self):
+        self.cache.store(FAKE_URL, '[delorean]\n', FAKE_HEADERS)
+        self.assertEqual('[delorean]\n', self.cache.get(FAKE_URL))
+
+    @mock.patch('logging.warning')
+    def test_store_failure_warns_once(self, mock_warning):
+        with mock.patch('repo_setup.utils.atomic_write',
+                        side_effect=OSError('Permission denied')):
+            self.cache.store(FAKE_URL, '[delorean]\n', FAKE_HEADERS)
+            self.cache.store(FAKE_URL + '.md5', 'a96366', FAKE_HEADERS)
+        self.assertEqual(1, mock_warning.call_count)
+        self.assertTrue(self.cache.read_only)
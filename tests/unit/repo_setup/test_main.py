@@ -12,19 +12,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
 import sys
+import tempfile
 from unittest import mock
 
 import ddt
 import testtools
 
 from repo_setup import main
+import repo_setup.utils as repos_utils
 
 
 @ddt.ddt
 class TestTripleORepos(testtools.TestCase):
     @mock.patch('repo_setup.main._get_distro')
-    @mock.patch('sys.argv', ['repo-setup', 'current', '-d', 'centos8'])
+    @mock.patch('sys.argv', ['repo-setup', 'current', '-d', 'centos8',
+                             '--clean-mode', 'all'])
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._download_repos',
+                mock.Mock(return_value={}))
     @mock.patch('repo_setup.main._run_pkg_clean')
     @mock.patch('repo_setup.main._validate_args')
     @mock.patch('repo_setup.main._get_base_path')
@@ -34,36 +46,354 @@ class TestTripleORepos(testtools.TestCase):
                           mock_validate, mock_clean, mock_distro):
         mock_distro.return_value = ('centos', '8', 'CentOS 8')
         args = main._parse_args('centos', '8')
-        mock_path = mock.Mock()
-        mock_gbp.return_value = mock_path
+        mock_gbp.return_value = 'roads/'
+        mock_install.return_value = [
+            main.RepoFile('/etc/yum.repos.d/delorean.repo', True,
+                          ['delorean']),
+            main.RepoFile('/etc/yum.repos.d/delorean-deps.repo', False,
+                          ['delorean-deps']),
+        ]
+        mock_remove.return_value = []
         main.main()
         mock_validate.assert_called_once_with(args, 'CentOS 8', '8')
         mock_gbp.assert_called_once_with(args)
-        mock_remove.assert_called_once_with(args)
+        mock_remove.assert_called_once_with(
+            args, keep=['/etc/yum.repos.d/delorean.repo',
+                        '/etc/yum.repos.d/delorean-deps.repo'],
+            dry_run=False)
         mock_clean.assert_called_once_with('centos8')
 
-    @mock.patch('requests.get')
-    def test_get_repo(self, mock_get):
+    @mock.patch('repo_setup.main._get_distro')
+    @mock.patch('sys.argv', ['repo-setup', 'current', '-d', 'centos8'])
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._download_repos',
+                mock.Mock(return_value={}))
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('repo_setup.main._validate_args')
+    @mock.patch('repo_setup.main._get_base_path')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_repos')
+    @mock.patch('repo_setup.main._refresh_repo_metadata')
+    def test_main_unchanged_skips_clean(self, mock_refresh, mock_install,
+                                        mock_remove, mock_gbp, mock_validate,
+                                        mock_clean, mock_distro):
+        mock_distro.return_value = ('centos', '8', 'CentOS 8')
+        mock_gbp.return_value = 'roads/'
+        mock_install.return_value = [
+            main.RepoFile('/etc/yum.repos.d/delorean.repo', False,
+                          ['delorean']),
+        ]
+        mock_remove.return_value = []
+        main.main()
+        mock_clean.assert_not_called()
+        mock_refresh.assert_not_called()
+
+    def test_options_defaults_match_cli(self):
+        parser = main._build_parser('centos9')
+        cli = vars(parser.parse_args(['current']))
+        options = vars(main.RepoSetupOptions(['current']))
+        cli.pop('distro')
+        self.assertIsNone(options.pop('distro'))
+        self.assertEqual(cli, options)
+
+    def test_parse_args_argv(self):
+        args = main._parse_args('centos', '9', ['current', '-b', 'wallaby'])
+        self.assertEqual(['current'], args.repos)
+        self.assertEqual('wallaby', args.branch)
+        self.assertEqual('centos9', args.distro)
+
+    @mock.patch('repo_setup.main._get_distro',
+                mock.Mock(return_value=('centos', '9', 'CentOS Stream 9')))
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._clean_metadata')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_repos')
+    @mock.patch('repo_setup.main._download_repos')
+    @mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_run(self, mock_stdout, mock_download, mock_install, mock_remove,
+                 mock_clean):
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        base_url = main.DEFAULT_RDO_MIRROR + '/centos9-wallaby/'
+        mock_download.return_value = {
+            base_url + 'current/delorean.repo': (
+                'https://twin', '[delorean]\n'),
+            base_url + 'delorean-deps.repo': (
+                main.DEFAULT_RDO_MIRROR, '[delorean-deps]\n'),
+        }
+        mock_install.return_value = [
+            main.RepoFile(output_path + '/delorean.repo', True, ['delorean']),
+            main.RepoFile(output_path + '/delorean-deps.repo', False,
+                          ['delorean-deps']),
+        ]
+        mock_remove.return_value = [
+            main.RepoFile(output_path + '/delorean-old.repo', True, ['old']),
+        ]
+        options = main.RepoSetupOptions(
+            ['current'], output_path=output_path, branch='wallaby',
+            rdo_mirror=main.DEFAULT_RDO_MIRROR + ',https://twin')
+        result = main.run(options)
+        self.assertEqual([output_path + '/delorean.repo'], result.written)
+        self.assertEqual([output_path + '/delorean-deps.repo'],
+                         result.unchanged)
+        self.assertEqual([output_path + '/delorean-old.repo'], result.removed)
+        mock_download.assert_called_once_with(
+            [base_url + 'current/delorean.repo',
+             base_url + 'delorean-deps.repo'], mock.ANY, None)
+        # from the mirror that served each
+        self.assertEqual(['https://twin/centos9-wallaby/current/delorean.repo',
+                          base_url + 'delorean-deps.repo'],
+                         result.fetched)
+        self.assertEqual(['validate', 'install', 'remove', 'clean'],
+                         list(result.timings))
+        install_args = mock_install.call_args[0][0]
+        self.assertEqual('centos9', install_args.distro)
+        self.assertEqual(main.DEFAULT_MIRROR_MAP['centos9'],
+                         install_args.mirror)
+        mock_clean.assert_called_once_with(install_args, mock.ANY)
+        self.assertEqual('', mock_stdout.getvalue())
+
+    @mock.patch('repo_setup.main._get_distro',
+                mock.Mock(return_value=('centos', '9', 'CentOS Stream 9')))
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._download_repos',
+                mock.Mock(return_value={}))
+    @mock.patch('repo_setup.main._clean_metadata')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_repos')
+    def test_run_timings(self, mock_install, mock_remove, mock_clean):
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        report_path = os.path.join(output_path, 'timings.json')
+        mock_install.return_value = []
+        mock_remove.return_value = []
+        options = main.RepoSetupOptions(['current'], output_path=output_path,
+                                        timings=report_path)
+        main.run(options)
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual('repo-setup', report['command'])
+        self.assertEqual(['distro', 'validate', 'install', 'remove', 'clean'],
+                         [s['name'] for s in report['spans']])
+
+    @mock.patch('repo_setup.main._get_distro',
+                mock.Mock(return_value=('centos', '9', 'CentOS Stream 9')))
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._download_repos',
+                mock.Mock(return_value={}))
+    @mock.patch('repo_setup.main._clean_metadata')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_repos')
+    def test_run_dry_run(self, mock_install, mock_remove, mock_clean):
+        mock_install.return_value = [
+            main.RepoFile('test/delorean.repo', True, ['delorean'],
+                          None, '[delorean]\n'),
+        ]
+        mock_remove.return_value = []
+        options = main.RepoSetupOptions(['current'], output_path='test',
+                                        dry_run=True)
+        result = main.run(options)
+        self.assertEqual(['test/delorean.repo'], result.written)
+        self.assertEqual(mock_install.return_value, result.repo_files)
+        self.assertTrue(mock_install.call_args[1]['dry_run'])
+        self.assertTrue(mock_remove.call_args[1]['dry_run'])
+        mock_clean.assert_not_called()
+
+    @mock.patch('repo_setup.main._get_distro',
+                mock.Mock(return_value=('centos', '9', 'CentOS Stream 9')))
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._download_repos',
+                mock.Mock(return_value={}))
+    @mock.patch('repo_setup.main._clean_metadata', mock.Mock())
+    @mock.patch('repo_setup.main._remove_existing',
+                mock.Mock(return_value=[]))
+    @mock.patch('repo_setup.main._install_repos')
+    def test_run_durability(self, mock_install):
+        mock_install.return_value = []
+        durability = repos_utils.get_durability()
+        options = main.RepoSetupOptions(['current'], output_path='test',
+                                        durability='none')
+        main.run(options)
+        self.assertEqual('none', mock_install.call_args[0][0].durability)
+        # not left behind for the next runs of the process
+        self.assertEqual(durability, repos_utils.get_durability())
+
+    @mock.patch('repo_setup.main._get_distro',
+                mock.Mock(return_value=('centos', '9', 'CentOS Stream 9')))
+    def test_run_invalid_options(self):
+        for options in (main.RepoSetupOptions(['current'], distro='doc7'),
+                        main.RepoSetupOptions(['current'], clean_mode='some'),
+                        main.RepoSetupOptions(['tomorrow'])):
+            self.assertRaises(main.InvalidArguments, main.run, options)
+
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('repo_setup.main._refresh_repo_metadata')
+    def test_clean_metadata_changed(self, mock_refresh, mock_clean):
+        args = mock.Mock(clean_mode='changed', distro='centos9',
+                         output_path='/etc/yum.repos.d/')
+        main._clean_metadata(args, [
+            main.RepoFile('test/delorean.repo', True, ['delorean'],
+                          None, '[delorean]\n[delorean-off]\nenabled=0\n'),
+            main.RepoFile('test/delorean-deps.repo', False,
+                          ['delorean-deps'], '[delorean-deps]\n',
+                          '[delorean-deps]\n'),
+            main.RepoFile('test/delorean-new.repo', True, ['new', 'old'],
+                          '[old]\n', '[new]\nenabled = 1\n'),
+            # dnf doesn't know about removed repos anymore
+            main.RepoFile('test/delorean-gone.repo', True, ['gone'],
+                          '[gone]\n', None),
+        ])
+        mock_refresh.assert_called_once_with(['delorean', 'new'], 'centos9')
+        mock_clean.assert_not_called()
+
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('repo_setup.main._refresh_repo_metadata')
+    def test_clean_metadata_none(self, mock_refresh, mock_clean):
+        args = mock.Mock(clean_mode='none')
+        main._clean_metadata(args, [
+            main.RepoFile('test/delorean.repo', True, ['delorean'])])
+        mock_refresh.assert_not_called()
+        mock_clean.assert_not_called()
+
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('repo_setup.main._refresh_repo_metadata')
+    def test_clean_metadata_output_path(self, mock_refresh, mock_clean):
+        # repos installed elsewhere are not used by the host dnf
+        args = mock.Mock(clean_mode='changed', output_path='test')
+        main._clean_metadata(args, [
+            main.RepoFile('test/delorean.repo', True, ['delorean'],
+                          None, '[delorean]\n')])
+        mock_refresh.assert_not_called()
+        mock_clean.assert_not_called()
+
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('subprocess.check_call')
+    def test_refresh_repo_metadata(self, mock_check_call, mock_clean):
+        main._refresh_repo_metadata(['delorean', 'delorean-deps'], 'centos9')
+        mock_check_call.assert_called_once_with(
+            ['dnf', 'makecache', '--refresh', '--repo', 'delorean',
+             '--repo', 'delorean-deps'])
+        mock_clean.assert_not_called()
+
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('subprocess.check_call')
+    def test_refresh_repo_metadata_failure(self, mock_check_call,
+                                           mock_clean):
+        mock_check_call.side_effect = subprocess.CalledProcessError(1, 'dnf')
+        main._refresh_repo_metadata(['delorean'], 'centos9')
+        mock_clean.assert_called_once_with('centos9')
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_download_repo(self, mock_session):
+        mock_get = mock_session.return_value.get
         mock_response = mock.Mock()
         mock_response.status_code = 200
         mock_response.text = '88MPH'
+        mock_response.content = b'88MPH'
         mock_get.return_value = mock_response
         fake_addr = 'http://lone/pine/mall'
-        args = mock.Mock()
+        args = mock.Mock(rdo_mirror='http://lone', rdo_mirrors=['http://lone'])
         args.distro = 'centos'
-        content = main._get_repo(fake_addr, args)
-        self.assertEqual('88MPH', content)
-        mock_get.assert_called_once_with(fake_addr)
+        self.assertEqual(('http://lone', '88MPH'),
+                         main._download_repo(fake_addr, args))
+        mock_get.assert_called_once_with(fake_addr, headers={},
+                                         timeout=repos_utils.HTTP_TIMEOUT)
 
-    @mock.patch('requests.get')
-    def test_get_repo_404(self, mock_get):
-        mock_response = mock.Mock()
-        mock_response.status_code = 404
-        mock_get.return_value = mock_response
+    @mock.patch('repo_setup.utils.get_session')
+    def test_download_repo_unexpected_status(self, mock_session):
+        mock_get = mock_session.return_value.get
         fake_addr = 'http://twin/pines/mall'
-        main._get_repo(fake_addr, mock.Mock())
-        mock_get.assert_called_once_with(fake_addr)
-        mock_response.raise_for_status.assert_called_once_with()
+        args = mock.Mock(rdo_mirror='http://twin', rdo_mirrors=['http://twin'])
+        # redirects that were not followed are not errors for requests
+        for status in (404, 302):
+            mock_get.return_value = mock.Mock(status_code=status, content=b'')
+            self.assertRaises(main.DownloadError,
+                              main._download_repo, fake_addr, args)
+            mock_get.assert_called_with(fake_addr, headers={},
+                                        timeout=repos_utils.HTTP_TIMEOUT)
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_download_repo_not_modified(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = mock.Mock(status_code=304, content=b'')
+        mock_cache = mock.Mock()
+        mock_cache.conditional_headers.return_value = {'If-None-Match': 'x'}
+        mock_cache.get.return_value = '88MPH'
+        fake_addr = 'http://lone/pine/mall'
+        args = mock.Mock(old_mirror=None, rdo_mirror='http://lone',
+                         rdo_mirrors=['http://lone'])
+        self.assertEqual(('http://lone', '88MPH'),
+                         main._download_repo(fake_addr, args, mock_cache))
+        mock_get.assert_called_once_with(fake_addr,
+                                         headers={'If-None-Match': 'x'},
+                                         timeout=repos_utils.HTTP_TIMEOUT)
+        mock_cache.get.assert_called_once_with(fake_addr)
+        mock_cache.store.assert_not_called()
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_download_repo_stores_in_cache(self, mock_session):
+        mock_response = mock.Mock(status_code=200, text='88MPH',
+                                  content=b'88MPH')
+        mock_session.return_value.get.return_value = mock_response
+        mock_cache = mock.Mock()
+        mock_cache.conditional_headers.return_value = {}
+        fake_addr = 'http://lone/pine/mall'
+        args = mock.Mock(old_mirror=None, rdo_mirror='http://lone',
+                         rdo_mirrors=['http://lone'])
+        main._download_repo(fake_addr, args, mock_cache)
+        mock_cache.store.assert_called_once_with(fake_addr, '88MPH',
+                                                 mock_response.headers)
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_download_repo_mirror_failover(self, mock_session):
+        content = 'baseurl=http://lone/centos9/current\n'
+
+        def get(url, headers, timeout):
+            if url.startswith('http://lone/'):
+                return mock.Mock(status_code=503, content=b'')
+            return mock.Mock(status_code=200, text=content,
+                             content=content.encode('utf-8'))
+        mock_session.return_value.get.side_effect = get
+        args = mock.Mock(old_mirror=None, rdo_mirror='http://lone',
+                         rdo_mirrors=['http://lone', 'http://twin'])
+        result = main._download_repo(
+            'http://lone/centos9/current/delorean.repo', args)
+        self.assertEqual(('http://twin', content), result)
+        self.assertEqual(
+            ['http://lone/centos9/current/delorean.repo',
+             'http://twin/centos9/current/delorean.repo'],
+            sorted(c[0][0]
+                   for c in mock_session.return_value.get.call_args_list))
+
+    def test_mirror_candidates(self):
+        args = mock.Mock(rdo_mirror='http://lone',
+                         rdo_mirrors=['http://lone', 'http://twin'])
+        self.assertEqual([('http://lone', 'http://lone/a.repo'),
+                          ('http://twin', 'http://twin/a.repo')],
+                         main._mirror_candidates('http://lone/a.repo', args))
+        self.assertEqual([('http://lone', 'http://other/a.repo')],
+                         main._mirror_candidates('http://other/a.repo', args))
+
+    def test_inject_mirrors_serving_mirror(self):
+        start_repo = ('baseurl=https://trunk.rdoproject.org/centos9/a\n'
+                      'baseurl=http://lone/centos9/b\n')
+        args = mock.Mock(old_mirror=None, rdo_mirror='http://lone',
+                         rdo_mirrors=['http://lone', 'http://twin'])
+        self.assertEqual('baseurl=http://twin/centos9/a\n'
+                         'baseurl=http://twin/centos9/b\n',
+                         main._inject_mirrors(start_repo, args, 'http://twin'))
+
+    def test_get_cache_disabled(self):
+        args = mock.Mock(no_cache=True)
+        self.assertIsNone(main._get_cache(args))
+
+    def test_get_cache_dry_run(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        args = mock.Mock(no_cache=False, cache_dir=cache_dir, dry_run=True)
+        self.assertTrue(main._get_cache(args).read_only)
+        args.dry_run = False
+        self.assertFalse(main._get_cache(args).read_only)
 
     @mock.patch('os.listdir')
     @mock.patch('os.remove')
@@ -90,6 +420,24 @@ class TestTripleORepos(testtools.TestCase):
         self.assertNotIn(mock.call('/etc/yum.repos.d/foo.repo'),
                          mock_remove.mock_calls)
 
+    @mock.patch('os.listdir')
+    @mock.patch('os.remove')
+    @mock.patch('os.path.exists')
+    def test_remove_existing_keep(self, mock_exists, mock_remove,
+                                  mock_listdir):
+        mock_exists.return_value = True
+        mock_listdir.return_value = ['delorean.repo', 'delorean-deps.repo']
+        mock_args = mock.Mock()
+        mock_args.output_path = '/etc/yum.repos.d'
+        mock_args.distro = 'centos9'
+        removed = main._remove_existing(
+            mock_args, keep=['/etc/yum.repos.d/delorean.repo'])
+        removed_paths = [f.path for f in removed]
+        self.assertNotIn('/etc/yum.repos.d/delorean.repo', removed_paths)
+        self.assertIn('/etc/yum.repos.d/delorean-deps.repo', removed_paths)
+        self.assertNotIn(mock.call('/etc/yum.repos.d/delorean.repo'),
+                         mock_remove.mock_calls)
+
     # There is no $DISTRO single path anymore, every path has branch
     # specification, even master
     def test_get_base_path(self):
@@ -100,78 +448,188 @@ class TestTripleORepos(testtools.TestCase):
         path = main._get_base_path(args)
         self.assertEqual('http://trunk.rdoproject.org/centos9-master/', path)
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_current(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['current']
         args.dlrn_hash_tag = None
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/current/delorean.repo', args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
                                     name='delorean'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
                           ],
                          mock_write.mock_calls)
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
-    def test_install_repos_deps(self, mock_write, mock_get):
+    def test_install_repos_current_and_deps_fetched_once(self, mock_write,
+                                                         mock_get):
+        args = mock.Mock(durability=None)
+        args.repos = ['current', 'deps']
+        args.dlrn_hash_tag = None
+        args.branch = 'master'
+        args.output_path = 'test'
+        args.distro = 'fake'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
+        main._install_repos(args, 'roads/')
+        self.assertCountEqual([mock.call('roads/current/delorean.repo', args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
+        self.assertEqual(3, mock_write.call_count)
+
+    def test_parse_target(self):
+        self.assertEqual(main.Target('centos9', 'master', '/srv/a:b'),
+                         main._parse_target('centos9:master:/srv/a:b'))
+        for value in ('centos9:master', 'centos9::/srv', 'doc7:master:/srv'):
+            self.assertRaises(argparse.ArgumentTypeError,
+                              main._parse_target, value)
+
+    def test_target_args(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '-d', 'centos9',
+                                             '--target', 'rhel9:wallaby:a',
+                                             '--target', 'ubi8:master:b']):
+            args = main._parse_args('centos', '9')
+        rhel9 = main._target_args(args, args.targets[0])
+        self.assertEqual(('rhel9', 'wallaby', 'a'),
+                         (rhel9.distro, rhel9.branch, rhel9.output_path))
+        self.assertEqual(main.DEFAULT_MIRROR_MAP['rhel9'], rhel9.mirror)
+        self.assertEqual('centos9', args.distro)
+        args.mirror = 'http://foo'
+        ubi8 = main._target_args(args, args.targets[1])
+        self.assertEqual('http://foo', ubi8.mirror)
+        self.assertEqual(main.DEFAULT_MIRROR_MAP['ubi8'], ubi8.old_mirror)
+
+    @mock.patch('repo_setup.main._download_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_targets_share_downloads(self, mock_write, mock_download):
+        mock_download.side_effect = lambda url, args, cache: (
+            'http://lone',
+            '[delorean]\nbaseurl=%s/x\n' % main.DEFAULT_RDO_MIRROR)
+        mock_write.side_effect = lambda content, target, name=None: (
+            main.RepoFile(os.path.join(target, name or 'deps'), True, []))
+        targets_args = []
+        for output_path, branch in (('a', 'master'), ('b', 'master'),
+                                    ('c', 'wallaby')):
+            targets_args.append(mock.Mock(
+                repos=['current'], dlrn_hash_tag=None, branch=branch,
+                distro='fake', output_path=output_path, old_mirror=None,
+                rdo_mirror='http://lone', rdo_mirrors=['http://lone'],
+                durability=None))
+        args = mock.Mock(rdo_mirror='http://lone')
+        plans = [(t, main._get_base_path(t)) for t in targets_args]
+        results = main._install_targets(args, plans)
+        self.assertCountEqual(
+            ['http://lone/fake-master/current/delorean.repo',
+             'http://lone/fake-master/delorean-deps.repo',
+             'http://lone/fake-wallaby/current/delorean.repo',
+             'http://lone/fake-wallaby/delorean-deps.repo'],
+            [c[0][0] for c in mock_download.call_args_list])
+        self.assertEqual(['a', 'b', 'c'],
+                         [t.output_path for t, __ in results])
+        self.assertEqual([2, 2, 2], [len(files) for __, files in results])
+        mock_write.assert_any_call('[delorean]\nbaseurl=http://lone/x\n',
+                                   'a', name='delorean')
+
+    @mock.patch('repo_setup.main._get_distro',
+                mock.Mock(return_value=('centos', '9', 'CentOS Stream 9')))
+    @mock.patch('repo_setup.main._get_cache', mock.Mock(return_value=None))
+    @mock.patch('repo_setup.main._download_repos',
+                mock.Mock(return_value={}))
+    @mock.patch('repo_setup.main._validate_args', mock.Mock())
+    @mock.patch('repo_setup.main._clean_metadata')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_targets')
+    def test_main_targets(self, mock_install, mock_remove, mock_clean):
+        argv = ['repo-setup', 'current', '--target', 'centos9:master:/srv/a',
+                '--target', 'centos9:wallaby:' + main.DEFAULT_OUTPUT_PATH]
+        mock_install.side_effect = lambda args, plans, *a, **kw: [
+            (t, [main.RepoFile(t.output_path + '/delorean.repo', True, [])])
+            for t, __ in plans]
+        mock_remove.return_value = []
+        with mock.patch.object(sys, 'argv', argv):
+            main.main()
+        self.assertEqual(2, mock_remove.call_count)
+        mock_clean.assert_called_once_with(mock.ANY, mock.ANY)
+        self.assertEqual(main.DEFAULT_OUTPUT_PATH,
+                         mock_clean.call_args[0][0].output_path)
+
+    def test_main_targets_same_output_path(self):
+        args = mock.Mock(targets=[main.Target('centos9', 'master', 'a'),
+                                  main.Target('rhel9', 'master', 'a')])
+        self.assertRaises(main.InvalidArguments, main._run, args,
+                          'CentOS Stream 9', '9')
+
+    def test_plan_repo_urls(self):
         args = mock.Mock()
+        args.repos = ['current-podified', 'deps', 'ceph']
+        args.dlrn_hash_tag = None
+        args.distro = 'rhel9'
+        urls = main._plan_repo_urls(args, 'roads/')
+        self.assertEqual(['roads/current-podified/delorean.repo',
+                          'roads/osptrunk-deps.repo'], urls)
+
+    @mock.patch('repo_setup.main._download_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_deps(self, mock_write, mock_get):
+        args = mock.Mock(durability=None)
         args.repos = ['deps']
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
-        mock_get.return_value = '[delorean-deps]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean-deps]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        mock_get.assert_called_once_with('roads/delorean-deps.repo', args)
+        mock_get.assert_called_once_with('roads/delorean-deps.repo', args,
+                                         None)
         mock_write.assert_called_once_with('[delorean-deps]\nMr. Fusion',
                                            'test')
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_current_podified(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['current-podified']
         args.dlrn_hash_tag = None
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current-podified/delorean.repo',
-                                    args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/current-podified/delorean.repo',
+                                         args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
                           ],
                          mock_write.mock_calls)
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_podified_ci_testing(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['podified-ci-testing']
         args.dlrn_hash_tag = None
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/podified-ci-testing/delorean.repo',
-                                    args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/podified-ci-testing/delorean.repo',
+                                         args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
                           ],
@@ -188,7 +646,7 @@ class TestTripleORepos(testtools.TestCase):
             'antelope': 'pacific',
             'master': 'pacific',
         }
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['ceph']
         args.branch = branch
         args.output_path = 'test'
@@ -205,10 +663,10 @@ class TestTripleORepos(testtools.TestCase):
         self.assertRaises(main.InvalidArguments, main._install_repos, args,
                           'roads/')
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_centos8(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['current']
         args.dlrn_hash_tag = None
         args.branch = 'master'
@@ -216,12 +674,12 @@ class TestTripleORepos(testtools.TestCase):
         args.distro = 'centos8'
         args.stream = False
         args.mirror = 'mirror'
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/current/delorean.repo', args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
                                     name='delorean'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
@@ -240,10 +698,10 @@ class TestTripleORepos(testtools.TestCase):
                           ],
                          mock_write.mock_calls)
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_centos8_stream(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['current']
         args.branch = 'master'
         args.output_path = 'test'
@@ -252,12 +710,12 @@ class TestTripleORepos(testtools.TestCase):
         args.no_stream = False
         args.mirror = 'mirror'
         args.dlrn_hash_tag = None
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/current/delorean.repo', args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
                                     name='delorean'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
@@ -276,10 +734,10 @@ class TestTripleORepos(testtools.TestCase):
                           ],
                          mock_write.mock_calls)
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_centos9_stream(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['current']
         args.dlrn_hash_tag = None
         args.branch = 'master'
@@ -288,12 +746,12 @@ class TestTripleORepos(testtools.TestCase):
         args.stream = True
         args.no_stream = False
         args.mirror = 'mirror'
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/current/delorean.repo', args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
                                     name='delorean'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
@@ -324,10 +782,10 @@ class TestTripleORepos(testtools.TestCase):
                           ],
                          mock_write.mock_calls)
 
-    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._download_repo')
     @mock.patch('repo_setup.main._write_repo')
     def test_install_repos_centos8_no_stream(self, mock_write, mock_get):
-        args = mock.Mock()
+        args = mock.Mock(durability=None)
         args.repos = ['current']
         args.dlrn_hash_tag = None
         args.branch = 'master'
@@ -336,12 +794,12 @@ class TestTripleORepos(testtools.TestCase):
         args.stream = False
         args.no_stream = True
         args.mirror = 'mirror'
-        mock_get.return_value = '[delorean]\nMr. Fusion'
+        mock_get.return_value = (None, '[delorean]\nMr. Fusion')
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
-                          ],
-                         mock_get.mock_calls)
+        self.assertCountEqual([mock.call('roads/current/delorean.repo', args, None),
+                               mock.call('roads/delorean-deps.repo', args, None),
+                               ],
+                              mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
                                     name='delorean'),
                           mock.call('[delorean]\nMr. Fusion', 'test'),
@@ -361,11 +819,86 @@ class TestTripleORepos(testtools.TestCase):
                          mock_write.mock_calls)
 
     def test_write_repo(self):
-        m = mock.mock_open()
-        with mock.patch('repo_setup.main.open', m, create=True):
-            main._write_repo('#Doc\n[delorean]\nThis=Heavy', 'test')
-        m.assert_called_once_with('test/delorean.repo', 'w')
-        m().write.assert_called_once_with('#Doc\n[delorean]\nThis=Heavy')
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        result = main._write_repo('#Doc\n[delorean]\nThis=Heavy', target)
+        filename = os.path.join(target, 'delorean.repo')
+        self.assertEqual(main.RepoFile(filename, True, ['delorean'], None,
+                                       '#Doc\n[delorean]\nThis=Heavy'),
+                         result)
+        with open(filename) as f:
+            self.assertEqual('#Doc\n[delorean]\nThis=Heavy', f.read())
+        self.assertEqual(0o644, os.stat(filename).st_mode & 0o777)
+
+    def test_write_repo_unchanged(self):
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        main._write_repo('[delorean]\nThis=Heavy', target)
+        with mock.patch('repo_setup.utils.atomic_write') as mock_write:
+            result = main._write_repo('[delorean]\nThis=Heavy', target)
+        self.assertFalse(result.changed)
+        mock_write.assert_not_called()
+
+    def test_write_repo_dry_run(self):
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        result = main._write_repo('[delorean]\nThis=Heavy', target,
+                                  dry_run=True)
+        self.assertTrue(result.changed)
+        self.assertEqual('[delorean]\nThis=Heavy', result.content)
+        self.assertEqual([], os.listdir(target))
+
+    def test_remove_existing_dry_run(self):
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        filename = os.path.join(target, 'delorean-old.repo')
+        with open(filename, 'w') as f:
+            f.write('[delorean-old]\n')
+        args = mock.Mock(output_path=target, distro='centos9')
+        with mock.patch('os.path.exists',
+                        side_effect=lambda p: p.startswith(target)):
+            removed = main._remove_existing(args, dry_run=True)
+        self.assertEqual([main.RepoFile(filename, True, ['delorean-old'],
+                                        '[delorean-old]\n', None)], removed)
+        self.assertTrue(os.path.exists(filename))
+
+    @mock.patch('repo_setup.main._download_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_dry_run(self, mock_write, mock_get):
+        args = mock.Mock(repos=['deps'], dlrn_hash_tag=None,
+                         output_path='test', distro='fake')
+        mock_get.return_value = (None, '[delorean-deps]\nMr. Fusion')
+        main._install_repos(args, 'roads/', dry_run=True)
+        mock_write.assert_called_once_with('[delorean-deps]\nMr. Fusion',
+                                           'test', dry_run=True)
+
+    @mock.patch('repo_setup.main._download_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_durability(self, mock_write, mock_get):
+        args = mock.Mock(repos=['deps'], dlrn_hash_tag=None,
+                         output_path='test', distro='fake', durability='none')
+        mock_get.return_value = (None, '[delorean-deps]\nMr. Fusion')
+        main._install_repos(args, 'roads/')
+        mock_write.assert_called_once_with('[delorean-deps]\nMr. Fusion',
+                                           'test', durability='none')
+
+    @mock.patch('repo_setup.utils.atomic_write')
+    def test_write_repo_durability(self, mock_write):
+        main._write_repo('[delorean]\nThis=Heavy', 'test', durability='none')
+        mock_write.assert_called_once_with('test/delorean.repo',
+                                           '[delorean]\nThis=Heavy',
+                                           durability='none')
+
+    def test_merge_repo_files(self):
+        result = main._merge_repo_files([
+            main.RepoFile('test/delorean-deps.repo', True, ['deps']),
+            main.RepoFile('test/delorean.repo', False, ['delorean']),
+            main.RepoFile('test/delorean-deps.repo', False, ['deps']),
+        ])
+        self.assertEqual(
+            [main.RepoFile('test/delorean-deps.repo', True, ['deps']),
+             main.RepoFile('test/delorean.repo', False, ['delorean'])],
+            result)
 
     def test_write_repo_invalid(self):
         self.assertRaises(main.NoRepoTitle, main._write_repo, 'Great Scot!',
@@ -392,6 +925,13 @@ class TestTripleORepos(testtools.TestCase):
         self.assertEqual('master', args.branch)
         self.assertEqual('test', args.output_path)
 
+    def test_parse_args_rdo_mirrors(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '--rdo-mirror',
+                                             'http://lone, http://twin']):
+            args = main._parse_args('centos', '9')
+        self.assertEqual('http://lone', args.rdo_mirror)
+        self.assertEqual(['http://lone', 'http://twin'], args.rdo_mirrors)
+
     def test_change_priority(self):
         result = main._change_priority('[delorean]\npriority=1', 10)
         self.assertEqual('[delorean]\npriority=10', result)
@@ -0,0 +1,146 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import testtools
+
+import repo_setup.metrics as repos_metrics
+import repo_setup.timing as repos_timing
+
+
+class TestMetrics(testtools.TestCase):
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(repos_metrics.METRICS_DIR_ENV, None)
+        os.environ.pop(repos_timing.TIMINGS_ENV, None)
+        self.prom_path = os.path.join(self.metrics_dir, 'repo-setup.prom')
+
+    def _prom(self):
+        with open(self.prom_path) as f:
+            return f.read().splitlines()
+
+    def _run(self, fail=False):
+        with repos_timing.recording('repo-setup') as recorder:
+            # spans recorded before the sink was added count too
+            with repos_timing.span('http', url='http://lone/a.repo') as span:
+                span.update(status=200, bytes=10)
+            repos_metrics.attach(recorder, self.metrics_dir)
+            with repos_timing.span('http', url='http://lone/b.repo') as span:
+                span.update(status=304, bytes=0)
+            with repos_timing.span('http', url='http://twin/a.repo') as span:
+                span['status'] = -1
+            with repos_timing.span('write', path='/tmp/a.repo', bytes=10):
+                pass
+            if fail:
+                with repos_timing.span('dnf_clean'):
+                    raise RuntimeError('Great Scott!')
+
+    def test_render(self):
+        labels = (('command', 'repo-setup'),)
+        histogram_key = ('repo_setup_dnf_clean_duration_seconds', labels)
+        counts = [0] * (len(repos_metrics.DNF_CLEAN_BUCKETS) + 1)
+        counts[1] = 2
+        counts[-1] = 1
+        text = repos_metrics.render(
+            {('repo_setup_runs_total',
+              labels + (('result', 'success'),)): 3},
+            {histogram_key: [counts, 301.5, 3]},
+            {('repo_setup_last_run_success', labels): 1})
+        lines = text.splitlines()
+        self.assertEqual([
+            '# HELP repo_setup_runs_total Runs by result.',
+            '# TYPE repo_setup_runs_total counter',
+            'repo_setup_runs_total{command="repo-setup",result="success"} 3',
+            '# HELP repo_setup_last_run_success Whether the last run '
+            'succeeded.',
+            '# TYPE repo_setup_last_run_success gauge',
+            'repo_setup_last_run_success{command="repo-setup"} 1',
+        ], lines[:6])
+        self.assertIn('repo_setup_dnf_clean_duration_seconds_bucket'
+                      '{command="repo-setup",le="0.5"} 0', lines)
+        self.assertIn('repo_setup_dnf_clean_duration_seconds_bucket'
+                      '{command="repo-setup",le="1.0"} 2', lines)
+        self.assertIn('repo_setup_dnf_clean_duration_seconds_bucket'
+                      '{command="repo-setup",le="+Inf"} 3', lines)
+        self.assertIn('repo_setup_dnf_clean_duration_seconds_sum'
+                      '{command="repo-setup"} 301.5', lines)
+        self.assertIn('repo_setup_dnf_clean_duration_seconds_count'
+                      '{command="repo-setup"} 3', lines)
+
+    def test_render_escapes_labels(self):
+        text = repos_metrics.render(
+            {('repo_setup_runs_total', (('result', 'a"b\\c\n'),)): 1}, {}, {})
+        self.assertIn('repo_setup_runs_total{result="a\\"b\\\\c\\n"} 1',
+                      text.splitlines())
+
+    def test_sink_accumulates_runs(self):
+        self._run()
+        self.assertRaises(RuntimeError, self._run, fail=True)
+
+        lines = self._prom()
+        self.assertIn('repo_setup_runs_total'
+                      '{command="repo-setup",result="success"} 1', lines)
+        self.assertIn('repo_setup_runs_total'
+                      '{command="repo-setup",result="failure"} 1', lines)
+        self.assertIn('repo_setup_last_run_success{command="repo-setup"} 0',
+                      lines)
+        self.assertIn('repo_setup_http_requests_total'
+                      '{command="repo-setup",host="lone",status="200"} 2',
+                      lines)
+        self.assertIn('repo_setup_http_requests_total'
+                      '{command="repo-setup",host="lone",status="304"} 2',
+                      lines)
+        self.assertIn('repo_setup_http_requests_total'
+                      '{command="repo-setup",host="twin",status="error"} 2',
+                      lines)
+        self.assertIn('repo_setup_http_response_bytes_total'
+                      '{command="repo-setup",host="lone"} 20', lines)
+        self.assertIn('repo_setup_http_request_duration_seconds_count'
+                      '{command="repo-setup",host="lone"} 4', lines)
+        self.assertIn('repo_setup_file_writes_total'
+                      '{command="repo-setup",result="success"} 2', lines)
+        self.assertIn('repo_setup_dnf_clean_total'
+                      '{command="repo-setup",result="failure"} 1', lines)
+        # only the .prom file is seen by the textfile collector
+        self.assertEqual(['repo-setup.prom'],
+                         [f for f in os.listdir(self.metrics_dir)
+                          if f.endswith('.prom')])
+
+    def test_sink_invalid_state(self):
+        self._run()
+        with open(os.path.join(self.metrics_dir,
+                               '.repo-setup.state.json'), 'w') as f:
+            f.write('{"version": 1, "counters": 42}')
+        self._run()
+        self.assertIn('repo_setup_runs_total'
+                      '{command="repo-setup",result="success"} 1',
+                      self._prom())
+
+    def test_attach_env(self):
+        with repos_timing.recording('repo-setup') as recorder:
+            repos_metrics.attach(recorder)
+        self.assertEqual([], recorder.sinks)
+        os.environ[repos_metrics.METRICS_DIR_ENV] = self.metrics_dir
+        with repos_timing.recording('repo-setup') as recorder:
+            repos_metrics.attach(recorder)
+        self.assertTrue(os.path.exists(self.prom_path))
@@ -0,0 +1,180 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import testtools
+
+from repo_setup import main
+import repo_setup.mirrors as repos_mirrors
+
+FAKE_PATH = '9-stream/BaseOS/x86_64/os/repodata/repomd.xml'
+FAKE_REPOMD = b'<?xml version="1.0"?>\n<repomd></repomd>\n'
+
+
+def _probe(mirror, healthy=True, latency=0.1, throughput=1000000.0):
+    return repos_mirrors.MirrorProbe(mirror, healthy, latency, throughput)
+
+
+class TestMirrors(testtools.TestCase):
+    def setUp(self):
+        super(TestMirrors, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_probe_mirror(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = mock.Mock(status_code=200,
+                                          content=FAKE_REPOMD)
+        probe = repos_mirrors.probe_mirror('http://lone/', FAKE_PATH)
+        self.assertEqual('http://lone/', probe.mirror)
+        self.assertTrue(probe.healthy)
+        self.assertIsNotNone(probe.latency)
+        mock_get.assert_called_once_with('http://lone/' + FAKE_PATH,
+                                         timeout=repos_mirrors.PROBE_TIMEOUT,
+                                         stream=True)
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_probe_mirror_unhealthy(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = mock.Mock(status_code=200,
+                                          content=b'<html>Captive</html>')
+        self.assertFalse(
+            repos_mirrors.probe_mirror('http://lone', FAKE_PATH).healthy)
+        mock_get.side_effect = IOError('Great Scott!')
+        self.assertEqual(_probe('http://lone', False, None, None),
+                         repos_mirrors.probe_mirror('http://lone', FAKE_PATH))
+
+    @mock.patch('repo_setup.mirrors.probe_mirror')
+    def test_rank_mirrors(self, mock_probe):
+        probes = {
+            'http://down': _probe('http://down', healthy=False),
+            'http://slow': _probe('http://slow', latency=2.0),
+            'http://thin': _probe('http://thin', throughput=500000.0),
+            'http://fast': _probe('http://fast'),
+        }
+        mock_probe.side_effect = lambda mirror, path, timeout: probes[mirror]
+        ranking = repos_mirrors.rank_mirrors(
+            ['http://down', 'http://slow', 'http://thin', 'http://fast'],
+            FAKE_PATH)
+        self.assertEqual(
+            ['http://fast', 'http://thin', 'http://slow', 'http://down'],
+            [probe.mirror for probe in ranking])
+
+    @mock.patch('repo_setup.mirrors.rank_mirrors')
+    def test_select_mirror_cached(self, mock_rank):
+        mirrors = ['http://lone', 'http://twin']
+        mock_rank.return_value = [_probe('http://twin'),
+                                  _probe('http://lone', healthy=False)]
+        self.assertEqual('http://twin', repos_mirrors.select_mirror(
+            mirrors, FAKE_PATH, cache_dir=self.cache_dir))
+        self.assertEqual('http://twin', repos_mirrors.select_mirror(
+            mirrors, FAKE_PATH, cache_dir=self.cache_dir))
+        mock_rank.assert_called_once_with(mirrors, FAKE_PATH)
+        # another stream is ranked on its own
+        repos_mirrors.select_mirror(mirrors, 'other/repomd.xml',
+                                    cache_dir=self.cache_dir)
+        self.assertEqual(2, mock_rank.call_count)
+
+    @mock.patch('repo_setup.mirrors.rank_mirrors')
+    def test_select_mirror_expired(self, mock_rank):
+        mirrors = ['http://lone', 'http://twin']
+        mock_rank.return_value = [_probe('http://lone')]
+        repos_mirrors.select_mirror(mirrors, FAKE_PATH,
+                                    cache_dir=self.cache_dir)
+        with mock.patch('time.time', return_value=time.time() + 61):
+            repos_mirrors.select_mirror(mirrors, FAKE_PATH,
+                                        cache_dir=self.cache_dir, ttl=60)
+        self.assertEqual(2, mock_rank.call_count)
+
+    @mock.patch('repo_setup.mirrors.rank_mirrors')
+    def test_select_mirror_none_healthy(self, mock_rank):
+        mock_rank.return_value = [_probe('http://twin', healthy=False)]
+        self.assertEqual('http://lone', repos_mirrors.select_mirror(
+            ['http://lone', 'http://twin'], FAKE_PATH,
+            cache_dir=self.cache_dir))
+        # a network blip doesn't pin the fallback for the whole ttl
+        self.assertEqual([], os.listdir(self.cache_dir))
+        repos_mirrors.select_mirror(['http://lone', 'http://twin'],
+                                    FAKE_PATH, cache_dir=self.cache_dir)
+        self.assertEqual(2, mock_rank.call_count)
+
+    @mock.patch('repo_setup.mirrors.rank_mirrors')
+    def test_select_mirror_read_only(self, mock_rank):
+        mock_rank.return_value = [_probe('http://twin')]
+        self.assertEqual('http://twin', repos_mirrors.select_mirror(
+            ['http://lone', 'http://twin'], FAKE_PATH,
+            cache_dir=self.cache_dir, read_only=True))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    @mock.patch('platform.machine', mock.Mock(return_value='x86_64'))
+    @mock.patch('repo_setup.mirrors.logging')
+    def test_save_ranking_not_writable(self, mock_logging):
+        ranking = [_probe('http://lone')]
+        with mock.patch('os.makedirs',
+                        side_effect=OSError(errno.EACCES, 'Permission denied')):
+            repos_mirrors.save_ranking(
+                os.path.join(self.cache_dir, 'sub'), ['http://lone'],
+                FAKE_PATH, ranking)
+        mock_logging.warning.assert_not_called()
+        mock_logging.debug.assert_called_once_with(
+            'Unable to cache the mirror ranking: %s', mock.ANY)
+
+        with mock.patch('os.makedirs',
+                        side_effect=OSError(errno.ENOSPC, 'No space left')):
+            repos_mirrors.save_ranking(
+                os.path.join(self.cache_dir, 'sub'), ['http://lone'],
+                FAKE_PATH, ranking)
+        mock_logging.warning.assert_called_once_with(
+            'Unable to cache the mirror ranking: %s', mock.ANY)
+
+    def test_mirror_probe_path(self):
+        args = mock.Mock(distro='centos9')
+        self.assertEqual(FAKE_PATH, main._mirror_probe_path(args))
+        args = mock.Mock(distro='centos8', stream=True, no_stream=False)
+        self.assertEqual(
+            'centos/8-stream/BaseOS/x86_64/os/repodata/repomd.xml',
+            main._mirror_probe_path(args))
+        self.assertIsNone(main._mirror_probe_path(mock.Mock(distro='rhel9')))
+
+    @mock.patch('repo_setup.mirrors.select_mirror')
+    def test_select_mirror_auto(self, mock_select):
+        mock_select.return_value = 'http://twin'
+        args = mock.Mock(distro='centos9', mirror='auto',
+                         mirror_candidates='http://twin',
+                         old_mirror='http://mirror.stream.centos.org',
+                         no_cache=False, cache_dir=self.cache_dir,
+                         mirror_ttl=60, dry_run=False)
+        self.assertEqual('http://twin', main._select_mirror(args))
+        self.assertEqual('http://twin', args.mirror)
+        mock_select.assert_called_once_with(
+            ['http://mirror.stream.centos.org', 'http://twin'], mock.ANY,
+            cache_dir=self.cache_dir, ttl=60, read_only=False)
+
+    @mock.patch('repo_setup.mirrors.select_mirror')
+    def test_select_mirror_not_auto(self, mock_select):
+        args = mock.Mock(mirror='http://lone')
+        self.assertEqual('http://lone', main._select_mirror(args))
+        args = mock.Mock(distro='rhel9', mirror='auto',
+                         mirror_candidates='http://twin',
+                         old_mirror='https://trunk.rdoproject.org')
+        self.assertEqual('https://trunk.rdoproject.org',
+                         main._select_mirror(args))
+        mock_select.assert_not_called()
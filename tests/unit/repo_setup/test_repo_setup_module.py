@@ -0,0 +1,111 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+from unittest import mock
+
+import testtools
+
+from repo_setup import main
+from .. import modules
+
+repo_setup_module = modules.load_module('repo_setup')
+
+WRITTEN = main.RepoFile('/etc/yum.repos.d/delorean.repo', True,
+                        ['delorean'], '[delorean]\nold\n', '[delorean]\n')
+UNCHANGED = main.RepoFile('/etc/yum.repos.d/delorean-deps.repo', False,
+                          ['delorean-deps'], '[delorean-deps]\n',
+                          '[delorean-deps]\n')
+REMOVED = main.RepoFile('/etc/yum.repos.d/delorean-old.repo', True,
+                        ['delorean-old'], '[delorean-old]\n', None)
+
+
+def _run_result(repo_files):
+    return main.RepoSetupResult(
+        written=[f.path for f in repo_files if f.changed and f.content],
+        unchanged=[f.path for f in repo_files if not f.changed],
+        removed=[f.path for f in repo_files if f.changed and not f.content],
+        fetched=['https://trunk.rdoproject.org/centos9-master/'
+                 'current-podified/delorean.repo'],
+        timings={'install': 0.1},
+        repo_files=repo_files)
+
+
+@mock.patch('repo_setup.main.run')
+class TestRepoSetupModule(testtools.TestCase):
+    def test_changed(self, mock_run):
+        mock_run.return_value = _run_result([WRITTEN, UNCHANGED, REMOVED])
+        result = modules.run_module(
+            repo_setup_module, {'repos': ['current-podified']})
+
+        self.assertTrue(result['changed'])
+        self.assertEqual([WRITTEN.path], result['written'])
+        self.assertEqual([UNCHANGED.path], result['unchanged'])
+        self.assertEqual([REMOVED.path], result['removed'])
+        self.assertEqual(['delorean', 'delorean-old'],
+                         result['changed_repo_ids'])
+        self.assertNotIn('diff', result)
+        options = mock_run.call_args[0][0]
+        self.assertEqual(['current-podified'], options.repos)
+        self.assertFalse(options.dry_run)
+        self.assertFalse(options.no_cache)
+
+    def test_unchanged(self, mock_run):
+        mock_run.return_value = _run_result([UNCHANGED])
+        result = modules.run_module(
+            repo_setup_module, {'repos': ['current-podified']})
+
+        self.assertFalse(result['changed'])
+        self.assertEqual([], result['changed_repo_ids'])
+
+    def test_check_mode(self, mock_run):
+        mock_run.return_value = _run_result([WRITTEN, UNCHANGED])
+        result = modules.run_module(
+            repo_setup_module, {'repos': ['current-podified']},
+            check_mode=True)
+
+        self.assertTrue(result['changed'])
+        self.assertEqual([WRITTEN.path], result['written'])
+        self.assertTrue(mock_run.call_args[0][0].dry_run)
+
+    def test_diff(self, mock_run):
+        mock_run.return_value = _run_result([WRITTEN, UNCHANGED, REMOVED])
+        result = modules.run_module(
+            repo_setup_module, {'repos': ['current-podified']}, diff=True)
+
+        self.assertEqual([
+            dict(before_header=WRITTEN.path, after_header=WRITTEN.path,
+                 before='[delorean]\nold\n', after='[delorean]\n'),
+            dict(before_header=REMOVED.path, after_header=REMOVED.path,
+                 before='[delorean-old]\n', after=''),
+        ], result['diff'])
+
+    def test_targets(self, mock_run):
+        mock_run.return_value = _run_result([])
+        modules.run_module(repo_setup_module, {
+            'repos': ['current-podified'],
+            'targets': [{'distro': 'centos9', 'branch': 'master',
+                         'output_path': '/srv/centos9'}],
+            'cache': False,
+        })
+
+        options = mock_run.call_args[0][0]
+        self.assertEqual([main.Target('centos9', 'master', '/srv/centos9')],
+                         options.targets)
+        self.assertTrue(options.no_cache)
+
+    def test_failure(self, mock_run):
+        mock_run.side_effect = main.InvalidArguments('Great Scott!')
+        e = self.assertRaises(modules.ModuleFail, modules.run_module,
+                              repo_setup_module, {'repos': ['tomorrow']})
+        self.assertEqual('Great Scott!', e.result['msg'])
@@ -0,0 +1,155 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+import testtools
+
+import repo_setup.timing as repos_timing
+import repo_setup.utils as repos_utils
+
+
+class TestTiming(testtools.TestCase):
+    def setUp(self):
+        super(TestTiming, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.report_path = os.path.join(self.tmp_dir, 'timings.json')
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(repos_timing.TIMINGS_ENV, None)
+
+    def _report(self):
+        with open(self.report_path) as f:
+            return json.load(f)
+
+    def test_span_without_recording(self):
+        with repos_timing.span('http', url='http://lone') as span:
+            span['status'] = 200
+        self.assertIsNone(repos_timing.get_recorder())
+
+    def test_recording(self):
+        def write():
+            with repos_timing.span('write', path='/etc/yum.repos.d/x.repo'):
+                pass
+
+        with repos_timing.recording('repo-setup', self.report_path):
+            with repos_timing.span('install'):
+                with repos_timing.span('http', url='http://lone') as span:
+                    span['status'] = 200
+            # spans of other threads are recorded too
+            thread = threading.Thread(target=write)
+            thread.start()
+            thread.join()
+        self.assertIsNone(repos_timing.get_recorder())
+
+        report = self._report()
+        self.assertEqual('repo-setup', report['command'])
+        self.assertIsNone(report['error'])
+        self.assertEqual(['install', 'http', 'write'],
+                         [s['name'] for s in report['spans']])
+        self.assertEqual('http://lone', report['spans'][1]['url'])
+        self.assertEqual(200, report['spans'][1]['status'])
+        self.assertEqual(['http', 'install', 'write'],
+                         sorted(report['totals']))
+
+    def test_concurrent_recordings(self):
+        started = threading.Barrier(2)
+        recorders = {}
+
+        def worker(command):
+            with repos_timing.span('http', url='http://' + command):
+                pass
+
+        def run(command):
+            with repos_timing.recording(command) as recorder:
+                recorders[command] = recorder
+                started.wait()
+                with repos_timing.span('install'):
+                    thread = threading.Thread(
+                        target=repos_timing.bind(worker), args=(command,))
+                    thread.start()
+                    thread.join()
+                started.wait()
+
+        threads = [threading.Thread(target=run, args=(command,))
+                   for command in ('lone', 'twin')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsNone(repos_timing.get_recorder())
+        for command, recorder in recorders.items():
+            self.assertEqual(['http', 'install'],
+                             [s.name for s in recorder.spans])
+            self.assertEqual('http://' + command,
+                             recorder.spans[0].attrs['url'])
+
+    def test_recording_error(self):
+        def fail():
+            with repos_timing.recording('repo-setup', self.report_path):
+                with repos_timing.span('validate'):
+                    raise ValueError('Great Scott!')
+
+        self.assertRaises(ValueError, fail)
+        report = self._report()
+        self.assertEqual('Great Scott!', report['error'])
+        self.assertEqual('Great Scott!', report['spans'][0]['error'])
+
+    def test_recording_path(self):
+        # no report without a path
+        with repos_timing.recording('repo-setup'):
+            pass
+        self.assertEqual([], os.listdir(self.tmp_dir))
+        # the path can be set once the arguments are parsed
+        with repos_timing.recording('repo-setup') as recorder:
+            recorder.path = self.report_path
+        self.assertEqual('repo-setup', self._report()['command'])
+        os.unlink(self.report_path)
+        os.environ[repos_timing.TIMINGS_ENV] = self.report_path
+        with repos_timing.recording('repo-setup-get-hash'):
+            pass
+        self.assertEqual('repo-setup-get-hash', self._report()['command'])
+
+    def test_recording_max_spans(self):
+        with mock.patch.object(repos_timing, 'MAX_SPANS', 2):
+            with repos_timing.recording('repo-setup', self.report_path):
+                for i in range(3):
+                    with repos_timing.span('http'):
+                        pass
+        report = self._report()
+        self.assertEqual(2, len(report['spans']))
+        self.assertEqual(1, report['dropped_spans'])
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_http_get_span(self, mock_session):
+        mock_session.return_value.get.return_value = mock.Mock(
+            status_code=200, content=b'88MPH')
+        with repos_timing.recording('repo-setup') as recorder:
+            repos_utils.http_get('http://lone/delorean.repo')
+            repos_utils.atomic_write(
+                os.path.join(self.tmp_dir, 'delorean.repo'), '88MPH',
+                durability='none')
+        http, write = recorder.spans
+        self.assertEqual('http', http.name)
+        self.assertEqual({'url': 'http://lone/delorean.repo',
+                          'status': 200, 'bytes': 5}, http.attrs)
+        self.assertEqual('write', write.name)
+        self.assertEqual(5, write.attrs['bytes'])
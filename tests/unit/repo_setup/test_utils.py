@@ -0,0 +1,289 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import testtools
+
+import repo_setup.utils as repos_utils
+
+
+class TestHttpSession(testtools.TestCase):
+    def setUp(self):
+        super(TestHttpSession, self).setUp()
+        self.addCleanup(setattr, repos_utils, '_session', None)
+        repos_utils._session = None
+
+    def test_get_session_is_shared(self):
+        session = repos_utils.get_session()
+        self.assertIsNotNone(session)
+        self.assertIs(session, repos_utils.get_session())
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_http_get_uses_session(self, mock_session):
+        mock_response = mock.Mock(status_code=200, content=b'88MPH')
+        mock_session.return_value.get.return_value = mock_response
+        result = repos_utils.http_get('http://lone/pine/mall')
+        self.assertEqual(('88MPH', 200), result)
+        mock_session.return_value.get.assert_called_once_with(
+            'http://lone/pine/mall', timeout=repos_utils.HTTP_TIMEOUT)
+
+    @mock.patch('repo_setup.utils.get_session')
+    def test_http_get_error(self, mock_session):
+        mock_session.return_value.get.side_effect = IOError('Great Scott!')
+        result = repos_utils.http_get('http://lone/pine/mall')
+        self.assertEqual(('Great Scott!', -1), result)
+
+    @mock.patch('repo_setup.utils._http_get_fallback')
+    @mock.patch('repo_setup.utils.get_session')
+    def test_http_get_without_requests(self, mock_session, mock_fallback):
+        mock_session.return_value = None
+        mock_fallback.return_value = ('88MPH', 200)
+        result = repos_utils.http_get('http://lone/pine/mall')
+        self.assertEqual(('88MPH', 200), result)
+        mock_fallback.assert_called_once_with('http://lone/pine/mall')
+
+
+class TestHedgedCall(testtools.TestCase):
+    def setUp(self):
+        super(TestHedgedCall, self).setUp()
+        self.addCleanup(repos_utils._latencies.clear)
+        repos_utils._latencies.clear()
+
+    def test_split_mirrors(self):
+        self.assertEqual(['http://a', 'http://b'],
+                         repos_utils.split_mirrors(' http://a, http://b,'))
+        self.assertEqual(['http://a'], repos_utils.split_mirrors(['http://a']))
+        self.assertEqual([], repos_utils.split_mirrors(None))
+
+    def test_hedge_delay(self):
+        self.assertEqual(repos_utils.HEDGE_DEFAULT_DELAY,
+                         repos_utils.hedge_delay('http://a/x'))
+        for i in range(1, 21):
+            repos_utils.record_latency('http://a/%d' % i, i / 100.0)
+        self.assertEqual(0.19, repos_utils.hedge_delay('http://a/y'))
+        self.assertEqual(repos_utils.HEDGE_DEFAULT_DELAY,
+                         repos_utils.hedge_delay('http://b/y'))
+
+    def test_hedged_call_first_wins(self):
+        func = mock.Mock(return_value='88MPH')
+        result = repos_utils.hedged_call(func, ['http://a', 'http://b'])
+        self.assertEqual(('http://a', '88MPH'), result)
+        func.assert_called_once_with('http://a')
+
+    def test_hedged_call_failover(self):
+        def func(url):
+            if url == 'http://a':
+                raise IOError('Great Scott!')
+            return url
+        result = repos_utils.hedged_call(func, ['http://a', 'http://b'])
+        self.assertEqual(('http://b', 'http://b'), result)
+
+    def test_hedged_call_unsuccessful_result(self):
+        results = {'http://a': ('', 404), 'http://b': ('88MPH', 200)}
+        result = repos_utils.hedged_call(
+            results.get, ['http://a', 'http://b'],
+            is_success=lambda r: r[1] == 200)
+        self.assertEqual(('http://b', ('88MPH', 200)), result)
+
+    def test_hedged_call_all_fail(self):
+        func = mock.Mock(side_effect=IOError('Great Scott!'))
+        self.assertRaises(IOError, repos_utils.hedged_call,
+                          func, ['http://a', 'http://b'])
+        results = {'http://a': ('', 404), 'http://b': ('', 500)}
+        result = repos_utils.hedged_call(
+            results.get, ['http://a', 'http://b'],
+            is_success=lambda r: r[1] == 200)
+        self.assertEqual(500, result[1][1])
+
+    @mock.patch('repo_setup.utils.HEDGE_DEFAULT_DELAY', 0.01)
+    def test_hedged_call_slow_mirror(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def func(url):
+            if url == 'http://slow':
+                release.wait(5)
+            return url
+        result = repos_utils.hedged_call(func, ['http://slow', 'http://fast'])
+        self.assertEqual(('http://fast', 'http://fast'), result)
+
+    def test_hedged_call_abandons_slow_mirror(self):
+        # the process exits without waiting for the abandoned call
+        script = (
+            'import sys, time\n'
+            'import repo_setup.utils as repos_utils\n'
+            'repos_utils.HEDGE_DEFAULT_DELAY = 0.01\n'
+            'def func(url):\n'
+            '    if url == "http://slow":\n'
+            '        time.sleep(60)\n'
+            '    return url\n'
+            'print(repos_utils.hedged_call(func, ["http://slow", '
+            '"http://fast"])[0])\n')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.dirname(os.path.abspath(repos_utils.__file__))))
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=env, timeout=30)
+        self.assertEqual(b'http://fast', output.strip())
+        self.assertLess(time.time() - start, 20)
+
+    @mock.patch('repo_setup.utils.http_get')
+    def test_http_get_mirrors(self, mock_get):
+        mock_get.side_effect = lambda url: (
+            ('88MPH', 200) if url.startswith('http://b') else ('', 503))
+        self.assertEqual(('http://b/x', ('88MPH', 200)),
+                         repos_utils.http_get_mirrors(['http://a/x',
+                                                       'http://b/x']))
+
+
+class TestAtomicWrite(testtools.TestCase):
+    def setUp(self):
+        super(TestAtomicWrite, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.file_path = os.path.join(self.tmp_dir, 'delorean.repo')
+        self.addCleanup(repos_utils.set_durability, None)
+
+    def test_atomic_write(self):
+        with open(self.file_path, 'w') as f:
+            f.write('old')
+        os.chmod(self.file_path, 0o600)
+        repos_utils.atomic_write(self.file_path, '[delorean]\n')
+        with open(self.file_path) as f:
+            self.assertEqual('[delorean]\n', f.read())
+        self.assertEqual(0o600, os.stat(self.file_path).st_mode & 0o7777)
+        self.assertEqual(['delorean.repo'], os.listdir(self.tmp_dir))
+
+    def test_atomic_write_symlink(self):
+        os.mkdir(os.path.join(self.tmp_dir, 'dnf'))
+        target = os.path.join(self.tmp_dir, 'dnf', 'dnf.conf')
+        with open(target, 'w') as f:
+            f.write('old')
+        os.symlink('dnf/dnf.conf', self.file_path)
+        repos_utils.atomic_write(self.file_path, '[main]\n')
+        self.assertEqual('dnf/dnf.conf', os.readlink(self.file_path))
+        with open(target) as f:
+            self.assertEqual('[main]\n', f.read())
+        self.assertEqual(['dnf.conf'],
+                         os.listdir(os.path.join(self.tmp_dir, 'dnf')))
+
+    @mock.patch('os.chown')
+    @mock.patch('os.geteuid')
+    def test_atomic_write_owner(self, mock_geteuid, mock_chown):
+        with open(self.file_path, 'w') as f:
+            f.write('old')
+        stat = os.stat(self.file_path)
+        mock_geteuid.return_value = 1000
+        repos_utils.atomic_write(self.file_path, '[delorean]\n')
+        mock_chown.assert_not_called()
+        mock_geteuid.return_value = 0
+        repos_utils.atomic_write(self.file_path, '[delorean]\n')
+        mock_chown.assert_called_once_with(mock.ANY, stat.st_uid,
+                                           stat.st_gid)
+        # new files are left to the umask and the running user
+        mock_chown.reset_mock()
+        repos_utils.atomic_write(os.path.join(self.tmp_dir, 'new.repo'),
+                                 '[delorean]\n')
+        mock_chown.assert_not_called()
+
+    @mock.patch('os.rename', mock.Mock(side_effect=OSError('Great Scott!')))
+    def test_atomic_write_cleanup(self):
+        self.assertRaises(OSError, repos_utils.atomic_write,
+                          self.file_path, '[delorean]\n')
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    @mock.patch('repo_setup.utils._fsync_dir')
+    @mock.patch('os.fsync')
+    def test_atomic_write_durability(self, mock_fsync, mock_fsync_dir):
+        for level, file_syncs, dir_syncs in (('none', 0, 0),
+                                             ('file', 1, 0),
+                                             ('full', 2, 1)):
+            repos_utils.set_durability(level)
+            repos_utils.atomic_write(self.file_path, '[delorean]\n')
+            self.assertEqual(file_syncs, mock_fsync.call_count)
+            self.assertEqual(dir_syncs, mock_fsync_dir.call_count)
+
+    def test_get_durability(self):
+        with mock.patch.dict(os.environ, {repos_utils.DURABILITY_ENV: ''}):
+            self.assertEqual(repos_utils.DEFAULT_DURABILITY,
+                             repos_utils.get_durability())
+        with mock.patch.dict(os.environ,
+                             {repos_utils.DURABILITY_ENV: 'none'}):
+            self.assertEqual('none', repos_utils.get_durability())
+            repos_utils.set_durability('file')
+            self.assertEqual('file', repos_utils.get_durability())
+        with mock.patch.dict(os.environ,
+                             {repos_utils.DURABILITY_ENV: 'bogus'}):
+            repos_utils.set_durability(None)
+            self.assertEqual(repos_utils.DEFAULT_DURABILITY,
+                             repos_utils.get_durability())
+        self.assertRaises(ValueError, repos_utils.set_durability, 'bogus')
+
+
+FAKE_OS_RELEASE = """# a comment
+NAME="CentOS Stream"
+VERSION="9"
+ID=centos
+ID_LIKE='rhel fedora'
+VERSION_ID="9"
+
+PRETTY_NAME="CentOS \\"Stream\\" 9 costs \\$0"
+"""
+
+
+class TestOsRelease(testtools.TestCase):
+    def setUp(self):
+        super(TestOsRelease, self).setUp()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.os_release = os.path.join(tmp_dir, 'os-release')
+        with open(self.os_release, 'w') as f:
+            f.write(FAKE_OS_RELEASE)
+        self.addCleanup(repos_utils._os_release_cache.clear)
+
+    def test_parse_os_release(self):
+        info = repos_utils.parse_os_release(self.os_release)
+        self.assertEqual({'NAME': 'CentOS Stream',
+                          'VERSION': '9',
+                          'ID': 'centos',
+                          'ID_LIKE': 'rhel fedora',
+                          'VERSION_ID': '9',
+                          'PRETTY_NAME': 'CentOS "Stream" 9 costs $0'},
+                         info)
+
+    def test_parse_os_release_memoized(self):
+        repos_utils.parse_os_release(self.os_release)
+        with mock.patch('io.open') as mock_open:
+            info = repos_utils.parse_os_release(self.os_release)
+        mock_open.assert_not_called()
+        self.assertEqual('centos', info['ID'])
+
+    @mock.patch('os.path.exists')
+    def test_get_distro_info(self, mock_exists):
+        mock_exists.side_effect = lambda path: path == self.os_release
+        self.assertEqual(('centos', '9', 'CentOS Stream'),
+                         repos_utils.get_distro_info(self.os_release))
+
+    @mock.patch('platform.system', mock.Mock(return_value='Darwin'))
+    def test_get_distro_info_no_os_release(self):
+        self.assertEqual(('Darwin', 'unknown', 'unknown'),
+                         repos_utils.get_distro_info('/no/os-release'))
@@ -16,7 +16,6 @@ import copy
 import json
 import os
 from unittest import mock
-import urllib.request
 
 from . import fakes
 from . import test_main
@@ -24,6 +23,7 @@ import repo_setup.yum_config.constants as const
 import repo_setup.yum_config.exceptions as exc
 import repo_setup.yum_config.compose_repos as repos
 import repo_setup.yum_config.yum_config as yum_config
+import repo_setup.utils as repos_utils
 
 
 class TestComposeRepos(test_main.TestYumConfigBase):
@@ -41,12 +41,9 @@ class TestComposeRepos(test_main.TestYumConfigBase):
             dir_path=None,
             arch=const.COMPOSE_REPOS_SUPPORTED_ARCHS[0]):
 
-        url_res = mock.Mock()
         json_data = json.dumps(fakes.FAKE_COMPOSE_INFO)
-        self.mock_object(urllib.request, "urlopen",
-                         mock.Mock(return_value=url_res))
-        self.mock_object(url_res, 'read',
-                         mock.Mock(return_value=json_data))
+        self.mock_object(repos_utils, "http_get",
+                         mock.Mock(return_value=(json_data, 200)))
 
         return repos.YumComposeRepoConfig(
             compose_url, release, dir_path=dir_path, arch=arch)
@@ -64,8 +61,8 @@ class TestComposeRepos(test_main.TestYumConfigBase):
                           const.COMPOSE_REPOS_RELEASES[0])
 
     def test__get_compose_info_exc(self):
-        self.mock_object(urllib.request, "urlopen",
-                         mock.Mock(side_effect=Exception))
+        self.mock_object(repos_utils, "http_get",
+                         mock.Mock(return_value=("Not Found", 404)))
 
         self.assertRaises(exc.YumConfigComposeError,
                           self.repos._get_compose_info)
@@ -77,8 +74,8 @@ class TestComposeRepos(test_main.TestYumConfigBase):
             override_repos=False
         )
 
-    @mock.patch('builtins.open')
-    def test_add_section(self, open):
+    @mock.patch('repo_setup.utils.atomic_write')
+    def test_add_section(self, atomic_write):
         self.mock_object(os.path, 'isfile', mock.Mock(return_value=False))
         mock_add_section = self.mock_object(yum_config.YumConfig,
                                             "add_section")
@@ -86,6 +83,7 @@ class TestComposeRepos(test_main.TestYumConfigBase):
         self.repos.add_section(fakes.FAKE_SECTION1, fakes.FAKE_SET_DICT,
                                fakes.FAKE_FILE_PATH)
 
+        atomic_write.assert_called_once_with(fakes.FAKE_FILE_PATH, '')
         mock_add_section.assert_called_once_with(
             fakes.FAKE_SECTION1, fakes.FAKE_SET_DICT, fakes.FAKE_FILE_PATH
         )
@@ -13,6 +13,7 @@
 #   under the License.
 
 import ddt
+import io
 import sys
 import unittest
 from unittest import mock
@@ -23,6 +24,7 @@ import repo_setup.yum_config.__main__ as main
 import repo_setup.yum_config.compose_repos as repos
 import repo_setup.yum_config.constants as const
 import repo_setup.yum_config.dnf_manager as dnf_mgr
+import repo_setup.yum_config.exceptions as exc
 import repo_setup.yum_config.utils as utils
 import repo_setup.yum_config.yum_config as yum_cfg
 
@@ -95,6 +97,57 @@ class TestYumConfigMain(TestYumConfigBase):
             fakes.FAKE_REPO_DOWN_URL, file_path=fakes.FAKE_FILE_PATH,
             set_dict=expected_dict, enabled=True)
 
+    @ddt.data('[{"name": "fake_repo", "enabled": false,'
+              ' "set_opts": {"priority": 1, "exclude": ["a", "b"]}}]',
+              'repos:\n- name: fake_repo\n  enabled: false\n'
+              '  set_opts:\n    priority: 1\n    exclude: [a, b]\n')
+    def test_main_repo_batch(self, manifest):
+        sys.argv[1:] = ['repo', '--batch', '-']
+        self.mock_object(sys, 'stdin', io.StringIO(manifest))
+
+        yum_repo_obj = mock.Mock()
+        mock_apply_batch = self.mock_object(yum_repo_obj, 'apply_batch')
+        self.mock_object(yum_cfg, 'YumRepoConfig',
+                         mock.Mock(return_value=yum_repo_obj))
+
+        main.main()
+
+        mock_apply_batch.assert_called_once_with([
+            {'name': 'fake_repo', 'enabled': False, 'file_path': None,
+             'down_url': None,
+             'set_opts': {'priority': '1', 'exclude': 'a,b'}}])
+
+    @ddt.data('{"name": "fake_repo"}', '[{"enabled": true}]')
+    def test_main_repo_batch_invalid_manifest(self, manifest):
+        sys.argv[1:] = ['repo', '--batch', '-']
+        self.mock_object(sys, 'stdin', io.StringIO(manifest))
+        self.mock_object(yum_cfg, 'YumRepoConfig')
+
+        self.assertRaises(exc.YumConfigInvalidManifest, main.main)
+
+        self.mock_object(sys, 'stdin', io.StringIO(manifest))
+        with self.assertRaises(SystemExit) as command:
+            main.cli_entrypoint()
+
+        self.assertEqual(2, command.exception.code)
+
+    @ddt.data(['--name', 'fake_repo'], ['--disable'],
+              ['--set-opts', 'key1=value1'],
+              ['--config-file-path', fakes.FAKE_FILE_PATH],
+              ['--down-url', fakes.FAKE_REPO_DOWN_URL])
+    def test_main_repo_batch_conflicts(self, extra_args):
+        sys.argv[1:] = ['repo', '--batch', '-'] + extra_args
+        mock_yum_repo_obj = self.mock_object(yum_cfg, 'YumRepoConfig')
+
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr, \
+                self.assertRaises(SystemExit) as command:
+            main.main()
+
+        self.assertEqual(2, command.exception.code)
+        self.assertIn('argument --batch: not allowed with argument',
+                      stderr.getvalue())
+        mock_yum_repo_obj.assert_not_called()
+
     @ddt.data('enable', 'disable', 'reset', 'install', 'remove')
     def test_main_module(self, operation):
         sys.argv[1:] = ['module', operation, 'fake_module', '--stream',
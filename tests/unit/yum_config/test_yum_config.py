@@ -16,7 +16,9 @@ import configparser
 import copy
 import ddt
 import os
+import shutil
 import subprocess
+import tempfile
 from unittest import mock
 
 from . import fakes
@@ -104,33 +106,59 @@ class TestYumConfig(test_main.TestYumConfigBase):
         yum_config = self._create_yum_config_obj(
             dir_path=fakes.FAKE_DIR_PATH,
             file_extension='.conf')
-        parser_mocks = []
-        for i in range(3):
-            parser_mock = mock.Mock()
-            parser_mocks.append(parser_mock)
-            self.mock_object(parser_mock, 'read')
-
-        self.mock_object(parser_mocks[0], 'sections',
-                         mock.Mock(return_value=[]))
         # second file inside dir will have the expected sections
-        self.mock_object(parser_mocks[1], 'sections',
-                         mock.Mock(return_value=fakes.FAKE_SECTIONS))
-        self.mock_object(parser_mocks[2], 'sections',
-                         mock.Mock(return_value=[]))
+        mock_scan = self.mock_object(
+            yum_cfg, 'scan_sections',
+            mock.Mock(side_effect=[set(), set(fakes.FAKE_SECTIONS)]))
+        self.mock_object(os, 'stat')
         self.mock_object(os, 'listdir',
                          mock.Mock(return_value=fakes.FAKE_DIR_FILES))
         self.mock_object(os, 'access', mock.Mock(return_value=True))
-        self.mock_object(configparser, 'ConfigParser',
-                         mock.Mock(side_effect=parser_mocks))
 
         result = yum_config._get_config_files(fakes.FAKE_SECTION1)
         expected_dir_path = [os.path.join(fakes.FAKE_DIR_PATH,
                                           fakes.FAKE_DIR_FILES[1])]
 
         self.assertEqual(expected_dir_path, result)
+        self.assertEqual(2, mock_scan.call_count)
+
+    def test_get_config_files_uses_index(self):
+        dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir_path)
+        file_path = os.path.join(dir_path, 'fake.repo')
+        with open(file_path, 'w') as f:
+            f.write('[fake_section1]\nname=fake\n')
+        yum_config = yum_cfg.YumConfig(dir_path=dir_path,
+                                       file_extension='.repo')
+        mock_scan = self.mock_object(
+            yum_cfg, 'scan_sections',
+            mock.Mock(wraps=yum_cfg.scan_sections))
 
-    @mock.patch('builtins.open')
-    def test_update_section(self, open):
+        for i in range(3):
+            self.assertEqual([file_path], yum_config._get_config_files(
+                fakes.FAKE_SECTION1))
+        self.assertEqual(1, mock_scan.call_count)
+
+        # the file is scanned again once it changes
+        with open(file_path, 'w') as f:
+            f.write('[fake_section2]\nname=fake\n')
+        os.utime(file_path, (0, 0))
+        self.assertEqual([], yum_config._get_config_files(
+            fakes.FAKE_SECTION1))
+        self.assertEqual([file_path], yum_config._get_config_files(
+            fakes.FAKE_SECTION2))
+        self.assertEqual(2, mock_scan.call_count)
+
+    def test_scan_sections(self):
+        content = ('# [commented]\n[fake_section1]\nkey=[value]\n'
+                   '  [fake_section2]  \n')
+        with mock.patch('io.open', mock.mock_open(read_data=content)):
+            result = yum_cfg.scan_sections(fakes.FAKE_FILE_PATH)
+
+        self.assertEqual(set(fakes.FAKE_SECTIONS), result)
+
+    @mock.patch('repo_setup.utils.atomic_write')
+    def test_update_section(self, atomic_write):
         yum_config = self._create_yum_config_obj(
             valid_options=fakes.FAKE_SUPP_OPTIONS)
         config_parser = fakes.FakeConfigParser({fakes.FAKE_SECTION1: {}})
@@ -174,8 +202,8 @@ class TestYumConfig(test_main.TestYumConfigBase):
                           updates)
         mock_get_configs.assert_called_once_with(fakes.FAKE_SECTION1)
 
-    @mock.patch('builtins.open')
-    def test_add_section(self, open):
+    @mock.patch('repo_setup.utils.atomic_write')
+    def test_add_section(self, atomic_write):
         yum_config = self._create_yum_config_obj(
             valid_options=fakes.FAKE_SUPP_OPTIONS)
         config_parser = fakes.FakeConfigParser({fakes.FAKE_SECTION1: {}})
@@ -212,11 +240,12 @@ class TestYumConfig(test_main.TestYumConfigBase):
         mock_read_config.assert_called_once_with(
             file_path=fakes.FAKE_FILE_PATH)
 
-    @mock.patch('builtins.open')
-    def test_add_update_all_sections(self, open):
+    @mock.patch('repo_setup.utils.atomic_write')
+    def test_add_update_all_sections(self, atomic_write):
         yum_config = self._create_yum_config_obj(
             valid_options=fakes.FAKE_SUPP_OPTIONS)
-        config_parser = fakes.FakeConfigParser({fakes.FAKE_SECTION1: {}})
+        config_parser = fakes.FakeConfigParser({fakes.FAKE_SECTION1: {},
+                                                fakes.FAKE_SECTION2: {}})
 
         mock_read_config = self.mock_object(
             yum_config, '_read_config_file',
@@ -227,6 +256,18 @@ class TestYumConfig(test_main.TestYumConfigBase):
         yum_config.update_all_sections(updates, fakes.FAKE_FILE_PATH)
 
         mock_read_config.assert_called_once_with(fakes.FAKE_FILE_PATH)
+        self.assertEqual(updates, config_parser[fakes.FAKE_SECTION1])
+        self.assertEqual(updates, config_parser[fakes.FAKE_SECTION2])
+        # all sections are flushed with a single write
+        atomic_write.assert_called_once_with(fakes.FAKE_FILE_PATH, '')
+
+    def test_render_config(self):
+        config = configparser.ConfigParser()
+        config.add_section(fakes.FAKE_SECTION1)
+        config.set(fakes.FAKE_SECTION1, 'key1', 'value1')
+
+        self.assertEqual('[fake_section1]\nkey1=value1\n\n',
+                         yum_cfg.render_config(config))
 
     def test_source_env_file(self):
         p_open_mock = mock.Mock()
@@ -325,9 +366,9 @@ class TestYumRepoConfig(test_main.TestYumConfigBase):
                                             expected_updates,
                                             file_path=fakes.FAKE_FILE_PATH)
 
-    @mock.patch('builtins.open')
+    @mock.patch('repo_setup.utils.atomic_write')
     @ddt.data(None, fakes.FAKE_REPO_DOWN_URL)
-    def test_add_or_update_section(self, open, down_url):
+    def test_add_or_update_section(self, atomic_write, down_url):
         mock_update = self.mock_object(
             self.config_obj, 'update_section',
             mock.Mock(side_effect=exc.YumConfigNotFound(
@@ -436,12 +477,214 @@ class TestYumRepoConfig(test_main.TestYumConfigBase):
             create_if_not_exists=True)
 
 
+class TestYumRepoConfigBatch(test_main.TestYumConfigBase):
+    """Tests for YumRepoConfig batch updates on real files."""
+
+    def setUp(self):
+        super(TestYumRepoConfigBatch, self).setUp()
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        self.repo_file = os.path.join(self.dir_path, 'fake.repo')
+        with open(self.repo_file, 'w') as f:
+            f.write('[fake_section1]\nname=fake1\nenabled=0\n\n'
+                    '[fake_section2]\nname=fake2\nenabled=1\n')
+        self.config_obj = yum_cfg.YumRepoConfig(dir_path=self.dir_path)
+
+    def _read(self, file_path):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+        return config
+
+    def test_apply_batch(self):
+        new_file = os.path.join(self.dir_path, 'new.repo')
+        mock_save = self.mock_object(yum_cfg, 'save_config_to_file',
+                                     mock.Mock(wraps=yum_cfg.save_config_to_file))
+
+        written = self.config_obj.apply_batch([
+            {'name': fakes.FAKE_SECTION1, 'enabled': True},
+            {'name': fakes.FAKE_SECTION2, 'enabled': False,
+             'set_opts': {'priority': '1'}},
+            {'name': 'new_section', 'file_path': new_file,
+             'set_opts': {'baseurl': 'http://fake/url'}},
+        ])
+
+        self.assertEqual([self.repo_file, new_file], written)
+        self.assertEqual(2, mock_save.call_count)
+        config = self._read(self.repo_file)
+        self.assertEqual('1', config.get(fakes.FAKE_SECTION1, 'enabled'))
+        self.assertEqual('0', config.get(fakes.FAKE_SECTION2, 'enabled'))
+        self.assertEqual('1', config.get(fakes.FAKE_SECTION2, 'priority'))
+        config = self._read(new_file)
+        self.assertEqual('new_section', config.get('new_section', 'name'))
+        self.assertEqual('http://fake/url',
+                         config.get('new_section', 'baseurl'))
+
+    def test_apply_batch_section_added_in_batch(self):
+        self.config_obj.apply_batch([
+            {'name': 'new_section', 'file_path': self.repo_file},
+            {'name': 'new_section', 'enabled': False},
+        ])
+
+        config = self._read(self.repo_file)
+        self.assertEqual('0', config.get('new_section', 'enabled'))
+
+    def test_apply_batch_invalid_entry_writes_nothing(self):
+        mock_save = self.mock_object(yum_cfg, 'save_config_to_file')
+
+        self.assertRaises(exc.YumConfigInvalidOption,
+                          self.config_obj.apply_batch,
+                          [{'name': fakes.FAKE_SECTION1, 'enabled': True},
+                           {'name': fakes.FAKE_SECTION2,
+                            'set_opts': {'invalid': 'option'}}])
+        mock_save.assert_not_called()
+
+    def test_apply_batch_section_not_found(self):
+        self.assertRaises(exc.YumConfigNotFound,
+                          self.config_obj.apply_batch,
+                          [{'name': 'missing_section', 'enabled': True}])
+
+
+class TestYumConfigChanges(test_main.TestYumConfigBase):
+    """Tests for the change tracking and dry run mode on real files."""
+
+    CONTENT = ('# managed by hand\n'
+               '[fake_section1]\nname=fake1\nenabled=0\n\n'
+               '[fake_section2]\nname=fake2\nenabled=1\n')
+
+    def setUp(self):
+        super(TestYumConfigChanges, self).setUp()
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        self.repo_file = os.path.join(self.dir_path, 'fake.repo')
+        with open(self.repo_file, 'w') as f:
+            f.write(self.CONTENT)
+
+    def _content(self, file_path):
+        with open(file_path) as f:
+            return f.read()
+
+    def test_update_section_unchanged(self):
+        config_obj = yum_cfg.YumRepoConfig(dir_path=self.dir_path)
+        mock_save = self.mock_object(yum_cfg, 'save_config_to_file')
+
+        config_obj.update_section(fakes.FAKE_SECTION1, enabled=False)
+        self.assertEqual([], config_obj.apply_batch(
+            [{'name': fakes.FAKE_SECTION2, 'enabled': True,
+              'set_opts': {'name': 'fake2'}}]))
+
+        self.assertFalse(config_obj.changed)
+        mock_save.assert_not_called()
+        self.assertEqual(self.CONTENT, self._content(self.repo_file))
+
+    def test_update_section_changed(self):
+        config_obj = yum_cfg.YumRepoConfig(dir_path=self.dir_path)
+
+        config_obj.update_section(fakes.FAKE_SECTION1, enabled=True)
+        config_obj.update_section(fakes.FAKE_SECTION2,
+                                  set_dict={'priority': '1'})
+
+        self.assertTrue(config_obj.changed)
+        change = config_obj.changes[self.repo_file]
+        self.assertEqual([fakes.FAKE_SECTION1, fakes.FAKE_SECTION2],
+                         change.sections)
+        self.assertEqual(self.CONTENT, change.before)
+        self.assertEqual(self._content(self.repo_file), change.after)
+        self.assertIn('priority=1', change.after)
+
+    def test_update_section_skips_unparsable_file(self):
+        broken_file = os.path.join(self.dir_path, 'broken.repo')
+        broken = 'not an ini file\n[fake_section1]\nenabled=0\n'
+        with open(broken_file, 'w') as f:
+            f.write(broken)
+        config_obj = yum_cfg.YumRepoConfig(dir_path=self.dir_path)
+
+        config_obj.update_section(fakes.FAKE_SECTION1, enabled=True)
+
+        self.assertEqual([self.repo_file], list(config_obj.changes))
+        self.assertEqual(broken, self._content(broken_file))
+
+    def test_dry_run(self):
+        new_file = os.path.join(self.dir_path, 'new.repo')
+        config_obj = yum_cfg.YumRepoConfig(dir_path=self.dir_path,
+                                           dry_run=True)
+        mock_write = self.mock_object(repos_utils, 'atomic_write')
+
+        config_obj.update_section(fakes.FAKE_SECTION1, enabled=True)
+        config_obj.add_or_update_section('new_section',
+                                         set_dict={'baseurl': 'http://fake'},
+                                         file_path=new_file)
+        # later updates see the files changed in memory
+        config_obj.update_section('new_section', enabled=False)
+
+        mock_write.assert_not_called()
+        self.assertEqual(self.CONTENT, self._content(self.repo_file))
+        self.assertFalse(os.path.exists(new_file))
+        self.assertEqual([self.repo_file, new_file], list(config_obj.changes))
+        change = config_obj.changes[new_file]
+        self.assertIsNone(change.before)
+        self.assertEqual(['new_section'], change.sections)
+        self.assertIn('enabled=0', change.after)
+        self.assertIn('enabled=1',
+                      config_obj.changes[self.repo_file].after)
+
+    def test_dry_run_content_is_text(self):
+        # the dry run content is read back through io.StringIO, which
+        # only takes unicode on python2
+        new_file = os.path.join(self.dir_path, 'new.repo')
+        config_obj = yum_cfg.YumRepoConfig(dir_path=self.dir_path,
+                                           dry_run=True)
+
+        config_obj.add_or_update_section('new_section',
+                                         set_dict={'baseurl': 'http://fake'},
+                                         file_path=new_file)
+        config_obj.add_or_update_section('new_section',
+                                         set_dict={'priority': '1'},
+                                         file_path=new_file)
+
+        after = config_obj.changes[new_file].after
+        self.assertIsInstance(after, type(u''))
+        self.assertIn(u'baseurl=http://fake', after)
+        self.assertIn(u'priority=1', after)
+        config = yum_cfg.cfg_parser.RawConfigParser()
+        yum_cfg.read_config_string(config, after)
+        self.assertEqual('1', config.get('new_section', 'priority'))
+
+    def test_dry_run_global_config(self):
+        conf_file = os.path.join(self.dir_path, 'dnf.conf')
+        with open(conf_file, 'w') as f:
+            f.write('[main]\nkeepcache=0\n')
+        config_obj = yum_cfg.YumGlobalConfig(file_path=conf_file,
+                                             dry_run=True)
+
+        config_obj.update_section('main', {'keepcache': '0'})
+        self.assertFalse(config_obj.changed)
+        config_obj.update_section('main', {'keepcache': '1'})
+
+        self.assertEqual('[main]\nkeepcache=0\n', self._content(conf_file))
+        self.assertEqual(['main'], config_obj.changes[conf_file].sections)
+
+    def test_global_config_symlink(self):
+        # /etc/yum.conf is a link to dnf/dnf.conf on EL8 and later
+        os.mkdir(os.path.join(self.dir_path, 'dnf'))
+        dnf_conf = os.path.join(self.dir_path, 'dnf', 'dnf.conf')
+        with open(dnf_conf, 'w') as f:
+            f.write('[main]\nkeepcache=0\n')
+        yum_conf = os.path.join(self.dir_path, 'yum.conf')
+        os.symlink('dnf/dnf.conf', yum_conf)
+        config_obj = yum_cfg.YumGlobalConfig(file_path=yum_conf)
+
+        config_obj.update_section('main', {'keepcache': '1'})
+
+        self.assertTrue(os.path.islink(yum_conf))
+        self.assertIn('keepcache=1', self._content(dnf_conf))
+
+
 @ddt.ddt
 class TestYumGlobalConfig(test_main.TestYumConfigBase):
     """Tests for YumGlobalConfig class and its methods."""
 
-    @mock.patch('builtins.open')
-    def test_create_yum_global_config_create_yum_conf(self, open):
+    @mock.patch('repo_setup.utils.atomic_write')
+    def test_create_yum_global_config_create_yum_conf(self, atomic_write):
         self.mock_object(os, 'access')
         self.mock_object(os.path, 'isdir')
         self.mock_object(os.path, 'isfile',
@@ -460,3 +703,5 @@ class TestYumGlobalConfig(test_main.TestYumConfigBase):
         mock_read.assert_called_once_with(const.YUM_GLOBAL_CONFIG_FILE_PATH)
         mock_add.assert_called_once_with('main')
         mock_write.assert_called_once()
+        atomic_write.assert_called_once_with(
+            const.YUM_GLOBAL_CONFIG_FILE_PATH, mock.ANY)